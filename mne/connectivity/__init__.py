@@ -2,5 +2,5 @@
 
 from .utils import seed_target_indices, degree
 from .spectral import spectral_connectivity
-from .effective import phase_slope_index
+from .effective import phase_slope_index, mvar_connectivity
 from .envelope import envelope_correlation
@@ -3,10 +3,16 @@
 # License: BSD (3-clause)
 
 import copy
+from itertools import islice
 
 import numpy as np
 
-from ..utils import logger, verbose
+from ..epochs import BaseEpochs
+from ..fixes import rfft, rfftfreq
+from ..source_estimate import _BaseSourceEstimate
+from ..time_frequency.ar import (_mvar_lagged_products, _mvar_solve,
+                                 _MVAR_BLOCK_SIZE)
+from ..utils import logger, verbose, _check_option, _validate_type, _pl
 from .spectral import spectral_connectivity
 
 
@@ -158,3 +164,218 @@ def phase_slope_index(data, indices=None, sfreq=2 * np.pi,
     logger.info('[PSI Estimation Done]')
 
     return psi, freqs, times, n_epochs, n_tapers
+
+
+def _mvar_transfer(coef, n_fft, freq_mask):
+    """Compute the MVAR coefficient spectra and transfer functions.
+
+    Returns A(f) = I - sum_k A_k exp(-2j pi f k / sfreq) and H(f) = A(f)^-1,
+    both with shape (n_models, n_freqs, n_sub, n_sub).
+    """
+    n_models, order, n_sub = coef.shape[:3]
+    a_f = np.zeros((n_models, order + 1, n_sub, n_sub))
+    a_f[:, 0] = np.eye(n_sub)
+    a_f[:, 1:] = -coef
+    a_f = rfft(a_f, n=n_fft, axis=1)[:, freq_mask]
+    return a_f, np.linalg.inv(a_f)
+
+
+@verbose
+def mvar_connectivity(data, method='pdc', indices=None, sfreq=2 * np.pi,
+                      order=5, fit_method='ls', fmin=0., fmax=np.inf,
+                      n_fft=None, verbose=None):
+    """Compute directed connectivity from multivariate autoregressive models.
+
+    A multivariate autoregressive (MVAR) model
+    ``x(t) = sum_k A_k x(t - k) + e(t)`` is fitted to all epochs at once
+    and the directed connectivity measures are derived from its spectral
+    representation ``A(f) = I - sum_k A_k exp(-2j pi f k / sfreq)`` and its
+    transfer function ``H(f) = A(f)^-1``.
+
+    Parameters
+    ----------
+    data : array-like, shape=(n_epochs, n_signals, n_times) | Epochs
+        The data from which to compute connectivity. Can also be a
+        list/generator of array, shape =(n_signals, n_times), or of
+        SourceEstimate, which is consumed lazily. Each epoch is demeaned
+        before fitting.
+    method : str | list of str
+        Connectivity measure(s) to compute. Supported measures:
+
+            'gc' : Pairwise spectral Granger causality [1]_, computed from
+            one bivariate model per pair of signals.
+
+            'pdc' : Partial directed coherence [2]_.
+
+            'dtf' : Directed transfer function [3]_.
+
+        PDC and DTF are computed from a single model of all signals.
+    indices : tuple of array | None
+        Two arrays ``(seeds, targets)`` with the indices of the connections
+        for which to compute the connectivity from ``seeds[k]`` to
+        ``targets[k]``. If None, all connections are computed.
+    sfreq : float
+        The sampling frequency.
+    order : int
+        The model order, i.e., the number of lags.
+    fit_method : str
+        How the model is fitted. Can be ``'ls'`` (default) for ordinary
+        least squares or ``'yw'`` for the multivariate Yule-Walker
+        equations.
+    fmin : float
+        The lower frequency of interest.
+    fmax : float
+        The upper frequency of interest.
+    n_fft : int | None
+        The FFT length used to evaluate the model spectra, which sets the
+        frequency resolution. If None, the number of time points of the
+        epochs is used.
+    %(verbose)s
+
+    Returns
+    -------
+    con : array | list of array
+        Computed connectivity measure(s). The shape of each array is either
+        (n_signals, n_signals, n_freqs), with ``con[i, j]`` the connectivity
+        from signal ``i`` to signal ``j`` (and zeros on the diagonal), when
+        "indices" is None, or (n_con, n_freqs) when "indices" is specified
+        and "n_con = len(indices[0])".
+    freqs : array
+        Frequency points at which the connectivity was computed.
+
+    Notes
+    -----
+    The lagged cross-products of the signals are accumulated once, a few
+    epochs at a time, and all models (e.g., the bivariate models of all
+    pairs for ``'gc'``) are then obtained by solving their normal
+    equations in a single batch. The model spectra are evaluated with a
+    real FFT of the coefficients.
+
+    .. versionadded:: 0.23
+
+    References
+    ----------
+    .. [1] Ding et al. "Granger Causality: Basic Theory and Application to
+           Neuroscience", Handbook of Time Series Analysis, Wiley, 2006.
+    .. [2] Baccala and Sameshima. "Partial directed coherence: a new concept
+           in neural structure determination", Biological Cybernetics,
+           vol. 84, no. 6, pp. 463-474, 2001.
+    .. [3] Kaminski and Blinowska. "A new method of the description of the
+           information flow in the brain structures", Biological
+           Cybernetics, vol. 65, no. 3, pp. 203-210, 1991.
+    """
+    if not isinstance(method, (list, tuple)):
+        method = [method]
+    for this_method in method:
+        _check_option('method', this_method, ('gc', 'pdc', 'dtf'))
+    _check_option('fit_method', fit_method, ('ls', 'yw'))
+    _validate_type(order, 'int-like', 'order')
+    order = int(order)
+    if order < 1:
+        raise ValueError('order must be at least 1, got %d' % (order,))
+    if isinstance(data, BaseEpochs):
+        sfreq = data.info['sfreq']
+
+    # accumulate the lagged cross-products, a block of epochs at a time
+    logger.info('Fitting MVAR model(s) of order %d...' % (order,))
+    stats = None
+    n_epochs = 0
+    data = iter(data)
+    n_block = 1
+    while True:
+        epoch_block = list(islice(data, n_block))
+        if len(epoch_block) == 0:
+            break
+        for bi, epoch_data in enumerate(epoch_block):
+            if isinstance(epoch_data, _BaseSourceEstimate):
+                epoch_data = epoch_data.data
+            epoch_data = np.asarray(epoch_data, dtype=np.float64)
+            if epoch_data.ndim != 2:
+                raise ValueError('Each entry in data must be 2D, got shape %s'
+                                 % (epoch_data.shape,))
+            if stats is None and bi == 0:
+                n_signals, n_times = epoch_data.shape
+            elif epoch_data.shape != (n_signals, n_times):
+                raise ValueError('All epochs must have the same shape, got '
+                                 '%s and %s' % ((n_signals, n_times),
+                                                epoch_data.shape))
+            epoch_block[bi] = epoch_data
+        this_stats = _mvar_lagged_products(np.array(epoch_block), order,
+                                           fit_method)
+        if stats is None:
+            stats = list(this_stats)
+        else:
+            for si, stat in enumerate(this_stats):
+                stats[si] += stat
+        n_epochs += len(epoch_block)
+        n_block = int(max(_MVAR_BLOCK_SIZE // (8 * order * n_signals *
+                                               n_times), 1))
+    if stats is None:
+        raise ValueError('No epochs found in data')
+    logger.info('    using %d epoch%s' % (n_epochs, _pl(n_epochs)))
+
+    if indices is None:
+        seeds, targets = np.where(~np.eye(n_signals, dtype=bool))
+    else:
+        seeds, targets = (np.asarray(ind, int) for ind in indices)
+        if len(seeds) != len(targets):
+            raise ValueError('indices must contain two arrays of the same '
+                             'length')
+    if n_fft is None:
+        n_fft = n_times
+    freqs = rfftfreq(n_fft, 1. / sfreq)
+    freq_mask = (freqs >= fmin) & (freqs <= fmax)
+    if not freq_mask.any():
+        raise ValueError('There are no frequency points between %0.1fHz and '
+                         '%0.1fHz' % (fmin, fmax))
+    freqs = freqs[freq_mask]
+
+    con = list()
+    full = None
+    for this_method in method:
+        logger.info('    computing %s' % (this_method.upper(),))
+        if this_method == 'gc':
+            # bivariate models of each (target, seed) pair; each model gives
+            # both directions, so fit the unique pairs only
+            pairs = np.sort(np.array([targets, seeds]).T, axis=1)
+            pairs, pair_idx = np.unique(pairs, axis=0, return_inverse=True)
+            coef, sigma = _mvar_solve(*stats, order=order, sig_idx=pairs)
+            _, h_f = _mvar_transfer(coef, n_fft, freq_mask)
+            # the signal with the smaller index is the first of each model
+            tgt = (targets > seeds).astype(int)
+            src = 1 - tgt
+            pair_idx = pair_idx.ravel()
+            h_f = h_f[pair_idx]
+            sigma = sigma[pair_idx]
+            n_con = len(pair_idx)
+            con_idx = np.arange(n_con)
+            s_f = np.matmul(np.matmul(h_f, sigma[:, np.newaxis]),
+                            h_f.conj().transpose(0, 1, 3, 2))
+            s_tt = s_f[con_idx, :, tgt, tgt].real
+            sigma_part = (sigma[con_idx, src, src] -
+                          sigma[con_idx, tgt, src] ** 2 /
+                          sigma[con_idx, tgt, tgt])
+            h_ts = np.abs(h_f[con_idx, :, tgt, src]) ** 2
+            this_con = np.log(s_tt / (s_tt - sigma_part[:, np.newaxis] * h_ts))
+        else:
+            if full is None:
+                coef, _ = _mvar_solve(*stats, order=order)
+                full = [f[0] for f in _mvar_transfer(coef, n_fft, freq_mask)]
+            # matrices are (n_freqs, target, seed)
+            if this_method == 'pdc':
+                mat = np.abs(full[0])
+                mat /= np.linalg.norm(mat, axis=-2, keepdims=True)
+            else:  # this_method == 'dtf'
+                mat = np.abs(full[1])
+                mat /= np.linalg.norm(mat, axis=-1, keepdims=True)
+            this_con = mat[:, targets, seeds].T
+        if indices is None:
+            con_mat = np.zeros((n_signals, n_signals, len(freqs)))
+            con_mat[seeds, targets] = this_con
+            this_con = con_mat
+        con.append(this_con)
+    logger.info('[MVAR Connectivity Estimation Done]')
+
+    if len(method) == 1:
+        con = con[0]
+    return con, freqs
@@ -4,16 +4,22 @@
 #
 # License: BSD (3-clause)
 
+from itertools import islice
+
 import numpy as np
 
 from ..filter import next_fast_len
+from ..parallel import parallel_func
 from ..source_estimate import _BaseSourceEstimate
 from ..utils import verbose, _check_combine, _check_option
 
+# bytes of orthogonalized envelopes computed at once (for a block of seeds)
+_ORTH_BLOCK_SIZE = 10e6
+
 
 @verbose
 def envelope_correlation(data, combine='mean', orthogonalize="pairwise",
-                         log=False, absolute=True, verbose=None):
+                         log=False, absolute=True, n_jobs=1, verbose=None):
     """Compute the envelope correlation.
 
     Parameters
@@ -22,12 +28,15 @@ def envelope_correlation(data, combine='mean', orthogonalize="pairwise",
         The data from which to compute connectivity.
         The array-like object can also be a list/generator of array,
         each with shape (n_signals, n_times), or a :class:`~mne.SourceEstimate`
-        object (and ``stc.data`` will be used). If it's float data,
+        object (and ``stc.data`` will be used). Generators are consumed
+        lazily, ``n_jobs`` epochs at a time. If it's float data,
         the Hilbert transform will be applied; if it's complex data,
         it's assumed the Hilbert has already been applied.
     combine : 'mean' | callable | None
         How to combine correlation estimates across epochs.
-        Default is 'mean'. Can be None to return without combining.
+        Default is 'mean', which is computed as a running mean so that only
+        one correlation matrix is kept in memory.
+        Can be None to return without combining.
         If callable, it must accept one positional input.
         For example::
 
@@ -52,6 +61,10 @@ def envelope_correlation(data, combine='mean', orthogonalize="pairwise",
         Only used when ``orthogonalize=True``.
 
         .. versionadded:: 0.22
+    n_jobs : int
+        The number of epochs to process in parallel (using threads).
+
+        .. versionadded:: 0.23
     %(verbose)s
 
     Returns
@@ -80,78 +93,119 @@ def envelope_correlation(data, combine='mean', orthogonalize="pairwise",
            Neuroimage 174:57–68
     """
     _check_option('orthogonalize', orthogonalize, (False, 'pairwise'))
-    from scipy.signal import hilbert
     n_nodes = None
     if combine is not None:
         fun = _check_combine(combine, valid=('mean',))
     else:  # None
         fun = np.array
 
+    # The orthogonalization of a block of seeds is vectorized, which spends
+    # little time holding the GIL, so threads avoid copying the data
+    parallel, p_fun, n_jobs = parallel_func(
+        _epoch_envelope_correlation, n_jobs, prefer='threads', verbose=False)
     corrs = list()
-    # Note: This is embarassingly parallel, but the overhead of sending
-    # the data to different workers is roughly the same as the gain of
-    # using multiple CPUs. And we require too much GIL for prefer='threading'
-    # to help.
-    for ei, epoch_data in enumerate(data):
-        if isinstance(epoch_data, _BaseSourceEstimate):
-            epoch_data = epoch_data.data
-        if epoch_data.ndim != 2:
-            raise ValueError('Each entry in data must be 2D, got shape %s'
-                             % (epoch_data.shape,))
-        n_nodes, n_times = epoch_data.shape
-        if ei > 0 and n_nodes != corrs[0].shape[0]:
-            raise ValueError('n_nodes mismatch between data[0] and data[%d], '
-                             'got %s and %s'
-                             % (ei, n_nodes, corrs[0].shape[0]))
-        # Get the complex envelope (allowing complex inputs allows people
-        # to do raw.apply_hilbert if they want)
-        if epoch_data.dtype in (np.float32, np.float64):
-            n_fft = next_fast_len(n_times)
-            epoch_data = hilbert(epoch_data, N=n_fft, axis=-1)[..., :n_times]
-
-        if epoch_data.dtype not in (np.complex64, np.complex128):
-            raise ValueError('data.dtype must be float or complex, got %s'
-                             % (epoch_data.dtype,))
-        data_mag = np.abs(epoch_data)
-        data_conj_scaled = epoch_data.conj()
-        data_conj_scaled /= data_mag
-        if log:
-            data_mag *= data_mag
-            np.log(data_mag, out=data_mag)
-        # subtract means
-        data_mag_nomean = data_mag - np.mean(data_mag, axis=-1, keepdims=True)
-        # compute variances using linalg.norm (square, sum, sqrt) since mean=0
-        data_mag_std = np.linalg.norm(data_mag_nomean, axis=-1)
-        data_mag_std[data_mag_std == 0] = 1
-        corr = np.empty((n_nodes, n_nodes))
-        for li, label_data in enumerate(epoch_data):
-            if orthogonalize is False:  # the new code
-                label_data_orth = data_mag[li]
-                label_data_orth_std = data_mag_std[li]
+    corr_sum = None
+    n_epochs = 0
+    data = iter(data)
+    while True:
+        epoch_block = list(islice(data, n_jobs))
+        if len(epoch_block) == 0:
+            break
+        for bi, epoch_data in enumerate(epoch_block):
+            if isinstance(epoch_data, _BaseSourceEstimate):
+                epoch_data = epoch_data.data
+            if epoch_data.ndim != 2:
+                raise ValueError('Each entry in data must be 2D, got shape %s'
+                                 % (epoch_data.shape,))
+            if n_nodes is None:
+                n_nodes = epoch_data.shape[0]
+            elif epoch_data.shape[0] != n_nodes:
+                raise ValueError('n_nodes mismatch between data[0] and '
+                                 'data[%d], got %s and %s'
+                                 % (n_epochs + bi, epoch_data.shape[0],
+                                    n_nodes))
+            if epoch_data.dtype not in (np.float32, np.float64,
+                                        np.complex64, np.complex128):
+                raise ValueError('data.dtype must be float or complex, got %s'
+                                 % (epoch_data.dtype,))
+            epoch_block[bi] = epoch_data
+        for corr in parallel(p_fun(epoch_data, orthogonalize, log, absolute)
+                             for epoch_data in epoch_block):
+            if combine == 'mean':
+                if corr_sum is None:
+                    corr_sum = corr
+                else:
+                    corr_sum += corr
             else:
-                label_data_orth = (label_data * data_conj_scaled).imag
-                np.abs(label_data_orth, out=label_data_orth)
-                # protect against invalid value -- this will be zero
-                # after (log and) mean subtraction
-                label_data_orth[li] = 1.
-                if log:
-                    label_data_orth *= label_data_orth
-                    np.log(label_data_orth, out=label_data_orth)
-                label_data_orth -= np.mean(label_data_orth, axis=-1,
-                                           keepdims=True)
-                label_data_orth_std = np.linalg.norm(label_data_orth, axis=-1)
-                label_data_orth_std[label_data_orth_std == 0] = 1
-            # correlation is dot product divided by variances
-            corr[li] = np.sum(label_data_orth * data_mag_nomean, axis=1)
-            corr[li] /= data_mag_std
-            corr[li] /= label_data_orth_std
-        if orthogonalize is not False:
-            # Make it symmetric (it isn't at this point)
-            if absolute:
-                corr = np.abs(corr)
-            corr = (corr.T + corr) / 2.
-        corrs.append(corr)
-        del corr
+                corrs.append(corr)
+        n_epochs += len(epoch_block)
 
+    if corr_sum is not None:
+        corr_sum /= n_epochs
+        return corr_sum
     corr = fun(corrs)
     return corr
+
+
+def _epoch_envelope_correlation(epoch_data, orthogonalize, log, absolute):
+    """Compute the envelope correlation of one epoch."""
+    from scipy.signal import hilbert
+    n_nodes, n_times = epoch_data.shape
+    # Get the complex envelope (allowing complex inputs allows people
+    # to do raw.apply_hilbert if they want)
+    if epoch_data.dtype in (np.float32, np.float64):
+        n_fft = next_fast_len(n_times)
+        epoch_data = hilbert(epoch_data, N=n_fft, axis=-1)[..., :n_times]
+    data_mag = np.abs(epoch_data)
+    data_conj_scaled = epoch_data.conj()
+    data_conj_scaled /= data_mag
+    if log:
+        data_mag *= data_mag
+        np.log(data_mag, out=data_mag)
+    # subtract means
+    data_mag_nomean = data_mag - np.mean(data_mag, axis=-1, keepdims=True)
+    # compute variances using linalg.norm (square, sum, sqrt) since mean=0
+    data_mag_std = np.linalg.norm(data_mag_nomean, axis=-1)
+    data_mag_std[data_mag_std == 0] = 1
+    if orthogonalize is False:  # the new code
+        # correlation is dot product divided by variances
+        corr = np.dot(data_mag_nomean, data_mag_nomean.T)
+        corr /= data_mag_std
+        corr /= data_mag_std[:, np.newaxis]
+        return corr
+
+    corr = np.empty((n_nodes, n_nodes))
+    n_block = max(int(_ORTH_BLOCK_SIZE // (8 * n_nodes * n_times)), 1)
+    for start in range(0, n_nodes, n_block):
+        seeds = np.arange(start, min(start + n_block, n_nodes))
+        # orthogonalize each seed with respect to all nodes at once:
+        # imag(seed * conj(node) / |node|), shape (n_seeds, n_nodes, n_times)
+        seed_data = epoch_data[seeds, np.newaxis]
+        label_data_orth = seed_data.real * data_conj_scaled.imag
+        label_data_orth += seed_data.imag * data_conj_scaled.real
+        del seed_data
+        np.abs(label_data_orth, out=label_data_orth)
+        # protect against invalid value -- this will be zero
+        # after (log and) mean subtraction
+        label_data_orth[np.arange(len(seeds)), seeds] = 1.
+        if log:
+            label_data_orth *= label_data_orth
+            np.log(label_data_orth, out=label_data_orth)
+        # correlation is dot product divided by variances, where (as
+        # data_mag_nomean has zero mean) the mean of the orthogonalized
+        # envelopes only needs to be removed from their variances
+        this_corr = np.einsum('snt,nt->sn', label_data_orth, data_mag_nomean)
+        label_data_orth_std = np.einsum('snt,snt->sn', label_data_orth,
+                                        label_data_orth)
+        label_data_orth_std -= label_data_orth.sum(axis=-1) ** 2 / n_times
+        np.sqrt(np.maximum(label_data_orth_std, 0), out=label_data_orth_std)
+        label_data_orth_std[label_data_orth_std == 0] = 1
+        this_corr /= data_mag_std
+        this_corr /= label_data_orth_std
+        corr[seeds] = this_corr
+    corr.flat[::n_nodes + 1] = 0.
+    # Make it symmetric (it isn't at this point)
+    if absolute:
+        corr = np.abs(corr)
+    corr = (corr.T + corr) / 2.
+    return corr
@@ -17,7 +17,7 @@ from ..epochs import BaseEpochs
 from ..time_frequency.multitaper import (_mt_spectra, _compute_mt_params,
                                          _psd_from_mt, _csd_from_mt,
                                          _psd_from_mt_adaptive)
-from ..time_frequency.tfr import morlet, cwt
+from ..time_frequency.tfr import morlet, cwt, _check_decim
 from ..utils import logger, verbose, _time_mask, warn
 
 ########################################################################
@@ -224,16 +224,16 @@ class _WPLIEst(_EpochMeanConEstBase):
     def accumulate(self, con_idx, csd_xy):
         """Accumulate some connections."""
         im_csd = np.imag(csd_xy)
-        self._acc[0, con_idx] += im_csd
-        self._acc[1, con_idx] += np.abs(im_csd)
+        self._acc[0][con_idx] += im_csd
+        self._acc[1][con_idx] += np.abs(im_csd)
 
     def compute_con(self, con_idx, n_epochs):
         """Compute final con. score for some connections."""
         if self.con_scores is None:
             self.con_scores = np.zeros(self.csd_shape)
 
-        num = np.abs(self._acc[0, con_idx])
-        denom = self._acc[1, con_idx]
+        num = np.abs(self._acc[0][con_idx])
+        denom = self._acc[1][con_idx]
 
         # handle zeros in denominator
         z_denom = np.where(denom == 0.)
@@ -261,9 +261,9 @@ class _WPLIDebiasedEst(_EpochMeanConEstBase):
     def accumulate(self, con_idx, csd_xy):
         """Accumulate some connections."""
         im_csd = np.imag(csd_xy)
-        self._acc[0, con_idx] += im_csd
-        self._acc[1, con_idx] += np.abs(im_csd)
-        self._acc[2, con_idx] += im_csd ** 2
+        self._acc[0][con_idx] += im_csd
+        self._acc[1][con_idx] += np.abs(im_csd)
+        self._acc[2][con_idx] += im_csd ** 2
 
     def compute_con(self, con_idx, n_epochs):
         """Compute final con. score for some connections."""
@@ -272,9 +272,9 @@ class _WPLIDebiasedEst(_EpochMeanConEstBase):
 
         # note: we use the trick from fieldtrip to compute the
         # the estimate over all pairwise epoch combinations
-        sum_im_csd = self._acc[0, con_idx]
-        sum_abs_im_csd = self._acc[1, con_idx]
-        sum_sq_im_csd = self._acc[2, con_idx]
+        sum_im_csd = self._acc[0][con_idx]
+        sum_abs_im_csd = self._acc[1][con_idx]
+        sum_sq_im_csd = self._acc[2][con_idx]
 
         denom = sum_abs_im_csd ** 2 - sum_sq_im_csd
 
@@ -325,17 +325,35 @@ class _PPCEst(_EpochMeanConEstBase):
 
 
 ###############################################################################
+# bytes of wavelet coefficients and cross-spectra computed at once
+_CWT_BLOCK_SIZE = 50e6
+
+
+def _get_dense_block(idx_0, idx_1):
+    """Get the unique rows and columns of a block of connections.
+
+    Returns None if the connections are too sparse for computing all
+    cross-spectra between the rows and columns to be worthwhile.
+    """
+    rows, row_idx = np.unique(idx_0, return_inverse=True)
+    cols, col_idx = np.unique(idx_1, return_inverse=True)
+    if len(rows) * len(cols) > 2 * len(idx_0):
+        return None
+    return rows, row_idx, cols, col_idx
+
+
 def _epoch_spectral_connectivity(data, sig_idx, tmin_idx, tmax_idx, sfreq,
                                  mode, window_fun, eigvals, wavelets,
                                  freq_mask, mt_adaptive, idx_map, block_size,
                                  psd, accumulate_psd, con_method_types,
-                                 con_methods, n_signals, n_times,
+                                 con_methods, n_signals, n_times, decim=None,
                                  accumulate_inplace=True):
     """Estimate connectivity for one epoch (see spectral_connectivity)."""
     n_cons = len(idx_map[0])
 
     if wavelets is not None:
-        n_times_spectrum = n_times
+        decim = slice(None) if decim is None else decim
+        n_times_spectrum = len(range(n_times)[decim])
         n_freqs = len(wavelets)
     else:
         n_times_spectrum = 0
@@ -347,55 +365,50 @@ def _epoch_spectral_connectivity(data, sig_idx, tmin_idx, tmax_idx, sfreq,
                        for mtype in con_method_types]
 
     _check_option('mode', mode, ('cwt_morlet', 'multitaper', 'fourier'))
-    if len(sig_idx) == n_signals:
+    n_sig = len(sig_idx)
+    if n_sig == n_signals:
         # we use all signals: use a slice for faster indexing
         sig_idx = slice(None, None)
 
+    if mode == 'cwt_morlet':
+        return _epoch_cwt_connectivity(
+            data, sig_idx, n_sig, tmin_idx, tmax_idx, wavelets, decim,
+            idx_map, block_size, psd, accumulate_psd, con_method_types,
+            con_methods, n_freqs, n_times_spectrum, accumulate_inplace)
+
     # compute tapered spectra
     x_t = list()
     this_psd = list()
     for this_data in data:
-        if mode in ('multitaper', 'fourier'):
-            if isinstance(this_data, _BaseSourceEstimate):
-                _mt_spectra_partial = partial(_mt_spectra, dpss=window_fun,
-                                              sfreq=sfreq)
-                this_x_t = this_data.transform_data(
-                    _mt_spectra_partial, idx=sig_idx, tmin_idx=tmin_idx,
-                    tmax_idx=tmax_idx)
-            else:
-                this_x_t, _ = _mt_spectra(
-                    this_data[sig_idx, tmin_idx:tmax_idx],
-                    window_fun, sfreq)
+        if isinstance(this_data, _BaseSourceEstimate):
+            _mt_spectra_partial = partial(_mt_spectra, dpss=window_fun,
+                                          sfreq=sfreq)
+            this_x_t = this_data.transform_data(
+                _mt_spectra_partial, idx=sig_idx, tmin_idx=tmin_idx,
+                tmax_idx=tmax_idx)
+        else:
+            this_x_t, _ = _mt_spectra(
+                this_data[sig_idx, tmin_idx:tmax_idx],
+                window_fun, sfreq)
 
-            if mt_adaptive:
-                # compute PSD and adaptive weights
-                _this_psd, weights = _psd_from_mt_adaptive(
-                    this_x_t, eigvals, freq_mask, return_weights=True)
+        if mt_adaptive:
+            # compute PSD and adaptive weights
+            _this_psd, weights = _psd_from_mt_adaptive(
+                this_x_t, eigvals, freq_mask, return_weights=True)
 
-                # only keep freqs of interest
-                this_x_t = this_x_t[:, :, freq_mask]
+            # only keep freqs of interest
+            this_x_t = this_x_t[:, :, freq_mask]
+        else:
+            # do not use adaptive weights
+            this_x_t = this_x_t[:, :, freq_mask]
+            if mode == 'multitaper':
+                weights = np.sqrt(eigvals)[np.newaxis, :, np.newaxis]
             else:
-                # do not use adaptive weights
-                this_x_t = this_x_t[:, :, freq_mask]
-                if mode == 'multitaper':
-                    weights = np.sqrt(eigvals)[np.newaxis, :, np.newaxis]
-                else:
-                    # hack to so we can sum over axis=-2
-                    weights = np.array([1.])[:, None, None]
+                # hack to so we can sum over axis=-2
+                weights = np.array([1.])[:, None, None]
 
-                if accumulate_psd:
-                    _this_psd = _psd_from_mt(this_x_t, weights)
-        else:  # mode == 'cwt_morlet'
-            if isinstance(this_data, _BaseSourceEstimate):
-                cwt_partial = partial(cwt, Ws=wavelets, use_fft=True,
-                                      mode='same')
-                this_x_t = this_data.transform_data(
-                    cwt_partial, idx=sig_idx, tmin_idx=tmin_idx,
-                    tmax_idx=tmax_idx)
-            else:
-                this_x_t = cwt(this_data[sig_idx, tmin_idx:tmax_idx],
-                               wavelets, use_fft=True, mode='same')
-            _this_psd = (this_x_t * this_x_t.conj()).real
+            if accumulate_psd:
+                _this_psd = _psd_from_mt(this_x_t, weights)
 
         x_t.append(this_x_t)
         if accumulate_psd:
@@ -419,31 +432,93 @@ def _epoch_spectral_connectivity(data, sig_idx, tmin_idx, tmax_idx, sfreq,
         method.start_epoch()
 
     # accumulate connectivity scores
-    if mode in ['multitaper', 'fourier']:
-        for i in range(0, n_cons, block_size):
-            con_idx = slice(i, i + block_size)
-            if mt_adaptive:
-                csd = _csd_from_mt(x_t[idx_map[0][con_idx]],
-                                   x_t[idx_map[1][con_idx]],
-                                   weights[idx_map[0][con_idx]],
-                                   weights[idx_map[1][con_idx]])
+    y_t = None
+    for i in range(0, n_cons, block_size):
+        con_idx = slice(i, i + block_size)
+        dense = _get_dense_block(idx_map[0][con_idx], idx_map[1][con_idx])
+        if dense is not None:
+            if y_t is None:
+                # scale the spectra so that the CSD of two signals is
+                # the sum over tapers of y_x * conj(y_y) (see
+                # _csd_from_mt), with shape (n_freqs, n_signals, n_tapers)
+                y_t = x_t * (weights * np.sqrt(2. / np.sum(
+                    weights * weights, axis=-2, keepdims=True)))
+                y_t = np.ascontiguousarray(y_t.transpose(2, 0, 1))
+            # all cross-spectra between the rows and columns of the block
+            rows, row_idx, cols, col_idx = dense
+            csd = np.matmul(y_t[:, rows],
+                            y_t[:, cols].conj().transpose(0, 2, 1))
+            csd = csd[:, row_idx, col_idx].T
+        elif mt_adaptive:
+            csd = _csd_from_mt(x_t[idx_map[0][con_idx]],
+                               x_t[idx_map[1][con_idx]],
+                               weights[idx_map[0][con_idx]],
+                               weights[idx_map[1][con_idx]])
+        else:
+            csd = _csd_from_mt(x_t[idx_map[0][con_idx]],
+                               x_t[idx_map[1][con_idx]],
+                               weights, weights)
+
+        for method in con_methods:
+            method.accumulate(con_idx, csd)
+
+    return con_methods, psd
+
+
+def _epoch_cwt_connectivity(data, sig_idx, n_sig, tmin_idx, tmax_idx,
+                            wavelets, decim, idx_map, block_size, psd,
+                            accumulate_psd, con_method_types, con_methods,
+                            n_freqs, n_times_spectrum, accumulate_inplace):
+    """Estimate time-resolved connectivity for one epoch using wavelets.
+
+    The wavelet coefficients are computed for a few frequencies at a time
+    and immediately accumulated, so that the complex coefficients of all
+    frequencies never have to be stored at once.
+    """
+    n_cons = len(idx_map[0])
+    if all(mtype in _CON_METHOD_MAP.values() for mtype in con_method_types):
+        # the built-in estimators accept (connections, frequencies) indices
+        n_items = max(n_sig, min(block_size, n_cons))
+        n_freq_block = _CWT_BLOCK_SIZE // (16 * n_items * n_times_spectrum)
+        n_freq_block = int(min(max(n_freq_block, 1), n_freqs))
+    else:
+        n_freq_block = n_freqs
+
+    if accumulate_psd and not accumulate_inplace:
+        psd = np.zeros((n_sig, n_freqs, n_times_spectrum))
+    elif not accumulate_psd:
+        psd = None
+
+    # tell the methods that a new epoch starts
+    for method in con_methods:
+        method.start_epoch()
+
+    for fi in range(0, n_freqs, n_freq_block):
+        freq_sl = slice(fi, fi + n_freq_block)
+        cwt_partial = partial(cwt, Ws=wavelets[freq_sl], use_fft=True,
+                              mode='same', decim=decim)
+        x_t = list()
+        for this_data in data:
+            if isinstance(this_data, _BaseSourceEstimate):
+                this_x_t = this_data.transform_data(
+                    cwt_partial, idx=sig_idx, tmin_idx=tmin_idx,
+                    tmax_idx=tmax_idx)
             else:
-                csd = _csd_from_mt(x_t[idx_map[0][con_idx]],
-                                   x_t[idx_map[1][con_idx]],
-                                   weights, weights)
+                this_x_t = cwt_partial(this_data[sig_idx, tmin_idx:tmax_idx])
+            x_t.append(this_x_t)
+        x_t = np.concatenate(x_t, axis=0)
+        if accumulate_psd:
+            psd[:, freq_sl] += (x_t * x_t.conj()).real
 
-            for method in con_methods:
-                method.accumulate(con_idx, csd)
-    else:  # mode == 'cwt_morlet'  # reminder to add alternative TFR methods
-        for i_block, i in enumerate(range(0, n_cons, block_size)):
+        # accumulate connectivity scores
+        for i in range(0, n_cons, block_size):
             con_idx = slice(i, i + block_size)
-            # this codes can be very slow
             csd = (x_t[idx_map[0][con_idx]] *
                    x_t[idx_map[1][con_idx]].conjugate())
-
+            if n_freq_block < n_freqs:
+                con_idx = (con_idx, freq_sl)
             for method in con_methods:
                 method.accumulate(con_idx, csd)
-                # future estimator types need to be explicitly handled here
 
     return con_methods, psd
 
@@ -551,8 +626,8 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
                           fskip=0, faverage=False, tmin=None, tmax=None,
                           mt_bandwidth=None, mt_adaptive=False,
                           mt_low_bias=True, cwt_freqs=None,
-                          cwt_n_cycles=7, block_size=1000, n_jobs=1,
-                          verbose=None):
+                          cwt_n_cycles=7, cwt_decim=1, block_size=1000,
+                          n_jobs=1, prefer='processes', verbose=None):
     """Compute frequency- and time-frequency-domain connectivity measures.
 
     The connectivity method(s) are specified using the "method" parameter.
@@ -618,11 +693,31 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
     cwt_n_cycles : float | array of float
         Number of cycles. Fixed number or one per frequency. Only used in
         'cwt_morlet' mode.
+    cwt_decim : int | slice
+        Decimation of the wavelet coefficients in time before the
+        connectivity is computed. If int, the coefficients are decimated
+        as ``[..., ::cwt_decim]``, if slice as ``[..., cwt_decim]``. The
+        returned ``times`` are decimated accordingly, which reduces the
+        memory and computation time required for long epochs. Only used in
+        'cwt_morlet' mode.
+
+        .. versionadded:: 0.23
     block_size : int
         How many connections to compute at once (higher numbers are faster
         but require more memory).
     n_jobs : int
         How many epochs to process in parallel.
+    prefer : str
+        How epochs are processed in parallel when ``n_jobs != 1``. Can be
+        ``'processes'`` (default), in which case each epoch is sent to a
+        worker process that returns its own connectivity estimators, or
+        ``'threads'``, in which case ``n_jobs`` threads share the tapers or
+        wavelets and each accumulates into its own estimators, which are
+        combined once at the end. Threads avoid copying the data and the
+        accumulators between processes, which dominates for large numbers
+        of connections.
+
+        .. versionadded:: 0.23
     %(verbose)s
 
     Returns
@@ -743,10 +838,13 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
            noise and sample-size bias" NeuroImage, vol. 55, no. 4,
            pp. 1548-1565, Apr. 2011.
     """
+    _check_option('prefer', prefer, ('processes', 'threads'))
+    cwt_decim = _check_decim(cwt_decim)
     if n_jobs != 1:
-        parallel, my_epoch_spectral_connectivity, _ = \
+        parallel, my_epoch_spectral_connectivity, n_jobs = \
             parallel_func(_epoch_spectral_connectivity, n_jobs,
-                          verbose=verbose)
+                          prefer=prefer, verbose=verbose)
+    use_threads = n_jobs != 1 and prefer == 'threads'
 
     # format fmin and fmax and check inputs
     if fmin is None:
@@ -794,7 +892,10 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
                 mode=mode, n_times=n_times, mt_adaptive=mt_adaptive,
                 mt_bandwidth=mt_bandwidth, sfreq=sfreq,
                 mt_low_bias=mt_low_bias, cwt_n_cycles=cwt_n_cycles,
-                cwt_freqs=cwt_freqs, freqs=freqs, freq_mask=freq_mask)
+                cwt_freqs=cwt_freqs, cwt_decim=cwt_decim, freqs=freqs,
+                freq_mask=freq_mask)
+            if mode == 'cwt_morlet':
+                times = times[cwt_decim]
 
             # unique signals for which we actually need to compute PSD etc.
             sig_idx = np.unique(np.r_[indices_use[0], indices_use[1]])
@@ -815,6 +916,15 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
             # create instances of the connectivity estimators
             con_methods = [mtype(n_cons, n_freqs, n_times_spectrum)
                            for mtype in con_method_types]
+            if use_threads:
+                # each thread accumulates into its own estimators and PSD,
+                # the first ones being those used for the final result
+                thread_methods = [con_methods] + [
+                    [mtype(n_cons, n_freqs, n_times_spectrum)
+                     for mtype in con_method_types]
+                    for _ in range(n_jobs - 1)]
+                if accumulate_psd:
+                    thread_psds = np.zeros((n_jobs,) + psd.shape)
 
             sep = ', '
             metrics_str = sep.join([meth.name for meth in con_methods])
@@ -834,11 +944,23 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
             mt_adaptive=mt_adaptive,
             con_method_types=con_method_types,
             con_methods=con_methods if n_jobs == 1 else None,
-            n_signals=n_signals, n_times=n_times,
+            n_signals=n_signals, n_times=n_times, decim=cwt_decim,
             accumulate_inplace=True if n_jobs == 1 else False)
         call_params.update(**spectral_params)
 
-        if n_jobs == 1:
+        if use_threads:
+            # process epochs in parallel, each thread accumulating in place
+            logger.info('    computing connectivity for epochs %d..%d'
+                        % (epoch_idx + 1, epoch_idx + len(epoch_block)))
+            call_params.update(accumulate_inplace=True)
+            for key in ('con_methods', 'psd'):
+                del call_params[key]
+            parallel(my_epoch_spectral_connectivity(
+                data=this_epoch, con_methods=thread_methods[ti],
+                psd=thread_psds[ti] if accumulate_psd else None,
+                **call_params) for ti, this_epoch in enumerate(epoch_block))
+            epoch_idx += len(epoch_block)
+        elif n_jobs == 1:
             # no parallel processing
             for this_epoch in epoch_block:
                 logger.info('    computing connectivity for epoch %d'
@@ -863,6 +985,15 @@ def spectral_connectivity(data, method='coh', indices=None, sfreq=2 * np.pi,
 
             epoch_idx += len(epoch_block)
 
+    if use_threads:
+        for this_methods in thread_methods[1:]:
+            for method, thread_method in zip(con_methods, this_methods):
+                method.combine(thread_method)
+        del thread_methods
+        if accumulate_psd:
+            thread_psds.sum(axis=0, out=psd)
+            del thread_psds
+
     # normalize
     n_epochs = epoch_idx
     if accumulate_psd:
@@ -1049,7 +1180,7 @@ def _prepare_connectivity(epoch_block, tmin, tmax, fmin, fmax, sfreq, indices,
 
 def _assemble_spectral_params(mode, n_times, mt_adaptive, mt_bandwidth, sfreq,
                               mt_low_bias, cwt_n_cycles, cwt_freqs,
-                              freqs, freq_mask):
+                              freqs, freq_mask, cwt_decim=slice(None)):
     """Prepare time-frequency decomposition."""
     spectral_params = dict(
         eigvals=None, window_fun=None, wavelets=None)
@@ -1080,7 +1211,7 @@ def _assemble_spectral_params(mode, n_times, mt_adaptive, mt_bandwidth, sfreq,
         spectral_params.update(
             wavelets=morlet(sfreq, freqs,
                             n_cycles=cwt_n_cycles, zero_mean=True))
-        n_times_spectrum = n_times
+        n_times_spectrum = len(range(n_times)[cwt_decim])
     else:
         raise ValueError('mode has an invalid value')
     return spectral_params, mt_adaptive, n_times_spectrum, n_tapers
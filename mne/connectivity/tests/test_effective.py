@@ -1,7 +1,8 @@
 import numpy as np
-from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_almost_equal, assert_allclose
+import pytest
 
-from mne.connectivity import phase_slope_index
+from mne.connectivity import phase_slope_index, mvar_connectivity
 
 
 def test_psi():
@@ -37,3 +38,99 @@ def test_psi():
 
     assert np.all(psi_cwt > 0)
     assert psi_cwt.shape[-1] == n_times
+
+
+def _simulate_var(coef, n_epochs, n_times, rng):
+    """Simulate epochs of a VAR process."""
+    order, n_signals = coef.shape[:2]
+    x = np.zeros((n_epochs, n_signals, n_times + 100))
+    noise = rng.randn(*x.shape)
+    for t in range(order, x.shape[-1]):
+        x[:, :, t] = noise[:, :, t]
+        for k in range(order):
+            x[:, :, t] += np.dot(x[:, :, t - k - 1], coef[k].T)
+    return x[:, :, 100:]
+
+
+def _bivariate_gc(x, order, seed, target, n_fft):
+    """Compute spectral Granger causality with a single lstsq fit."""
+    x = x[:, [target, seed]]
+    x = x - x.mean(axis=-1, keepdims=True)
+    n_times = x.shape[-1]
+    z = np.concatenate([np.concatenate(
+        [ep[:, order - k:n_times - k] for k in range(1, order + 1)])
+        for ep in x], axis=1)
+    y = np.concatenate([ep[:, order:] for ep in x], axis=1)
+    coef = np.linalg.lstsq(z.T, y.T, rcond=None)[0].T
+    resid = y - np.dot(coef, z)
+    sigma = np.dot(resid, resid.T) / resid.shape[1]
+    freqs = np.arange(n_fft // 2 + 1) / float(n_fft)
+    gc = list()
+    for f in freqs:
+        a_f = np.eye(2, dtype=complex)
+        for k in range(order):
+            a_f -= coef[:, 2 * k:2 * k + 2] * np.exp(-2j * np.pi * f * (k + 1))
+        h_f = np.linalg.inv(a_f)
+        s_f = np.dot(np.dot(h_f, sigma), h_f.conj().T)[0, 0].real
+        part = sigma[1, 1] - sigma[0, 1] ** 2 / sigma[0, 0]
+        gc.append(np.log(s_f / (s_f - part * np.abs(h_f[0, 1]) ** 2)))
+    return np.array(gc)
+
+
+def test_mvar_connectivity():
+    """Test MVAR-based Granger causality, PDC and DTF."""
+    rng = np.random.RandomState(0)
+    coef = np.zeros((2, 3, 3))
+    coef[0] = [[0.5, 0., 0.], [0.4, 0.3, 0.], [0., 0., 0.2]]
+    coef[1] = [[-0.3, 0., 0.], [0., -0.2, 0.], [0., 0.3, 0.]]
+    n_fft = 64
+    data = _simulate_var(coef, 20, 500, rng)
+    methods = ['gc', 'pdc', 'dtf']
+    con, freqs = mvar_connectivity(data, method=methods, order=2,
+                                   sfreq=100., n_fft=n_fft)
+    assert_allclose(freqs, np.arange(33) * 100. / n_fft)
+    # the true PDC and DTF of the simulated process
+    a_f = np.eye(3) - np.einsum(
+        'kij,fk->fij', coef, np.exp(-2j * np.pi * np.outer(
+            np.arange(33) / float(n_fft), np.arange(1, 3))))
+    h_f = np.linalg.inv(a_f)
+    pdc = np.abs(a_f) / np.linalg.norm(a_f, axis=1, keepdims=True)
+    dtf = np.abs(h_f) / np.linalg.norm(h_f, axis=2, keepdims=True)
+    off = ~np.eye(3, dtype=bool)
+    for c, want in zip(con[1:], (pdc, dtf)):
+        assert c.shape == (3, 3, 33)
+        assert_allclose(np.diagonal(c), 0.)
+        # con[i, j] is from i to j
+        assert_allclose(c[off], want.transpose(2, 1, 0)[off], atol=0.05)
+    # pairwise Granger causality: 0 -> 1 and 1 -> 2 only
+    gc = con[0]
+    assert gc[0, 1].mean() > 0.1 and gc[1, 2].mean() > 0.1
+    assert gc[1, 0].mean() < 0.01 and gc[2, 1].mean() < 0.01
+    for seed, target in ((0, 1), (1, 0), (2, 1), (0, 2)):
+        assert_allclose(gc[seed, target],
+                        _bivariate_gc(data, 2, seed, target, n_fft),
+                        rtol=1e-6, atol=1e-10)
+
+    # indices, generators, frequency limits, and Yule-Walker
+    indices = (np.array([0, 1, 2]), np.array([1, 2, 0]))
+    con2, freqs2 = mvar_connectivity((d for d in data), method=methods,
+                                     indices=indices, order=2, sfreq=100.,
+                                     n_fft=n_fft, fmin=10., fmax=30.)
+    mask = (freqs >= 10.) & (freqs <= 30.)
+    assert_allclose(freqs2, freqs[mask])
+    for c, c2 in zip(con, con2):
+        assert_allclose(c2, c[indices][:, mask], rtol=1e-10, atol=1e-12)
+    con3, _ = mvar_connectivity(data, method='pdc', order=2, sfreq=100.,
+                                n_fft=n_fft, fit_method='yw')
+    assert_allclose(con3, con[1], atol=0.01)
+
+    with pytest.raises(ValueError, match='Invalid value for the .method.'):
+        mvar_connectivity(data, method='foo')
+    with pytest.raises(ValueError, match='order must be at least 1'):
+        mvar_connectivity(data, order=0)
+    with pytest.raises(ValueError, match='must be larger than the model'):
+        mvar_connectivity(data[:, :, :5], order=5)
+    with pytest.raises(ValueError, match='same shape'):
+        mvar_connectivity([data[0], data[1, :2]])
+    with pytest.raises(ValueError, match='no frequency points'):
+        mvar_connectivity(data, fmin=60., sfreq=100.)
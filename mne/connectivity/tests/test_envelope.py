@@ -9,6 +9,7 @@ from numpy.testing import assert_allclose
 import pytest
 from scipy.signal import hilbert
 
+from mne import SourceEstimate
 from mne.connectivity import envelope_correlation
 
 
@@ -98,3 +99,34 @@ def test_envelope_correlation():
     corr_log = envelope_correlation(
         data, combine=None, log=True, absolute=False)
     assert_allclose(corr_log, ft_vals)
+
+
+@pytest.mark.parametrize('n_jobs', (1, 2))
+def test_envelope_correlation_generator(n_jobs, monkeypatch):
+    """Test envelope correlation of lazy SourceEstimate generators."""
+    import mne.connectivity.envelope as envelope
+    rng = np.random.RandomState(0)
+    data = rng.randn(5, 4, 64)
+    vertices = [np.arange(4), np.array([], int)]
+    n_consumed = list()
+
+    def stc_gen():
+        for ei, epoch_data in enumerate(data):
+            n_consumed.append(ei)
+            yield SourceEstimate(epoch_data, vertices, 0., 0.01)
+
+    corr_orig = envelope_correlation(data, combine=None)
+    # process blocks of one seed at a time
+    monkeypatch.setattr(envelope, '_ORTH_BLOCK_SIZE', 1.)
+    gen = stc_gen()
+    assert n_consumed == []
+    corr = envelope_correlation(gen, n_jobs=n_jobs)
+    assert n_consumed == list(range(5))
+    assert_allclose(corr, corr_orig.mean(axis=0))
+    assert_allclose(np.diag(corr), 0.)
+    corr = envelope_correlation(stc_gen(), combine=None, n_jobs=n_jobs)
+    assert_allclose(corr, corr_orig)
+    for kwargs in (dict(log=True, absolute=False), dict(orthogonalize=False)):
+        corr_orig = envelope_correlation(data, **kwargs)
+        corr = envelope_correlation(stc_gen(), n_jobs=n_jobs, **kwargs)
+        assert_allclose(corr, corr_orig)
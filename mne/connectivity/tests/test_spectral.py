@@ -1,9 +1,10 @@
 import numpy as np
-from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_almost_equal, assert_allclose
 import pytest
 
-from mne.connectivity import spectral_connectivity
-from mne.connectivity.spectral import _CohEst, _get_n_epochs
+from mne.connectivity import spectral_connectivity, spectral
+from mne.connectivity.spectral import (_CohEst, _get_n_epochs,
+                                       _get_dense_block)
 
 from mne import SourceEstimate
 from mne.utils import run_tests_if_main
@@ -212,4 +213,77 @@ def test_spectral_connectivity(method, mode):
     assert (out_lens[0] == 10)
 
 
+@pytest.mark.parametrize('mode', ['multitaper', 'fourier', 'cwt_morlet'])
+def test_spectral_connectivity_threads(mode):
+    """Test thread-based parallel spectral connectivity."""
+    rng = np.random.RandomState(0)
+    sfreq = 50.
+    data = rng.randn(7, 4, 128)
+    methods = ['coh', 'plv', 'wpli2_debiased', 'ppc']
+    kwargs = dict(method=methods, mode=mode, sfreq=sfreq, fmin=5., fmax=20.,
+                  cwt_freqs=np.arange(5., 20.), cwt_n_cycles=3.)
+    con, freqs, times, n, _ = spectral_connectivity(data, **kwargs)
+    with pytest.raises(ValueError, match='Invalid value for the .prefer.'):
+        spectral_connectivity(data, n_jobs=2, prefer='foo', **kwargs)
+    for n_jobs in (2, 3):
+        con2, freqs2, times2, n2, _ = spectral_connectivity(
+            (d for d in data), n_jobs=n_jobs, prefer='threads', **kwargs)
+        assert n2 == n
+        assert_allclose(freqs2, freqs)
+        assert_allclose(times2, times)
+        for c, c2 in zip(con, con2):
+            assert_allclose(c2, c, rtol=1e-7, atol=1e-12)
+
+
+@pytest.mark.parametrize('mode, adaptive', [
+    ('multitaper', False),
+    ('multitaper', True),
+    ('fourier', False),
+])
+def test_spectral_connectivity_dense(mode, adaptive):
+    """Test all-to-all cross-spectra against the indexed computation."""
+    rng = np.random.RandomState(0)
+    data = rng.randn(3, 6, 128)
+    methods = ['cohy', 'plv', 'wpli2_debiased']
+    kwargs = dict(method=methods, mode=mode, sfreq=50., fmin=5.,
+                  mt_adaptive=adaptive)
+    con = spectral_connectivity(data, **kwargs)[0]
+    # blocks of three connections with no common signal use the indexed path
+    indices = (np.array([1, 3, 5, 2, 4, 5, 3, 4, 5, 4, 5, 3, 5, 2, 4]),
+               np.array([0, 2, 4, 0, 1, 3, 0, 2, 1, 0, 2, 1, 0, 1, 3]))
+    assert _get_dense_block(indices[0][:3], indices[1][:3]) is None
+    assert _get_dense_block(*np.tril_indices(6, -1)) is not None
+    con2 = spectral_connectivity(data, indices=indices, block_size=3,
+                                 **kwargs)[0]
+    for c, c2 in zip(con, con2):
+        assert_allclose(c2, c[indices], rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize('decim', [1, 3, slice(10, -10, 4)])
+def test_spectral_connectivity_cwt_blocks(decim, monkeypatch):
+    """Test frequency-blocked and decimated wavelet connectivity."""
+    rng = np.random.RandomState(0)
+    sfreq = 50.
+    data = rng.randn(3, 4, 128)
+    methods = ['coh', 'imcoh', 'plv', 'pli2_unbiased', 'wpli',
+               'wpli2_debiased', 'ppc']
+    kwargs = dict(method=methods, mode='cwt_morlet', sfreq=sfreq,
+                  cwt_freqs=np.arange(5., 20.), cwt_n_cycles=3.)
+    con, freqs, times, _, _ = spectral_connectivity(data, **kwargs)
+    assert con[0].shape == (4, 4, 15, 128)
+    sl = decim if isinstance(decim, slice) else slice(None, None, decim)
+    # wavelet coefficients of two frequencies at a time
+    monkeypatch.setattr(spectral, '_CWT_BLOCK_SIZE', 2 * 16 * 6 * 128)
+    for stc in (False, True):
+        this_data = _stc_gen(data, sfreq, 0.) if stc else data
+        con2, freqs2, times2, _, _ = spectral_connectivity(
+            this_data, cwt_decim=decim, block_size=6, **kwargs)
+        assert_allclose(freqs2, freqs)
+        assert_allclose(times2, times[sl])
+        for c, c2 in zip(con, con2):
+            assert_allclose(c2, c[..., sl], rtol=1e-7, atol=1e-10)
+    with pytest.raises(TypeError, match='decim must be'):
+        spectral_connectivity(data, cwt_decim=1.5, **kwargs)
+
+
 run_tests_if_main()
@@ -19,6 +19,10 @@ from ._ola import _COLA
 
 # These values from Ifeachor and Jervis.
 _length_factors = dict(hann=3.1, hamming=3.3, blackman=5.0)
+# bytes of data and of multitaper spectra processed at once by notch_filter
+# with method='spectrum_fit'
+_MT_SPECTRUM_GROUP_SIZE = 4e6
+_MT_SPECTRUM_BLOCK_SIZE = 10e6
 
 
 def is_power2(num):
@@ -1232,23 +1236,16 @@ def _mt_spectrum_proc(x, sfreq, line_freqs, notch_widths, mt_bandwidth,
         _get_window_thresh, sfreq=sfreq, mt_bandwidth=mt_bandwidth,
         p_value=p_value)
     window_fun, threshold = get_wt(filter_length)
-    if n_jobs == 1:
-        freq_list = list()
-        for ii, x_ in enumerate(x):
-            if ii in picks:
-                x[ii], f = _mt_spectrum_remove_win(
-                    x_, sfreq, line_freqs, notch_widths, window_fun, threshold,
-                    get_wt)
-                freq_list.append(f)
-    else:
-        parallel, p_fun, _ = parallel_func(_mt_spectrum_remove_win, n_jobs)
-        data_new = parallel(p_fun(x_, sfreq, line_freqs, notch_widths,
-                                  window_fun, threshold, get_wt)
-                            for xi, x_ in enumerate(x)
-                            if xi in picks)
-        freq_list = [d[1] for d in data_new]
-        data_new = np.array([d[0] for d in data_new])
-        x[picks, :] = data_new
+    # process groups of channels small enough to keep the COLA buffers in
+    # cache, with all channels of a group handled together in each window
+    n_group = max(int(_MT_SPECTRUM_GROUP_SIZE // (8 * x.shape[-1])), 1)
+    freq_list = list()
+    for start in range(0, len(picks), n_group):
+        group = picks[start:start + n_group]
+        x[group], rm_freqs = _mt_spectrum_remove_win(
+            x[group], sfreq, line_freqs, notch_widths, window_fun, threshold,
+            get_wt, n_jobs)
+        freq_list.extend(rm_freqs)
 
     # report found frequencies, but do some sanitizing first by binning into
     # 1 Hz bins
@@ -1265,21 +1262,19 @@ def _mt_spectrum_proc(x, sfreq, line_freqs, notch_widths, mt_bandwidth,
 
 
 def _mt_spectrum_remove_win(x, sfreq, line_freqs, notch_widths,
-                            window_fun, threshold, get_thresh):
+                            window_fun, threshold, get_thresh, n_jobs=1):
+    """Remove line frequencies from all channels in COLA windows.
+
+    The windows are processed in batches of ``n_jobs`` using threads, and
+    all channels of a window are processed together.
+    """
     n_times = x.shape[-1]
     n_samples = window_fun.shape[1]
     n_overlap = (n_samples + 1) // 2
     x_out = np.zeros_like(x)
-    rm_freqs = list()
+    rm_freqs = [list() for _ in range(len(x))]
     idx = [0]
-
-    # Define how to process a chunk of data
-    def process(x_):
-        out = _mt_spectrum_remove(
-            x_, sfreq, line_freqs, notch_widths, window_fun, threshold,
-            get_thresh)
-        rm_freqs.append(out[1])
-        return (out[0],)  # must return a tuple
+    processed = list()
 
     # Define how to store a chunk of fully processed data (it's trivial)
     def store(x_):
@@ -1287,8 +1282,27 @@ def _mt_spectrum_remove_win(x, sfreq, line_freqs, notch_widths,
         x_out[..., idx[0]:stop] += x_
         idx[0] = stop
 
-    _COLA(process, store, n_times, n_samples, n_overlap, sfreq,
-          verbose=False).feed(x)
+    # Define how to process a chunk of data: the windows are computed ahead
+    # in batches, directly from x (the data the chunks are copied from)
+    def process(x_):
+        if len(processed) == 0:
+            batch = windows[:n_jobs]
+            del windows[:n_jobs]
+            processed.extend(parallel(p_fun(
+                x[:, start:stop], sfreq, line_freqs, notch_widths,
+                window_fun, threshold, get_thresh) for start, stop in batch))
+        out = processed.pop(0)
+        assert out[0].shape == x_.shape
+        for ri, rm in enumerate(out[1]):
+            rm_freqs[ri].append(rm)
+        return (out[0],)  # must return a tuple
+
+    cola = _COLA(process, store, n_times, n_samples, n_overlap, sfreq,
+                 verbose=False)
+    windows = list(zip(cola.starts, cola.stops))
+    parallel, p_fun, n_jobs = parallel_func(
+        _mt_spectrum_remove, n_jobs, prefer='threads', verbose=False)
+    cola.feed(x)
     assert idx[0] == n_times
     return x_out, rm_freqs
 
@@ -1298,15 +1312,29 @@ def _mt_spectrum_remove(x, sfreq, line_freqs, notch_widths,
     """Use MT-spectrum to remove line frequencies.
 
     Based on Chronux. If line_freqs is specified, all freqs within notch_width
-    of each line_freq is set to zero.
+    of each line_freq is set to zero. The channels of ``x`` (n_channels,
+    n_times) are processed in blocks with one multitaper FFT each.
     """
-    assert x.ndim == 1
+    assert x.ndim == 2
     if x.shape[-1] != window_fun.shape[-1]:
         window_fun, threshold = get_thresh(x.shape[-1])
+    n_block = max(int(_MT_SPECTRUM_BLOCK_SIZE //
+                      (16 * len(window_fun) * (x.shape[-1] // 2 + 1))), 1)
+    x_out = np.empty_like(x)
+    rm_freqs = list()
+    for start in range(0, len(x), n_block):
+        sl = slice(start, start + n_block)
+        x_out[sl], rm = _mt_spectrum_remove_block(
+            x[sl], sfreq, line_freqs, notch_widths, window_fun, threshold)
+        rm_freqs.extend(rm)
+    return x_out, rm_freqs
+
+
+def _mt_spectrum_remove_block(x, sfreq, line_freqs, notch_widths,
+                              window_fun, threshold):
     # drop the even tapers
     n_tapers = len(window_fun)
     tapers_odd = np.arange(0, n_tapers, 2)
-    tapers_even = np.arange(1, n_tapers, 2)
     tapers_use = window_fun[tapers_odd]
 
     # sum tapers for (used) odd prolates across time (n_tapers, 1)
@@ -1316,12 +1344,12 @@ def _mt_spectrum_remove(x, sfreq, line_freqs, notch_widths,
     H0_sq = sum_squared(H0)
 
     # make "time" vector
-    rads = 2 * np.pi * (np.arange(x.size) / float(sfreq))
+    rads = 2 * np.pi * (np.arange(x.shape[-1]) / float(sfreq))
 
     # compute mt_spectrum (returning n_ch, n_tapers, n_freq)
-    x_p, freqs = _mt_spectra(x[np.newaxis, :], window_fun, sfreq)
+    x_p, freqs = _mt_spectra(x, window_fun, sfreq)
 
-    # sum of the product of x_p and H0 across tapers (1, n_freqs)
+    # sum of the product of x_p and H0 across tapers (n_ch, n_freqs)
     x_p_H0 = np.sum(x_p[:, tapers_odd, :] *
                     H0[np.newaxis, :, np.newaxis], axis=1)
 
@@ -1331,20 +1359,21 @@ def _mt_spectrum_remove(x, sfreq, line_freqs, notch_widths,
     if line_freqs is None:
         # figure out which freqs to remove using F stat
 
-        # estimated coefficient
-        x_hat = A * H0[:, np.newaxis]
+        # power of the estimated coefficients x_hat = A * H0 across tapers
+        A_sq = (A * A.conj()).real * H0_sq
 
         # numerator for F-statistic
-        num = (n_tapers - 1) * (A * A.conj()).real * H0_sq
-        # denominator for F-statistic
-        den = (np.sum(np.abs(x_p[:, tapers_odd, :] - x_hat) ** 2, 1) +
-               np.sum(np.abs(x_p[:, tapers_even, :]) ** 2, 1))
+        num = (n_tapers - 1) * A_sq
+        # denominator for F-statistic, i.e. the residual power
+        # sum(|x_p_odd - x_hat| ** 2) + sum(|x_p_even| ** 2), which (as A is
+        # the least-squares fit) equals sum(|x_p| ** 2) - |A| ** 2 * H0_sq
+        power = np.sum(x_p.real ** 2 + x_p.imag ** 2, axis=1)
+        den = np.maximum(power - A_sq, 1e-12 * power)
         den[den == 0] = np.inf
         f_stat = num / den
 
         # find frequencies to remove
-        indices = np.where(f_stat > threshold)[1]
-        rm_freqs = freqs[indices]
+        remove = f_stat > threshold
     else:
         # specify frequencies
         indices_1 = np.unique([np.argmin(np.abs(freqs - lf))
@@ -1353,20 +1382,19 @@ def _mt_spectrum_remove(x, sfreq, line_freqs, notch_widths,
                      for lf, nw in zip(line_freqs, notch_widths)]
         indices_2 = np.where(np.any(np.array(indices_2), axis=0))[0]
         indices = np.unique(np.r_[indices_1, indices_2])
-        rm_freqs = freqs[indices]
-
-    fits = list()
-    for ind in indices:
-        c = 2 * A[0, ind]
-        fit = np.abs(c) * np.cos(freqs[ind] * rads + np.angle(c))
-        fits.append(fit)
-
-    if len(fits) == 0:
-        datafit = 0.0
-    else:
-        # fitted sinusoids are summed, and subtracted from data
-        datafit = np.sum(fits, axis=0)
-
+        remove = np.zeros(A.shape, bool)
+        remove[:, indices] = True
+    del x_p
+    rm_freqs = [freqs[r] for r in remove]
+
+    # fitted sinusoids |c| cos(w t + angle(c)) = Re(c exp(i w t)), with
+    # c = 2 A, are summed over the removed freqs and subtracted from data
+    indices = np.where(remove.any(axis=0))[0]
+    if len(indices) == 0:
+        return x, rm_freqs
+    c = np.where(remove[:, indices], 2 * A[:, indices], 0)
+    phase = freqs[indices][:, np.newaxis] * rads
+    datafit = np.dot(c.real, np.cos(phase)) - np.dot(c.imag, np.sin(phase))
     return x - datafit, rm_freqs
 
 
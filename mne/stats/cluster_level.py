@@ -10,96 +10,176 @@
 #
 # License: Simplified BSD
 
+import os
+import os.path as op
+
 import numpy as np
 from scipy import sparse
 
 from .parametric import f_oneway, ttest_1samp_no_p
+from .permutations import _STOP_N_BLOCK, _check_stop_alpha, _stop_permuting
 from ..parallel import parallel_func, check_n_jobs
 from ..fixes import jit, has_numba
 from ..utils import (split_list, logger, verbose, ProgressBar, warn, _pl,
+                     _check_fname,
                      check_random_state, _check_option, _validate_type)
 from ..source_estimate import (SourceEstimate, VolSourceEstimate,
                                MixedSourceEstimate)
 from ..source_space import SourceSpaces
 
 
-def _get_buddies_fallback(r, s, neighbors, indices=None):
-    if indices is None:
-        buddies = np.where(r)[0]
-    else:
-        buddies = indices[r[indices]]
-    buddies = buddies[np.in1d(s[buddies], neighbors, assume_unique=True)]
-    r[buddies] = False
-    return buddies.tolist()
-
-
-def _get_selves_fallback(r, s, ind, inds, t, t_border, max_step):
-    start = t_border[max(t[ind] - max_step, 0)]
-    stop = t_border[min(t[ind] + max_step + 1, len(t_border) - 1)]
-    indices = inds[start:stop]
-    selves = indices[r[indices]]
-    selves = selves[s[ind] == s[selves]]
-    r[selves] = False
-    return selves.tolist()
-
-
-def _where_first_fallback(x):
-    # this is equivalent to np.where(r)[0] for these purposes, but it's
-    # a little bit faster. Unfortunately there's no way to tell numpy
-    # just to find the first instance (to save checking every one):
-    next_ind = int(np.argmax(x))
-    if next_ind == 0:
-        next_ind = -1
-    return next_ind
+def _st_union(parent, ii, jj):
+    """Merge the sets of ii and jj, keeping the smallest index as root."""
+    ii = _st_find(parent, ii)
+    jj = _st_find(parent, jj)
+    if ii < jj:
+        parent[jj] = ii
+    elif jj < ii:
+        parent[ii] = jj
+
+
+def _st_find(parent, ii):
+    """Find the root of ii, halving the path along the way."""
+    while parent[ii] != ii:
+        parent[ii] = parent[parent[ii]]
+        ii = parent[ii]
+    return ii
+
+
+def _get_st_labels_fallback(idx, lookup, indptr, indices, n_src, n_times,
+                            max_step):
+    from scipy.sparse.csgraph import connected_components
+    n_points = len(idx)
+    t, s = np.divmod(idx, n_src)
+    # edges to the spatial neighbors at the same time point
+    counts = indptr[s + 1] - indptr[s]
+    src = np.repeat(np.arange(n_points), counts)
+    offsets = np.repeat(np.cumsum(counts) - counts - indptr[s], counts)
+    neighbors = indices[np.arange(len(src)) - offsets]
+    src = [src]
+    dst = [lookup[np.repeat(t, counts) * n_src + neighbors]]
+    # edges to the same vertex up to max_step time points later
+    for step in range(1, max_step + 1):
+        use = np.where(t + step < n_times)[0]
+        src.append(use)
+        dst.append(lookup[idx[use] + step * n_src])
+    src, dst = np.concatenate(src), np.concatenate(dst)
+    keep = dst >= 0
+    graph = sparse.coo_matrix(
+        (np.ones(keep.sum()), (src[keep], dst[keep])),
+        shape=(n_points, n_points))
+    n_labels, labels = connected_components(graph, directed=False)
+    # number the components in order of their first point
+    _, first = np.unique(labels, return_index=True)
+    remap = np.empty(n_labels, int)
+    remap[np.argsort(first)] = np.arange(n_labels)
+    return remap[labels], n_labels
 
 
 if has_numba:  # pragma: no cover
+    _st_find = jit()(_st_find)
+    _st_union = jit()(_st_union)
+
     @jit()
-    def _get_buddies(r, s, neighbors, indices=None):
-        buddies = list()
-        # At some point we might be able to use the sorted-ness of s or
-        # neighbors to further speed this up
-        if indices is None:
-            n_check = len(r)
-        else:
-            n_check = len(indices)
-        for ii in range(n_check):
-            if indices is None:
-                this_idx = ii
+    def _get_st_labels(idx, lookup, indptr, indices, n_src, n_times,
+                       max_step):
+        n_points = len(idx)
+        parent = np.arange(n_points)
+        for ii in range(n_points):
+            t = idx[ii] // n_src
+            s = idx[ii] - t * n_src
+            for jj in range(indptr[s], indptr[s + 1]):
+                other = lookup[t * n_src + indices[jj]]
+                if other >= 0:
+                    _st_union(parent, ii, other)
+            for step in range(1, min(max_step, n_times - 1 - t) + 1):
+                other = lookup[idx[ii] + step * n_src]
+                if other >= 0:
+                    _st_union(parent, ii, other)
+        # roots are the first point of each component, so labeling the
+        # roots in order numbers the components by their first point
+        labels = np.empty(n_points, np.int64)
+        n_labels = 0
+        for ii in range(n_points):
+            root = _st_find(parent, ii)
+            if root == ii:
+                labels[ii] = n_labels
+                n_labels += 1
             else:
-                this_idx = indices[ii]
-            if r[this_idx]:
-                this_s = s[this_idx]
-                for ni in range(len(neighbors)):
-                    if this_s == neighbors[ni]:
-                        buddies.append(this_idx)
-                        r[this_idx] = False
-                        break
-        return buddies
+                labels[ii] = labels[root]
+        return labels, n_labels
 
     @jit()
-    def _get_selves(r, s, ind, inds, t, t_border, max_step):
-        selves = list()
-        start = t_border[max(t[ind] - max_step, 0)]
-        stop = t_border[min(t[ind] + max_step + 1, len(t_border) - 1)]
-        for ii in range(start, stop):
-            this_idx = inds[ii]
-            if r[this_idx] and s[ind] == s[this_idx]:
-                selves.append(this_idx)
-                r[this_idx] = False
-        return selves
+    def _tfce_merge(ii, jj, level, parent, size, node, tree_parent,
+                    node_size, birth, death, n_nodes):
+        ii = _st_find(parent, ii)
+        jj = _st_find(parent, jj)
+        if ii == jj:
+            return n_nodes
+        if size[ii] < size[jj]:
+            ii, jj = jj, ii
+        parent[jj] = ii
+        size[ii] += size[jj]
+        # the merged component is a new node of the merge tree
+        for child in (node[ii], node[jj]):
+            tree_parent[child] = n_nodes
+            death[child] = level
+        birth[n_nodes] = level
+        node_size[n_nodes] = size[ii]
+        node[ii] = n_nodes
+        return n_nodes + 1
 
     @jit()
-    def _where_first(x):
-        for ii in range(len(x)):
-            if x[ii]:
-                return ii
-        return -1
+    def _get_tfce_sweep(order, lookup, values, levels, cum_h, indptr,
+                        indices, n_src, n_times, max_step, e_power):
+        # Points (sorted by decreasing value) are added as the threshold
+        # drops, and each merge creates a node of a merge tree. A node
+        # supports the levels from its birth down to its merge (death),
+        # so the score of a point is the sum over the nodes on its path
+        # to the root of size ** E * (sum of h ** H over those levels).
+        n_points = len(order)
+        parent = np.arange(n_points)
+        size = np.ones(n_points, np.int64)
+        node = np.arange(n_points)
+        tree_parent = np.full(2 * n_points, -1, np.int64)
+        node_size = np.ones(2 * n_points, np.int64)
+        birth = np.zeros(2 * n_points, np.int64)
+        death = np.full(2 * n_points, -1, np.int64)
+        n_nodes = n_points
+        ii = 0
+        for level in range(len(levels) - 1, -1, -1):
+            while ii < n_points and values[ii] > levels[level]:
+                birth[ii] = level
+                t = order[ii] // n_src
+                s = order[ii] - t * n_src
+                for jj in range(indptr[s], indptr[s + 1]):
+                    other = lookup[t * n_src + indices[jj]]
+                    if 0 <= other < ii:
+                        n_nodes = _tfce_merge(
+                            ii, other, level, parent, size, node,
+                            tree_parent, node_size, birth, death, n_nodes)
+                for step in range(1, max_step + 1):
+                    for other_t in (t - step, t + step):
+                        if 0 <= other_t < n_times:
+                            other = lookup[other_t * n_src + s]
+                            if 0 <= other < ii:
+                                n_nodes = _tfce_merge(
+                                    ii, other, level, parent, size, node,
+                                    tree_parent, node_size, birth, death,
+                                    n_nodes)
+                ii += 1
+        # parents are always created after their children
+        total = np.zeros(n_nodes)
+        for nn in range(n_nodes - 1, -1, -1):
+            h = cum_h[birth[nn]]
+            if death[nn] >= 0:
+                h -= cum_h[death[nn]]
+            total[nn] = node_size[nn] ** e_power * h
+            if tree_parent[nn] >= 0:
+                total[nn] += total[tree_parent[nn]]
+        return total[:n_points]
 else:  # pragma: no cover
-    # fastest ways we've found with NumPy
-    _get_buddies = _get_buddies_fallback
-    _get_selves = _get_selves_fallback
-    _where_first = _where_first_fallback
+    _get_st_labels = _get_st_labels_fallback
 
 
 @jit()
@@ -117,168 +197,102 @@ def _sum_cluster_data(data, tstep):
     return np.sign(data) * np.logical_not(data == 0) * tstep
 
 
-def _get_clusters_spatial(s, neighbors):
-    """Form spatial clusters using neighbor lists.
-
-    This is equivalent to _get_components with n_times = 1, with a properly
-    reconfigured adjacency matrix (formed as "neighbors" list)
-    """
-    # s is a vector of spatial indices that are significant, like:
-    #     s = np.where(x_in)[0]
-    # for x_in representing a single time-instant
-    r = np.ones(s.shape, bool)
-    clusters = list()
-    next_ind = 0 if s.size > 0 else -1
-    while next_ind >= 0:
-        # put first point in a cluster, adjust remaining
-        t_inds = [next_ind]
-        r[next_ind] = 0
-        icount = 1  # count of nodes in the current cluster
-        while icount <= len(t_inds):
-            ind = t_inds[icount - 1]
-            # look across other vertices
-            buddies = _get_buddies(r, s, neighbors[s[ind]])
-            t_inds.extend(buddies)
-            icount += 1
-        next_ind = _where_first(r)
-        clusters.append(s[t_inds])
-    return clusters
-
-
-def _reassign(check, clusters, base, num):
-    """Reassign cluster numbers."""
-    # reconfigure check matrix
-    check[check == num] = base
-    # concatenate new values into clusters array
-    clusters[base - 1] = np.concatenate((clusters[base - 1],
-                                         clusters[num - 1]))
-    clusters[num - 1] = np.array([], dtype=int)
-
-
-def _get_clusters_st_1step(keepers, neighbors):
-    """Directly calculate clusters.
-
-    This uses knowledge that time points are
-    only adjacent to immediate neighbors for data organized as time x space.
-
-    This algorithm time increases linearly with the number of time points,
-    compared to with the square for the standard (graph) algorithm.
+def _get_clusters_st(x, x_in, neighbors, max_step=1, t_power=1,
+                     partitions=None):
+    """Find spatio-temporal clusters and their sums in a single pass.
 
-    This algorithm creates clusters for each time point using a method more
-    efficient than the standard graph method (but otherwise equivalent), then
-    combines these clusters across time points in a reasonable way.
+    Points are adjacent if they are spatial neighbors at the same time point,
+    or the same vertex at most ``max_step`` time points apart. ``neighbors``
+    is the spatial adjacency as a CSR matrix (or a list of neighbor arrays),
+    and the data are organized as time x space.
     """
-    n_src = len(neighbors)
-    n_times = len(keepers)
-    # start cluster numbering at 1 for diffing convenience
-    enum_offset = 1
-    check = np.zeros((n_times, n_src), dtype=int)
-    clusters = list()
-    for ii, k in enumerate(keepers):
-        c = _get_clusters_spatial(k, neighbors)
-        for ci, cl in enumerate(c):
-            check[ii, cl] = ci + enum_offset
-        enum_offset += len(c)
-        # give them the correct offsets
-        c = [cl + ii * n_src for cl in c]
-        clusters += c
-
-    # now that each cluster has been assigned a unique number, combine them
-    # by going through each time point
-    for check1, check2, k in zip(check[:-1], check[1:], keepers[:-1]):
-        # go through each one that needs reassignment
-        inds = k[check2[k] - check1[k] > 0]
-        check1_d = check1[inds]
-        n = check2[inds]
-        nexts = np.unique(n)
-        for num in nexts:
-            prevs = check1_d[n == num]
-            base = np.min(prevs)
-            for pr in np.unique(prevs[prevs != base]):
-                _reassign(check1, clusters, base, pr)
-            # reassign values
-            _reassign(check2, clusters, base, num)
-    # clean up clusters
-    clusters = [cl for cl in clusters if len(cl) > 0]
-    return clusters
-
-
-def _get_clusters_st_multistep(keepers, neighbors, max_step=1):
-    """Directly calculate clusters.
-
-    This uses knowledge that time points are
-    only adjacent to immediate neighbors for data organized as time x space.
-
-    This algorithm time increases linearly with the number of time points,
-    compared to with the square for the standard (graph) algorithm.
-    """
-    n_src = len(neighbors)
-    n_times = len(keepers)
-    t_border = list()
-    t_border.append(0)
-    for ki, k in enumerate(keepers):
-        keepers[ki] = k + ki * n_src
-        t_border.append(t_border[ki] + len(k))
-    t_border = np.array(t_border)
-    keepers = np.concatenate(keepers)
-    v = keepers
-    t, s = divmod(v, n_src)
-
-    r = np.ones(t.shape, dtype=bool)
-    clusters = list()
-    inds = np.arange(t_border[0], t_border[n_times])
-    next_ind = 0 if s.size > 0 else -1
-    while next_ind >= 0:
-        # put first point in a cluster, adjust remaining
-        t_inds = [next_ind]
-        r[next_ind] = False
-        icount = 1  # count of nodes in the current cluster
-        # look for significant values at the next time point,
-        # same sensor, not placed yet, and add those
-        while icount <= len(t_inds):
-            ind = t_inds[icount - 1]
-            selves = _get_selves(r, s, ind, inds, t, t_border, max_step)
-
-            # look at current time point across other vertices
-            these_inds = inds[t_border[t[ind]]:t_border[t[ind] + 1]]
-            buddies = _get_buddies(r, s, neighbors[s[ind]], these_inds)
-
-            t_inds += buddies + selves
-            icount += 1
-        next_ind = _where_first(r)
-        clusters.append(v[t_inds])
-
-    return clusters
+    if isinstance(neighbors, list):
+        neighbors = _neighbors_to_csr(neighbors)
+    n_src = neighbors.shape[0]
+    n_times = x_in.size // n_src
+    idx = np.where(x_in)[0]
+    if len(idx) == 0:
+        return [], np.array([])
+    lookup = np.full(x_in.size, -1, np.int64)
+    lookup[idx] = np.arange(len(idx))
+    labels, n_labels = _get_st_labels(
+        idx, lookup, neighbors.indptr, neighbors.indices, n_src, n_times,
+        max_step)
+    order = np.argsort(labels, kind='stable')
+    counts = np.bincount(labels, minlength=n_labels)
+    clusters = np.split(idx[order], np.cumsum(counts)[:-1])
+    x = x[idx]
+    if t_power != 1:
+        x = np.sign(x) * np.abs(x) ** t_power
+    sums = np.bincount(labels, x, minlength=n_labels)
+    if partitions is not None:
+        # clusters cannot span partitions, just order them by partition
+        order = np.argsort(partitions[idx[order][np.cumsum(counts) - 1]],
+                           kind='stable')
+        clusters = [clusters[ii] for ii in order]
+        sums = sums[order]
+    return clusters, sums
 
 
-def _get_clusters_st(x_in, neighbors, max_step=1):
-    """Choose the most efficient version."""
-    n_src = len(neighbors)
-    n_times = x_in.size // n_src
-    cl_goods = np.where(x_in)[0]
-    if len(cl_goods) > 0:
-        keepers = [np.array([], dtype=int)] * n_times
-        row, col = np.unravel_index(cl_goods, (n_times, n_src))
-        lims = [0]
-        if isinstance(row, int):
-            row = [row]
-            col = [col]
-        else:
-            order = np.argsort(row)
-            row = row[order]
-            col = col[order]
-            lims += (np.where(np.diff(row) > 0)[0] + 1).tolist()
-            lims.append(len(row))
-
-        for start, end in zip(lims[:-1], lims[1:]):
-            keepers[row[start]] = np.sort(col[start:end])
-        if max_step == 1:
-            return _get_clusters_st_1step(keepers, neighbors)
-        else:
-            return _get_clusters_st_multistep(keepers, neighbors,
-                                              max_step)
+def _neighbors_to_csr(neighbors):
+    """Convert a list of neighbor arrays to a CSR adjacency matrix."""
+    indptr = np.concatenate(([0], np.cumsum([len(n) for n in neighbors])))
+    indices = np.concatenate(neighbors).astype(int) if len(neighbors) else \
+        np.array([], int)
+    return sparse.csr_matrix((np.ones(len(indices)), indices, indptr),
+                             shape=(len(neighbors), len(neighbors)))
+
+
+def _lattice_adjacency(shape):
+    """Get the adjacency of a regular lattice as a CSR matrix."""
+    n_tot = int(np.prod(shape))
+    adjacency = sparse.csr_matrix((n_tot, n_tot))
+    for ai, n in enumerate(shape):
+        chain = sparse.coo_matrix(
+            (np.ones(n - 1), (np.arange(n - 1), np.arange(1, n))), (n, n))
+        chain = sparse.kron(chain + chain.T,
+                            sparse.eye(int(np.prod(shape[ai + 1:]))))
+        adjacency = adjacency + sparse.kron(
+            sparse.eye(int(np.prod(shape[:ai]))), chain)
+    return adjacency.tocsr()
+
+
+def _get_tfce_scores(x, thresholds, tail, adjacency, max_step, include,
+                     h_power, e_power):
+    """Compute TFCE scores for all thresholds in a single sweep."""
+    # express all adjacencies as spatial neighbors for time x space data
+    if adjacency is None:
+        neighbors = _lattice_adjacency(x.shape[1:])
+        max_step = 1
+    elif adjacency is False:
+        neighbors = sparse.csr_matrix((x.size, x.size))
+    elif _is_st_adjacency(adjacency):
+        neighbors = adjacency
+        if isinstance(neighbors, list):
+            neighbors = _neighbors_to_csr(neighbors)
     else:
-        return []
+        neighbors = (adjacency + adjacency.transpose()).tocsr()
+    n_src = neighbors.shape[0]
+    n_times = x.size // n_src
+    if n_times == 1:
+        max_step = 0
+    x = x.ravel()
+    include = np.ravel(include)
+    thresholds = np.asarray(thresholds, float)
+    cum_h = np.cumsum(np.abs(np.diff(thresholds, prepend=0.)) ** h_power)
+    scores = np.zeros(x.size)
+    # cluster the negative values of -x for negative thresholds
+    sign = -1 if tail == -1 else 1
+    levels = sign * thresholds
+    for y in ([x, -x] if tail == 0 else [sign * x]):
+        idx = np.where(np.logical_and(y > levels[0], include))[0]
+        order = idx[np.argsort(-y[idx], kind='stable')]
+        lookup = np.full(x.size, -1, np.int64)
+        lookup[order] = np.arange(len(order))
+        scores[order] += _get_tfce_sweep(
+            order, lookup, y[order], levels, cum_h, neighbors.indptr,
+            neighbors.indices, n_src, n_times, max_step, e_power)
+    return scores
 
 
 def _get_components(x_in, adjacency, return_list=True):
@@ -329,11 +343,11 @@ def _find_clusters(x, threshold, tail=0, adjacency=None, max_step=1,
         threshold-free cluster enhancement.
     tail : -1 | 0 | 1
         Type of comparison
-    adjacency : scipy.sparse.coo_matrix, None, or list
-        Defines adjacency between features. The matrix is assumed to
+    adjacency : scipy.sparse.coo_matrix, scipy.sparse.csr_matrix, None, or list
+        Defines adjacency between features. The COO matrix is assumed to
         be symmetric and only the upper triangular half is used.
-        If adjacency is a list, it is assumed that each entry stores the
-        indices of the spatial neighbors in a spatio-temporal dataset x.
+        If adjacency is a CSR matrix or a list, it is assumed to store the
+        spatial neighbors of each vertex in a spatio-temporal dataset x.
         Default is None, i.e, a regular lattice adjacency.
         False means no adjacency.
     max_step : int
@@ -421,6 +435,12 @@ def _find_clusters(x, threshold, tail=0, adjacency=None, max_step=1,
     if tail == -1 and not np.all(np.diff(thresholds) < 0):
         raise ValueError('Thresholds must be monotonically decreasing')
 
+    if tfce and has_numba and len(thresholds) > 0:
+        # sweep all thresholds at once instead of clustering at each one
+        scores = _get_tfce_scores(x, thresholds, tail, adjacency, max_step,
+                                  include, h_power, e_power)
+        thresholds = list()
+
     # set these here just in case thresholds == []
     clusters = list()
     sums = list()
@@ -454,8 +474,8 @@ def _find_clusters(x, threshold, tail=0, adjacency=None, max_step=1,
                 # triage based on cluster storage type
                 if isinstance(c, slice):
                     len_c = c.stop - c.start
-                elif isinstance(c, tuple):
-                    len_c = len(c)
+                elif isinstance(c, tuple):  # slices from find_objects
+                    len_c = np.prod([sl.stop - sl.start for sl in c])
                 elif c.dtype == bool:
                     len_c = np.sum(c)
                 else:
@@ -475,7 +495,7 @@ def _find_clusters(x, threshold, tail=0, adjacency=None, max_step=1,
                 clusters = [(clusters == ii).ravel()
                             for ii in range(len(clusters))]
         else:
-            clusters = [np.array([c]) for c in clusters]
+            clusters = list(clusters[:, np.newaxis])
         sums = scores
     return clusters, sums
 
@@ -483,7 +503,14 @@ def _find_clusters(x, threshold, tail=0, adjacency=None, max_step=1,
 def _find_clusters_1dir_parts(x, x_in, adjacency, max_step, partitions,
                               t_power, ndimage):
     """Deal with partitions, and pass the work to _find_clusters_1dir."""
-    if partitions is None:
+    if _is_st_adjacency(adjacency):
+        # spatio-temporal clusters never span partitions, find them at once
+        if x.ndim > 1:
+            raise Exception("Data should be 1D when using a adjacency "
+                            "to define clusters.")
+        clusters, sums = _get_clusters_st(x, x_in, adjacency, max_step,
+                                          t_power, partitions)
+    elif partitions is None:
         clusters, sums = _find_clusters_1dir(x, x_in, adjacency, max_step,
                                              t_power, ndimage)
     else:
@@ -500,6 +527,11 @@ def _find_clusters_1dir_parts(x, x_in, adjacency, max_step, partitions,
     return clusters, sums
 
 
+def _is_st_adjacency(adjacency):
+    """Check if adjacency holds spatial neighbors for spatio-temporal data."""
+    return isinstance(adjacency, list) or sparse.isspmatrix_csr(adjacency)
+
+
 def _find_clusters_1dir(x, x_in, adjacency, max_step, t_power, ndimage):
     """Actually call the clustering algorithm."""
     if adjacency is None:
@@ -535,10 +567,10 @@ def _find_clusters_1dir(x, x_in, adjacency, max_step, t_power, ndimage):
         if x.ndim > 1:
             raise Exception("Data should be 1D when using a adjacency "
                             "to define clusters.")
-        if isinstance(adjacency, sparse.spmatrix) or adjacency is False:
+        if _is_st_adjacency(adjacency):  # use temporal adjacency
+            return _get_clusters_st(x, x_in, adjacency, max_step, t_power)
+        elif isinstance(adjacency, sparse.spmatrix) or adjacency is False:
             clusters = _get_components(x_in, adjacency)
-        elif isinstance(adjacency, list):  # use temporal adjacency
-            clusters = _get_clusters_st(x_in, adjacency, max_step)
         else:
             raise ValueError('adjacency must be a sparse matrix or list')
         if t_power == 1:
@@ -600,12 +632,159 @@ def _setup_adjacency(adjacency, n_tests, n_times):
                 % (adjacency.shape[0], n_tests))
         # we claim to only use upper triangular part... not true here
         adjacency = (adjacency + adjacency.transpose()).tocsr()
-        adjacency = [
-            adjacency.indices[adjacency.indptr[i]:adjacency.indptr[i + 1]]
-            for i in range(len(adjacency.indptr) - 1)]
     return adjacency
 
 
+# Approximate number of bytes to use for the block of permutations that is
+# evaluated at once with the built-in statistics
+_PERM_BLOCK_SIZE = 20e6
+
+
+def _get_n_perm_block(n_vars, n_rows):
+    """Get the number of permutations to evaluate at once."""
+    return max(int(_PERM_BLOCK_SIZE // (8 * n_vars * n_rows)), 1)
+
+
+def _block_dtype(X):
+    """Get the dtype to use for matrix products with X without copying it."""
+    return np.float32 if X.dtype == np.float32 else np.float64
+
+
+def _sum_squares(X):
+    """Get the double precision sum of squares of each column of X."""
+    return np.einsum('ij,ij->j', X, X, dtype=np.float64)
+
+
+def _ttest_1samp_signs(X, X2, signs):
+    """Compute ttest_1samp_no_p for a block of sign flips of X."""
+    n_samp = X.shape[0]
+    mean = np.dot(signs, X).astype(np.float64, copy=False) / n_samp
+    # the sum of squares does not depend on the signs
+    var = (X2 - n_samp * mean * mean) / (n_samp - 1)
+    np.maximum(var, 0, out=var)
+    mean /= np.sqrt(var / n_samp)
+    return mean
+
+
+def _f_oneway_orders(X_full, X2, X_sum, orders, slices):
+    """Compute f_oneway for a block of permutations of X_full."""
+    n_samp = X_full.shape[0]
+    n_perm, n_classes = len(orders), len(slices)
+    # group sums of each permutation as a single matrix product
+    members = np.zeros((n_perm, n_classes, n_samp), _block_dtype(X_full))
+    rows = np.arange(n_perm)[:, np.newaxis]
+    for ki, s in enumerate(slices):
+        members[rows, ki, orders[:, s]] = 1.
+    sums_args = np.dot(members.reshape(-1, n_samp), X_full).astype(
+        np.float64, copy=False)
+    sums_args.shape = (n_perm, n_classes, -1)
+    n_samples_per_class = np.array([s.stop - s.start for s in slices])
+    square_of_sums_alldata = X_sum ** 2 / float(n_samp)
+    ssbn = np.sum(sums_args ** 2 / n_samples_per_class[:, np.newaxis],
+                  axis=1)
+    ssbn -= square_of_sums_alldata
+    sswn = X2 - square_of_sums_alldata - ssbn
+    msb = ssbn / float(n_classes - 1)
+    msw = sswn / float(n_samp - n_classes)
+    return msb / msw
+
+
+def _max_cluster_sums(t_obs_surr, threshold, tail, adjacency, max_step,
+                      include, partitions, t_power, sample_shape, signed):
+    """Get the max cluster statistic of each permutation in a block.
+
+    If ``signed``, the (signed) cluster statistic with the largest absolute
+    value is returned for each permutation, otherwise the largest one.
+    """
+    n_perm = len(t_obs_surr)
+    out = np.zeros(n_perm)
+    if isinstance(threshold, dict) or (adjacency is not None and
+                                       adjacency is not False):
+        for pi, t in enumerate(t_obs_surr):
+            if adjacency is None:
+                t = t.reshape(sample_shape)
+            sums = _find_clusters(t, threshold=threshold, tail=tail,
+                                  max_step=max_step, adjacency=adjacency,
+                                  partitions=partitions, include=include,
+                                  t_power=t_power)[1]
+            if len(sums) > 0:
+                out[pi] = sums[np.argmax(np.abs(sums))] if signed \
+                    else np.max(sums)
+        return out
+
+    # Label all permutations at once, without adjacency between them
+    from scipy import ndimage
+    if adjacency is None:
+        shape = tuple(sample_shape)
+    else:
+        shape = (t_obs_surr.shape[1],)
+    x = t_obs_surr.reshape((n_perm,) + shape)
+    structure = np.zeros((3,) * (len(shape) + 1), bool)
+    if adjacency is None:
+        structure[1] = ndimage.generate_binary_structure(len(shape), 1)
+    else:  # each point is its own cluster
+        structure[(1,) * structure.ndim] = True
+    if tail == 0:
+        x_ins = [x > threshold, x < -threshold]
+    elif tail == -1:
+        x_ins = [x < threshold]
+    else:  # tail == 1
+        x_ins = [x > threshold]
+    if include is not None:
+        include = np.reshape(include, shape)
+        for x_in in x_ins:
+            x_in &= include
+    if t_power != 1:
+        x = np.sign(x) * np.abs(x) ** t_power
+    perm_idx = np.broadcast_to(np.arange(n_perm)[:, np.newaxis],
+                               (n_perm, int(np.prod(shape))))
+    sums, perms = list(), list()
+    for x_in in x_ins:
+        labels, n_labels = ndimage.label(x_in, structure)
+        if n_labels > 0:
+            sums.append(ndimage.sum(x, labels, np.arange(1, n_labels + 1)))
+            label_perms = np.empty(n_labels + 1, int)
+            label_perms[labels.reshape(n_perm, -1)] = perm_idx
+            perms.append(label_perms[1:])
+    if len(sums) > 0:
+        sums, perms = np.concatenate(sums), np.concatenate(perms)
+        # like np.argmax, pick the first of equal maxima in each permutation
+        key = np.abs(sums) if signed else sums
+        order = np.lexsort((-np.arange(len(sums)), key, perms))
+        perms, sums = perms[order], sums[order]
+        last = np.append(perms[1:] != perms[:-1], True)
+        out[perms[last]] = sums[last]
+    return out
+
+
+def _permute_rows(X, perm):
+    """Do ``X[:] = X[perm]`` in place, one row at a time."""
+    done = np.zeros(len(perm), bool)
+    row = np.empty_like(X[0])
+    for start in range(len(perm)):
+        if done[start]:
+            continue
+        # walk along the cycle of the permutation that contains start
+        row[:] = X[start]
+        ii = start
+        while perm[ii] != start:
+            done[ii] = True
+            X[ii] = X[perm[ii]]
+            ii = perm[ii]
+        done[ii] = True
+        X[ii] = row
+
+
+def _buffered_stat(stat_fun, X, buffer_size):
+    """Apply stat_fun to views of buffer_size variables at a time."""
+    n_vars = X[0].shape[1]
+    t_obs_surr = np.empty(n_vars, dtype=X[0].dtype)
+    for pos in range(0, n_vars, buffer_size):
+        t_obs_surr[pos:pos + buffer_size] = stat_fun(
+            *[x[:, pos:pos + buffer_size] for x in X])
+    return t_obs_surr
+
+
 def _do_permutations(X_full, slices, threshold, tail, adjacency, stat_fun,
                      max_step, include, partitions, t_power, orders,
                      sample_shape, buffer_size, progress_bar):
@@ -617,55 +796,90 @@ def _do_permutations(X_full, slices, threshold, tail, adjacency, stat_fun,
     # allocate space for output
     max_cluster_sums = np.empty(len(orders), dtype=np.double)
 
-    if buffer_size is not None:
+    if stat_fun is f_oneway:
+        # evaluate blocks of permutations at once, no data copies needed
+        orders = np.array(orders, int).reshape(len(orders), n_samp)
+        X2 = _sum_squares(X_full)
+        X_sum = np.sum(X_full, axis=0, dtype=np.float64)
+        n_block = _get_n_perm_block(n_vars, len(slices) + 2)
+        for start in range(0, len(orders), n_block):
+            block = slice(start, min(start + n_block, len(orders)))
+            t_obs_surr = _f_oneway_orders(X_full, X2, X_sum, orders[block],
+                                          slices)
+            max_cluster_sums[block] = _max_cluster_sums(
+                t_obs_surr, threshold, tail, adjacency, max_step, include,
+                partitions, t_power, sample_shape, signed=False)
+            progress_bar.update(block.stop)
+        return max_cluster_sums
+
+    # be careful about non-writable memmap (GH#1507)
+    inplace = X_full.flags.writeable
+    if inplace:
+        # permute the rows of X_full in place and pass views of it to
+        # stat_fun, so the data are never duplicated
+        current = np.arange(n_samp)  # X_full is the original X_full[current]
+    elif buffer_size is not None:
         # allocate buffer, so we don't need to allocate memory during loop
         X_buffer = [np.empty((len(X_full[s]), buffer_size), dtype=X_full.dtype)
                     for s in slices]
 
-    for seed_idx, order in enumerate(orders):
-        # shuffle sample indices
-        assert order is not None
-        idx_shuffle_list = [order[s] for s in slices]
-
-        if buffer_size is None:
-            # shuffle all data at once
-            X_shuffle_list = [X_full[idx, :] for idx in idx_shuffle_list]
-            t_obs_surr = stat_fun(*X_shuffle_list)
-        else:
-            # only shuffle a small data buffer, so we need less memory
-            t_obs_surr = np.empty(n_vars, dtype=X_full.dtype)
-
-            for pos in range(0, n_vars, buffer_size):
-                # number of variables for this loop
-                n_var_loop = min(pos + buffer_size, n_vars) - pos
-
-                # fill buffer
-                for i, idx in enumerate(idx_shuffle_list):
-                    X_buffer[i][:, :n_var_loop] =\
-                        X_full[idx, pos: pos + n_var_loop]
-
-                # apply stat_fun and store result
-                tmp = stat_fun(*X_buffer)
-                t_obs_surr[pos: pos + n_var_loop] = tmp[:n_var_loop]
-
-        # The stat should have the same shape as the samples for no adj.
-        if adjacency is None:
-            t_obs_surr.shape = sample_shape
-
-        # Find cluster on randomized stats
-        out = _find_clusters(t_obs_surr, threshold=threshold, tail=tail,
-                             max_step=max_step, adjacency=adjacency,
-                             partitions=partitions, include=include,
-                             t_power=t_power)
-        perm_clusters_sums = out[1]
-
-        if len(perm_clusters_sums) > 0:
-            max_cluster_sums[seed_idx] = np.max(perm_clusters_sums)
-        else:
-            max_cluster_sums[seed_idx] = 0
-
-        progress_bar.update(seed_idx + 1)
+    try:
+        for seed_idx, order in enumerate(orders):
+            # shuffle sample indices
+            assert order is not None
+            order = np.asarray(order)
+            if inplace:
+                _permute_rows(X_full, np.argsort(current)[order])
+                current = order
+                X_shuffle_list = [X_full[s] for s in slices]
+            idx_shuffle_list = [order[s] for s in slices]
+
+            if buffer_size is None:
+                if not inplace:
+                    # shuffle all data at once
+                    X_shuffle_list = [X_full[idx, :]
+                                      for idx in idx_shuffle_list]
+                t_obs_surr = stat_fun(*X_shuffle_list)
+            elif inplace:
+                t_obs_surr = _buffered_stat(stat_fun, X_shuffle_list,
+                                            buffer_size)
+            else:
+                # only shuffle a small data buffer, so we need less memory
+                t_obs_surr = np.empty(n_vars, dtype=X_full.dtype)
+
+                for pos in range(0, n_vars, buffer_size):
+                    # number of variables for this loop
+                    n_var_loop = min(pos + buffer_size, n_vars) - pos
+
+                    # fill buffer
+                    for i, idx in enumerate(idx_shuffle_list):
+                        X_buffer[i][:, :n_var_loop] =\
+                            X_full[idx, pos: pos + n_var_loop]
+
+                    # apply stat_fun and store result
+                    tmp = stat_fun(*X_buffer)
+                    t_obs_surr[pos: pos + n_var_loop] = tmp[:n_var_loop]
+
+            # The stat should have the same shape as the samples for no adj.
+            if adjacency is None:
+                t_obs_surr.shape = sample_shape
+
+            # Find cluster on randomized stats
+            out = _find_clusters(t_obs_surr, threshold=threshold, tail=tail,
+                                 max_step=max_step, adjacency=adjacency,
+                                 partitions=partitions, include=include,
+                                 t_power=t_power)
+            perm_clusters_sums = out[1]
+
+            if len(perm_clusters_sums) > 0:
+                max_cluster_sums[seed_idx] = np.max(perm_clusters_sums)
+            else:
+                max_cluster_sums[seed_idx] = 0
 
+            progress_bar.update(seed_idx + 1)
+    finally:
+        if inplace:  # restore the original order of the rows
+            _permute_rows(X_full, np.argsort(current))
     return max_cluster_sums
 
 
@@ -681,7 +895,26 @@ def _do_1samp_permutations(X, slices, threshold, tail, adjacency, stat_fun,
     # allocate space for output
     max_cluster_sums = np.empty(len(orders), dtype=np.double)
 
-    if buffer_size is not None:
+    if stat_fun is ttest_1samp_no_p:
+        # evaluate blocks of sign flips at once, no data copies needed
+        signs = 2 * np.array(orders, int).reshape(len(orders), n_samp) - 1
+        if not np.all(np.equal(np.abs(signs), 1)):
+            raise ValueError('signs from rng must be +/- 1')
+        signs = signs.astype(_block_dtype(X))
+        X2 = _sum_squares(X)
+        n_block = _get_n_perm_block(n_vars, 3)
+        for start in range(0, len(signs), n_block):
+            block = slice(start, min(start + n_block, len(signs)))
+            t_obs_surr = _ttest_1samp_signs(X, X2, signs[block])
+            max_cluster_sums[block] = _max_cluster_sums(
+                t_obs_surr, threshold, tail, adjacency, max_step, include,
+                partitions, t_power, sample_shape, signed=True)
+            progress_bar.update(block.stop)
+        return max_cluster_sums
+
+    # be careful about non-writable memmap (GH#1507)
+    inplace = X.flags.writeable
+    if buffer_size is not None and not inplace:
         # allocate a buffer so we don't need to allocate memory in loop
         X_flip_buffer = np.empty((n_samp, buffer_size), dtype=X.dtype)
 
@@ -693,16 +926,20 @@ def _do_1samp_permutations(X, slices, threshold, tail, adjacency, stat_fun,
         if not np.all(np.equal(np.abs(signs), 1)):
             raise ValueError('signs from rng must be +/- 1')
 
-        if buffer_size is None:
-            # be careful about non-writable memmap (GH#1507)
-            if X.flags.writeable:
-                X *= signs
+        if inplace:
+            X *= signs
+            try:
                 # Recompute statistic on randomized data
-                t_obs_surr = stat_fun(X)
-                # Set X back to previous state (trade memory eff. for CPU use)
+                if buffer_size is None:
+                    t_obs_surr = stat_fun(X)
+                else:
+                    t_obs_surr = _buffered_stat(stat_fun, [X], buffer_size)
+            finally:
+                # Set X back to previous state (trade memory eff. for CPU
+                # use), also if stat_fun fails
                 X *= signs
-            else:
-                t_obs_surr = stat_fun(X * signs)
+        elif buffer_size is None:
+            t_obs_surr = stat_fun(X * signs)
         else:
             # only sign-flip a small data buffer, so we need less memory
             t_obs_surr = np.empty(n_vars, dtype=X.dtype)
@@ -820,13 +1057,16 @@ def _get_1samp_orders(n_samples, n_permutations, tail, rng):
 def _permutation_cluster_test(X, threshold, n_permutations, tail, stat_fun,
                               adjacency, n_jobs, seed, max_step,
                               exclude, step_down_p, t_power, out_type,
-                              check_disjoint, buffer_size):
+                              check_disjoint, buffer_size, stop_alpha=None,
+                              perm_range=None, fname=None, overwrite=False):
     n_jobs = check_n_jobs(n_jobs)
+    stop_alpha = _check_stop_alpha(stop_alpha)
     """Aux Function.
 
     Note. X is required to be a list. Depending on the length of X
     either a 1 sample t-test or an F test / more sample permutation scheme
-    is elicited.
+    is elicited. If perm_range is given, only these permutations are run
+    and saved to fname (see permutation_cluster_slice).
     """
     _check_option('out_type', out_type, ['mask', 'indices'])
     _check_option('tail', tail, [-1, 0, 1])
@@ -925,7 +1165,6 @@ def _permutation_cluster_test(X, threshold, n_permutations, tail, stat_fun,
     # (for a two-tailed test, we can exploit symmetry to just do half)
     extra = ''
     rng = check_random_state(seed)
-    del seed
     if len(X) == 1:  # 1-sample test
         do_perm_func = _do_1samp_permutations
         X_full = X[0]
@@ -946,6 +1185,43 @@ def _permutation_cluster_test(X, threshold, n_permutations, tail, stat_fun,
     parallel, my_do_perm_func, _ = parallel_func(
         do_perm_func, n_jobs, verbose=False)
 
+    if perm_range is not None:
+        # only compute a (resumable) slice of the permutations
+        start, stop = perm_range[0], min(perm_range[1], len(orders))
+        if start > len(orders):
+            raise ValueError('start (%d) must not exceed the number of '
+                             'permutations (%d)' % (start, len(orders)))
+        info = dict(seed=seed, n_permutations=n_permutations, tail=tail,
+                    n_orders=len(orders), start=start, stop=stop,
+                    cluster_stats=cluster_stats)
+        H0 = _read_permutation_slice(fname, info) if not overwrite else None
+        if H0 is None:
+            fname = _check_fname(fname, overwrite)
+            orders = orders[start:stop]
+            H0 = np.array([])
+            if len(clusters) > 0 and len(orders) > 0:
+                logger.info('Permuting %d times (%d to %d)%s...'
+                            % (len(orders), start, stop, extra))
+                with ProgressBar(len(orders)) as progress_bar:
+                    H0 = np.concatenate(parallel(
+                        my_do_perm_func(X_full, slices, threshold, tail,
+                                        adjacency, stat_fun, max_step,
+                                        include, partitions, t_power, order,
+                                        sample_shape, buffer_size,
+                                        progress_bar.subset(idx))
+                        for idx, order in split_list(orders, n_jobs,
+                                                     idx=True)))
+            # write to a temporary file first so that a job interrupted
+            # while saving does not leave a broken slice behind
+            with open(fname + '.tmp', 'wb') as fid:
+                np.savez(fid, H0=H0, **info)
+            os.replace(fname + '.tmp', fname)
+        if len(clusters) == 0:
+            warn('No clusters found, returning empty H0 and clusters')
+            return t_obs, np.array([]), H0
+        return t_obs, _reshape_clusters(clusters, sample_shape), H0
+    del seed
+
     if len(clusters) == 0:
         warn('No clusters found, returning empty H0, clusters, and cluster_pv')
         return t_obs, np.array([]), np.array([]), np.array([])
@@ -968,13 +1244,26 @@ def _permutation_cluster_test(X, threshold, n_permutations, tail, stat_fun,
         else:
             this_include = step_down_include
         logger.info('Permuting %d times%s...' % (len(orders), extra))
+        # with sequential stopping, check the p-values after each block
+        n_block = max(len(orders), 1) if stop_alpha is None else _STOP_N_BLOCK
+        H0 = list()
         with ProgressBar(len(orders)) as progress_bar:
-            H0 = parallel(
-                my_do_perm_func(X_full, slices, threshold, tail, adjacency,
-                                stat_fun, max_step, this_include, partitions,
-                                t_power, order, sample_shape, buffer_size,
-                                progress_bar.subset(idx))
-                for idx, order in split_list(orders, n_jobs, idx=True))
+            for start in range(0, len(orders), n_block):
+                H0.extend(parallel(
+                    my_do_perm_func(X_full, slices, threshold, tail,
+                                    adjacency, stat_fun, max_step,
+                                    this_include, partitions, t_power, order,
+                                    sample_shape, buffer_size,
+                                    progress_bar.subset(start + idx))
+                    for idx, order in split_list(
+                        orders[start:start + n_block], n_jobs, idx=True)))
+                if stop_alpha is not None and start + n_block < len(orders):
+                    if _stop_permuting(np.concatenate(H0), cluster_stats,
+                                       tail, stop_alpha):
+                        logger.info('Stopping after %d permutations, all '
+                                    'p-values are resolved at alpha=%s'
+                                    % (start + n_block, stop_alpha))
+                        break
         # include original (true) ordering
         if tail == -1:  # up tail
             orig = cluster_stats.min()
@@ -1009,6 +1298,20 @@ def _permutation_cluster_test(X, threshold, n_permutations, tail, stat_fun,
     return t_obs, clusters, cluster_pv, H0
 
 
+def _read_permutation_slice(fname, info):
+    """Read the H0 of a permutation slice if it was already computed."""
+    if not op.isfile(fname):
+        return None
+    with np.load(fname) as npz:
+        saved = {key: npz[key] for key in npz.files}
+    if set(saved) != set(info) | {'H0'} or not all(
+            np.array_equal(saved[key], val) for key, val in info.items()):
+        return None
+    logger.info('Loading permutations %d to %d from %s'
+                % (info['start'], info['stop'], fname))
+    return saved['H0']
+
+
 def _check_fun(X, stat_fun, threshold, tail=0, kind='within'):
     """Check the stat_fun and threshold values."""
     from scipy import stats
@@ -1048,7 +1351,7 @@ def permutation_cluster_test(
         X, threshold=None, n_permutations=1024, tail=0, stat_fun=None,
         adjacency=None, n_jobs=1, seed=None, max_step=1, exclude=None,
         step_down_p=0, t_power=1, out_type='indices', check_disjoint=False,
-        buffer_size=1000, verbose=None):
+        buffer_size=1000, stop_alpha=None, verbose=None):
     """Cluster-level statistical permutation test.
 
     For a list of :class:`NumPy arrays <numpy.ndarray>` of data,
@@ -1090,6 +1393,7 @@ def permutation_cluster_test(
     %(clust_out_none)s
     %(clust_disjoint)s
     %(clust_buffer)s
+    %(clust_stop)s
     %(verbose)s
 
     Returns
@@ -1113,7 +1417,7 @@ def permutation_cluster_test(
         stat_fun=stat_fun, adjacency=adjacency, n_jobs=n_jobs, seed=seed,
         max_step=max_step, exclude=exclude, step_down_p=step_down_p,
         t_power=t_power, out_type=out_type, check_disjoint=check_disjoint,
-        buffer_size=buffer_size)
+        buffer_size=buffer_size, stop_alpha=stop_alpha)
 
 
 @verbose
@@ -1121,7 +1425,7 @@ def permutation_cluster_1samp_test(
         X, threshold=None, n_permutations=1024, tail=0, stat_fun=None,
         adjacency=None, n_jobs=1, seed=None, max_step=1,
         exclude=None, step_down_p=0, t_power=1, out_type='indices',
-        check_disjoint=False, buffer_size=1000, verbose=None):
+        check_disjoint=False, buffer_size=1000, stop_alpha=None, verbose=None):
     """Non-parametric cluster-level paired t-test.
 
     Parameters
@@ -1150,6 +1454,7 @@ def permutation_cluster_1samp_test(
     %(clust_out_none)s
     %(clust_disjoint)s
     %(clust_buffer)s
+    %(clust_stop)s
     %(verbose)s
 
     Returns
@@ -1197,7 +1502,7 @@ def permutation_cluster_1samp_test(
         stat_fun=stat_fun, adjacency=adjacency, n_jobs=n_jobs, seed=seed,
         max_step=max_step, exclude=exclude, step_down_p=step_down_p,
         t_power=t_power, out_type=out_type, check_disjoint=check_disjoint,
-        buffer_size=buffer_size)
+        buffer_size=buffer_size, stop_alpha=stop_alpha)
 
 
 @verbose
@@ -1206,7 +1511,7 @@ def spatio_temporal_cluster_1samp_test(
         stat_fun=None, adjacency=None, n_jobs=1, seed=None,
         max_step=1, spatial_exclude=None, step_down_p=0, t_power=1,
         out_type='indices', check_disjoint=False, buffer_size=1000,
-        verbose=None):
+        stop_alpha=None, verbose=None):
     """Non-parametric cluster-level paired t-test for spatio-temporal data.
 
     This function provides a convenient wrapper for
@@ -1234,6 +1539,7 @@ def spatio_temporal_cluster_1samp_test(
     %(clust_out)s
     %(clust_disjoint)s
     %(clust_buffer)s
+    %(clust_stop)s
     %(verbose)s
 
     Returns
@@ -1263,7 +1569,8 @@ def spatio_temporal_cluster_1samp_test(
         n_permutations=n_permutations, adjacency=adjacency,
         n_jobs=n_jobs, seed=seed, max_step=max_step, exclude=exclude,
         step_down_p=step_down_p, t_power=t_power, out_type=out_type,
-        check_disjoint=check_disjoint, buffer_size=buffer_size)
+        check_disjoint=check_disjoint, buffer_size=buffer_size,
+        stop_alpha=stop_alpha)
 
 
 @verbose
@@ -1272,7 +1579,7 @@ def spatio_temporal_cluster_test(
         adjacency=None, n_jobs=1, seed=None, max_step=1,
         spatial_exclude=None, step_down_p=0, t_power=1, out_type='indices',
         check_disjoint=False, buffer_size=1000,
-        verbose=None):
+        stop_alpha=None, verbose=None):
     """Non-parametric cluster-level test for spatio-temporal data.
 
     This function provides a convenient wrapper for
@@ -1303,6 +1610,7 @@ def spatio_temporal_cluster_test(
     %(clust_out)s
     %(clust_disjoint)s
     %(clust_buffer)s
+    %(clust_stop)s
     %(verbose)s
 
     Returns
@@ -1332,7 +1640,187 @@ def spatio_temporal_cluster_test(
         n_permutations=n_permutations, adjacency=adjacency,
         n_jobs=n_jobs, seed=seed, max_step=max_step, exclude=exclude,
         step_down_p=step_down_p, t_power=t_power, out_type=out_type,
-        check_disjoint=check_disjoint, buffer_size=buffer_size)
+        check_disjoint=check_disjoint, buffer_size=buffer_size,
+        stop_alpha=stop_alpha)
+
+
+@verbose
+def permutation_cluster_slice(
+        fname, X, start, stop, threshold=None, n_permutations=1024, tail=0,
+        stat_fun=None, adjacency=None, n_jobs=1, seed=0, max_step=1,
+        exclude=None, t_power=1, out_type='indices', check_disjoint=False,
+        buffer_size=1000, overwrite=False, verbose=None):
+    """Compute a slice of the permutations of a cluster-level test.
+
+    This runs the permutations ``start`` to ``stop`` of the test performed
+    by :func:`permutation_cluster_1samp_test` (if ``X`` is an array) or
+    :func:`permutation_cluster_test` (if ``X`` is a list of arrays), and saves
+    the corresponding part of ``H0`` to disk. The permutations are fully
+    determined by their index, ``seed`` and ``n_permutations``, so slices
+    can be computed by separate jobs and combined with
+    :func:`merge_permutation_slices` to obtain the same result as a single
+    call to the test function with the same ``seed``.
+
+    Parameters
+    ----------
+    fname : path-like
+        The ``.npz`` file to save the slice to. If the file already contains
+        this slice of the same test (e.g., when a job is restarted), it is
+        loaded instead of being recomputed.
+    X : array, shape (n_observations, p[, q]) | list of array
+        The data to be clustered, as in
+        :func:`permutation_cluster_1samp_test` (array) or
+        :func:`permutation_cluster_test` (list of arrays, one per group).
+    start : int
+        Index of the first permutation to compute.
+    stop : int
+        Index after the last permutation to compute. Values larger than the
+        number of permutations are clipped.
+    threshold : float | dict | None
+        The threshold, see :func:`permutation_cluster_1samp_test` and
+        :func:`permutation_cluster_test`.
+    n_permutations : int | 'all'
+        The total number of permutations of the test. ``'all'`` is only
+        supported for one-sample tests.
+    %(clust_tail)s
+    stat_fun : callable | None
+        The statistic, see :func:`permutation_cluster_1samp_test` and
+        :func:`permutation_cluster_test`.
+    adjacency : scipy.sparse.spmatrix | None | False
+        The adjacency, see :func:`permutation_cluster_1samp_test` and
+        :func:`permutation_cluster_test`.
+    %(n_jobs)s
+    seed : int
+        Seed of the random number generator. It must be an integer so that
+        all slices use the same permutations.
+    %(clust_maxstep)s
+    exclude : bool array or None
+        Mask to apply to the data to exclude certain points from clustering
+        (e.g., medial wall vertices). Should be the same shape as X. If None,
+        no points are excluded.
+    t_power : float
+        Power to raise the statistical values by before summing, see
+        :func:`permutation_cluster_1samp_test`.
+    %(clust_out_none)s
+    %(clust_disjoint)s
+    %(clust_buffer)s
+    overwrite : bool
+        If True, recompute the slice and overwrite ``fname`` even if it
+        already contains this slice. If False (default), a file that contains
+        anything else raises an error.
+    %(verbose)s
+
+    Returns
+    -------
+    stat_obs : array, shape (n_tests,)
+        Statistic observed for all variables.
+    clusters : list
+        List type defined by out_type above.
+    H0 : array, shape (n_slice_permutations,)
+        Max cluster level stats observed under the permutations of the
+        slice.
+
+    See Also
+    --------
+    merge_permutation_slices
+
+    Notes
+    -----
+    The step-down-in-jumps procedure (``step_down_p``) requires all
+    permutations at once and is thus not supported.
+
+    .. versionadded:: 0.23
+    """
+    _validate_type(seed, 'int', 'seed')
+    start, stop = int(start), int(stop)
+    if not 0 <= start <= stop:
+        raise ValueError('start and stop must satisfy 0 <= start <= stop, '
+                         'got %d and %d' % (start, stop))
+    fname = _check_fname(fname, overwrite='read')
+    kind = 'between' if isinstance(X, (list, tuple)) else 'within'
+    stat_fun, threshold = _check_fun(X, stat_fun, threshold, tail, kind)
+    if kind == 'within':
+        X = [X]
+    elif len(X) < 2:
+        raise ValueError('X must contain at least two groups, got %d'
+                         % (len(X),))
+    return _permutation_cluster_test(
+        X=X, threshold=threshold, n_permutations=n_permutations, tail=tail,
+        stat_fun=stat_fun, adjacency=adjacency, n_jobs=n_jobs, seed=seed,
+        max_step=max_step, exclude=exclude, step_down_p=0, t_power=t_power,
+        out_type=out_type, check_disjoint=check_disjoint,
+        buffer_size=buffer_size, perm_range=(start, stop), fname=fname,
+        overwrite=overwrite)
+
+
+@verbose
+def merge_permutation_slices(fnames, verbose=None):
+    """Merge slices of a cluster-level permutation test.
+
+    Parameters
+    ----------
+    fnames : list of path-like
+        The files saved by :func:`permutation_cluster_slice`, in any order.
+        Together, they must contain each permutation of the test once.
+    %(verbose)s
+
+    Returns
+    -------
+    cluster_pv : array
+        P-value for each cluster.
+    H0 : array, shape (n_permutations,)
+        Max cluster level stats observed under permutation.
+
+    See Also
+    --------
+    permutation_cluster_slice
+
+    Notes
+    -----
+    .. versionadded:: 0.23
+    """
+    slices = list()
+    for fname in fnames:
+        fname = _check_fname(fname, overwrite='read', must_exist=True)
+        with np.load(fname) as npz:
+            slices.append({key: npz[key] for key in npz.files})
+    if len(slices) == 0:
+        raise ValueError('fnames must contain at least one file')
+    for key in ('seed', 'n_permutations', 'tail', 'n_orders',
+                'cluster_stats'):
+        for fname, this_slice in zip(fnames, slices):
+            if not np.array_equal(this_slice[key], slices[0][key]):
+                raise ValueError('The slices come from different tests, '
+                                 '%s of %s does not match %s'
+                                 % (key, fname, fnames[0]))
+    slices = sorted(slices, key=lambda this_slice: int(this_slice['start']))
+    n_done = 0
+    for this_slice in slices:
+        if this_slice['start'] != n_done:
+            raise ValueError('Permutations %d to %d are %s'
+                             % (min(n_done, this_slice['start']),
+                                max(n_done, this_slice['start']),
+                                'missing' if this_slice['start'] > n_done
+                                else 'present more than once'))
+        n_done = int(this_slice['stop'])
+    if n_done != slices[0]['n_orders']:
+        raise ValueError('Permutations %d to %d are missing'
+                         % (n_done, slices[0]['n_orders']))
+    cluster_stats = slices[0]['cluster_stats']
+    if len(cluster_stats) == 0:
+        warn('No clusters found, returning empty H0 and cluster_pv')
+        return np.array([]), np.array([])
+    # include original (true) ordering
+    tail = int(slices[0]['tail'])
+    if tail == -1:  # up tail
+        orig = cluster_stats.min()
+    elif tail == 1:
+        orig = cluster_stats.max()
+    else:
+        orig = abs(cluster_stats).max()
+    H0 = np.concatenate([[orig]] + [this_slice['H0'] for this_slice in slices])
+    cluster_pv = _pval_from_histogram(cluster_stats, H0, tail)
+    return cluster_pv, H0
 
 
 def _st_mask_from_s_inds(n_times, n_vertices, vertices, set_as=True):
@@ -1370,12 +1858,11 @@ def _st_mask_from_s_inds(n_times, n_vertices, vertices, set_as=True):
 @verbose
 def _get_partitions_from_adjacency(adjacency, n_times, verbose=None):
     """Specify disjoint subsets (e.g., hemispheres) based on adjacency."""
-    if isinstance(adjacency, list):
-        test = np.ones(len(adjacency))
-        test_adj = np.zeros((len(adjacency), len(adjacency)), dtype='bool')
-        for vi in range(len(adjacency)):
-            test_adj[adjacency[vi], vi] = True
-        test_adj = sparse.coo_matrix(test_adj, dtype='float')
+    if _is_st_adjacency(adjacency):
+        if isinstance(adjacency, list):
+            adjacency = _neighbors_to_csr(adjacency)
+        test = np.ones(adjacency.shape[0])
+        test_adj = adjacency.tocoo()
     else:
         test = np.ones(adjacency.shape[0])
         test_adj = adjacency
@@ -1387,7 +1874,7 @@ def _get_partitions_from_adjacency(adjacency, n_times, verbose=None):
         partitions = np.zeros(len(test), dtype='int')
         for ii, pc in enumerate(part_clusts):
             partitions[pc] = ii
-        if isinstance(adjacency, list):
+        if _is_st_adjacency(adjacency):
             partitions = np.tile(partitions, n_times)
     else:
         logger.info('No disjoint adjacency sets found')
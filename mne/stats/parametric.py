@@ -4,11 +4,35 @@
 #
 # License: Simplified BSD
 
-import numpy as np
-from functools import reduce
+from functools import lru_cache
 from string import ascii_uppercase
+
+import numpy as np
 from ..utils import _check_option
 
+# Approximate number of bytes to use for the double precision temporaries of
+# the blocks of tests evaluated at once by the built-in statistics
+_STAT_BLOCK_SIZE = 20e6
+
+
+def _stat_blocks(n_samples, n_tests):
+    """Get slices of tests to evaluate a statistic in blocks."""
+    n_block = max(int(_STAT_BLOCK_SIZE // (8 * max(n_samples, 1))), 1)
+    return [slice(start, start + n_block)
+            for start in range(0, n_tests, n_block)]
+
+
+def _prepare_stat_args(*args):
+    """Reshape samples to 2D and get the output shape and dtype."""
+    args = [np.asarray(a) for a in args]
+    shape = args[0].shape[1:]
+    # single precision data gives single precision statistics
+    dtype = np.float32 if all(a.dtype == np.float32 for a in args) \
+        else np.float64
+    args = [a.reshape(len(a), -1) for a in args]
+    return args, shape, dtype
+
+
 # The following function is a rewriting of scipy.stats.f_oneway
 # Contrary to the scipy.stats.f_oneway implementation it does not
 # copy the data while keeping the inputs unchanged.
@@ -36,7 +60,8 @@ def ttest_1samp_no_p(X, sigma=0, method='relative'):
     Returns
     -------
     t : array
-        T-values, potentially adjusted using the hat method.
+        T-values, potentially adjusted using the hat method. Single precision
+        if ``X`` is single precision, double precision otherwise.
 
     Notes
     -----
@@ -56,11 +81,22 @@ def ttest_1samp_no_p(X, sigma=0, method='relative'):
     .. footbibliography::
     """
     _check_option('method', method, ['absolute', 'relative'])
-    var = np.var(X, axis=0, ddof=1)
+    X, shape, dtype = _prepare_stat_args(X)
+    n_samples, n_tests = X[0].shape
+    X = X[0]
+    mean = np.empty(n_tests)
+    var = np.empty(n_tests)
+    # work on blocks of tests to bound the size of the temporaries
+    for sl in _stat_blocks(n_samples, n_tests):
+        mean[sl] = np.mean(X[:, sl], axis=0, dtype=np.float64)
+        var[sl] = np.var(X[:, sl], axis=0, ddof=1, dtype=np.float64)
     if sigma > 0:
         limit = sigma * np.max(var) if method == 'relative' else sigma
         var += limit
-    return np.mean(X, axis=0) / np.sqrt(var / X.shape[0])
+    var /= n_samples
+    np.sqrt(var, out=var)
+    mean /= var
+    return mean.astype(dtype, copy=False).reshape(shape)[()]
 
 
 def ttest_ind_no_p(a, b, equal_var=True, sigma=0.):
@@ -134,8 +170,9 @@ def f_oneway(*args):
 
     Returns
     -------
-    F-value : float
-        The computed F-value of the test.
+    F-value : float | array
+        The computed F-value of the test. Single precision if all samples
+        are single precision, double precision otherwise.
 
     Notes
     -----
@@ -159,26 +196,31 @@ def f_oneway(*args):
            Statistics". Chapter 14.
     .. [2] Heiman, G.W.  Research Methods in Statistics. 2002.
     """
+    args, shape, dtype = _prepare_stat_args(*args)
     n_classes = len(args)
     n_samples_per_class = np.array([len(a) for a in args])
     n_samples = np.sum(n_samples_per_class)
-    ss_alldata = reduce(lambda x, y: x + y,
-                        [np.sum(a ** 2, axis=0) for a in args])
-    sums_args = [np.sum(a, axis=0) for a in args]
-    square_of_sums_alldata = reduce(lambda x, y: x + y, sums_args) ** 2
-    square_of_sums_args = [s ** 2 for s in sums_args]
-    sstot = ss_alldata - square_of_sums_alldata / float(n_samples)
-    ssbn = 0
-    for k, _ in enumerate(args):
-        ssbn += square_of_sums_args[k] / n_samples_per_class[k]
-    ssbn -= square_of_sums_alldata / float(n_samples)
-    sswn = sstot - ssbn
-    dfbn = n_classes - 1
-    dfwn = n_samples - n_classes
-    msb = ssbn / float(dfbn)
-    msw = sswn / float(dfwn)
-    f = msb / msw
-    return f
+    n_tests = args[0].shape[1]
+    f = np.empty(n_tests, dtype)
+    # work on blocks of tests to bound the size of the temporaries
+    for sl in _stat_blocks(n_samples_per_class.max(), n_tests):
+        ss_alldata = sum_alldata = ssbn = 0
+        for a, n_samples_class in zip(args, n_samples_per_class):
+            a = a[:, sl]
+            ss_alldata += np.einsum('ij,ij->j', a, a, dtype=np.float64)
+            sums_arg = np.sum(a, axis=0, dtype=np.float64)
+            sum_alldata += sums_arg
+            ssbn += sums_arg ** 2 / n_samples_class
+        square_of_sums_alldata = sum_alldata ** 2
+        sstot = ss_alldata - square_of_sums_alldata / float(n_samples)
+        ssbn -= square_of_sums_alldata / float(n_samples)
+        sswn = sstot - ssbn
+        dfbn = n_classes - 1
+        dfwn = n_samples - n_classes
+        msb = ssbn / float(dfbn)
+        msw = sswn / float(dfwn)
+        f[sl] = msb / msw
+    return f.reshape(shape)[()]
 
 
 def _map_effects(n_factors, effects):
@@ -246,9 +288,20 @@ def _get_contrast_indices(effect_idx, n_factors):  # noqa: D401
     return np.array([int(i) for i in binrepr], dtype=int)
 
 
-def _iter_contrasts(n_subjects, factor_levels, effect_picks):
-    """Set up contrasts."""
+@lru_cache(maxsize=32)
+def _get_mway_design(factor_levels, effects):
+    """Set up the contrasts of all effects as one read-only design.
+
+    Returns the selected effect indices, the stacked contrast matrix of the
+    effects, the index of the first contrast column of each effect, the
+    numerator degrees of freedom of each effect and the matrix that sums
+    the squared entries of the diagonal blocks of the column Gram matrix for
+    each effect.
+    """
     from scipy.signal import detrend
+    if not isinstance(effects, str):
+        effects = list(effects)
+    effect_picks, _ = _map_effects(len(factor_levels), effects)
     sc = []
     n_factors = len(factor_levels)
     # prepare computation of Kronecker products
@@ -261,15 +314,26 @@ def _iter_contrasts(n_subjects, factor_levels, effect_picks):
         sc.append([np.ones([n_levels, 1]),
                    detrend(np.eye(n_levels), type='constant')])
 
+    contrasts = list()
     for this_effect in effect_picks:
         contrast_idx = _get_contrast_indices(this_effect + 1, n_factors)
         c_ = sc[0][contrast_idx[n_factors - 1]]
         for i_contrast in range(1, n_factors):
             this_contrast = contrast_idx[(n_factors - 1) - i_contrast]
             c_ = np.kron(c_, sc[i_contrast][this_contrast])
-        df1 = np.linalg.matrix_rank(c_)
-        df2 = df1 * (n_subjects - 1)
-        yield c_, df1, df2
+        contrasts.append(c_)
+    df1 = np.array([np.linalg.matrix_rank(c_) for c_ in contrasts])
+    n_cols = np.array([c_.shape[1] for c_ in contrasts])
+    starts = np.concatenate([[0], np.cumsum(n_cols)[:-1]])
+    col_effects = np.repeat(np.arange(len(contrasts)), n_cols)
+    col_effects = col_effects[:, np.newaxis] == np.arange(len(contrasts))
+    blocks = (col_effects[:, np.newaxis] &
+              col_effects[np.newaxis]).reshape(-1, len(contrasts))
+    design = (tuple(effect_picks), np.concatenate(contrasts, axis=1), starts,
+              df1, blocks.astype(np.float64))
+    for arr in design[1:]:
+        arr.flags.writeable = False
+    return design
 
 
 def f_threshold_mway_rm(n_subjects, factor_levels, effects='A*B',
@@ -311,12 +375,10 @@ def f_threshold_mway_rm(n_subjects, factor_levels, effects='A*B',
     .. versionadded:: 0.10
     """
     from scipy.stats import f
-    effect_picks, _ = _map_effects(len(factor_levels), effects)
+    df1 = _get_mway_design(*_mway_design_key(factor_levels, effects))[3]
+    df2 = df1 * (n_subjects - 1)
 
-    F_threshold = []
-    for _, df1, df2 in _iter_contrasts(n_subjects, factor_levels,
-                                       effect_picks):
-        F_threshold.append(f(df1, df2).isf(pvalue))
+    F_threshold = [f(d1, d2).isf(pvalue) for d1, d2 in zip(df1, df2)]
 
     return F_threshold if len(F_threshold) > 1 else F_threshold[0]
 
@@ -386,44 +448,55 @@ def f_mway_rm(data, factor_levels, effects='all',
         data = data.reshape(
             data.shape[0], data.shape[1], np.prod(data.shape[2:]))
 
-    effect_picks, _ = _map_effects(len(factor_levels), effects)
-    n_obs = data.shape[2]
-    n_replications = data.shape[0]
-
-    # put last axis in front to 'iterate' over mass univariate instances.
-    data = np.rollaxis(data, 2)
-    fvalues, pvalues = [], []
-    for c_, df1, df2 in _iter_contrasts(n_replications, factor_levels,
-                                        effect_picks):
-        y = np.dot(data, c_)
-        b = np.mean(y, axis=1)[:, np.newaxis, :]
-        ss = np.sum(np.sum(y * b, axis=2), axis=1)
-        mse = (np.sum(np.sum(y * y, axis=2), axis=1) - ss) / (df2 / df1)
-        fvals = ss / mse
-        fvalues.append(fvals)
+    _, contrasts, starts, df1, blocks = _get_mway_design(
+        *_mway_design_key(factor_levels, effects))
+    n_replications, n_conditions, n_obs = data.shape
+    n_effects, n_cols = len(df1), contrasts.shape[1]
+    df2 = df1 * (n_replications - 1)
+
+    # evaluate all effects for blocks of tests at once
+    fvalues = np.empty((n_effects, n_obs))
+    eps = np.empty((n_effects, n_obs)) if correction else 1.
+    n_block = max(int(_STAT_BLOCK_SIZE // (8 * (
+        n_replications * (n_conditions + n_cols) + n_cols * n_cols))), 1)
+    for start in range(0, n_obs, n_block):
+        sl = slice(start, start + n_block)
+        # put last axis in front to 'iterate' over mass univariate instances
+        y = np.dot(np.moveaxis(data[:, :, sl], 2, 0), contrasts)
+        # sums of squares of the contrast columns, then of the effects
+        ss = np.add.reduceat(n_replications * np.mean(y, axis=1) ** 2,
+                             starts, axis=1)
+        yy = np.einsum('osc,osc->oc', y, y)
+        ss_tot = np.add.reduceat(yy, starts, axis=1)
+        fvalues[:, sl] = (ss / ((ss_tot - ss) / (df2 / df1))).T
         if correction:
             # sample covariances, leave off "/ (y.shape[1] - 1)" norm because
-            # it falls out.
-            v = np.array([np.dot(y_.T, y_) for y_ in y])
-            v = (np.array([np.trace(vv) for vv in v]) ** 2 /
-                 (df1 * np.sum(np.sum(v * v, axis=2), axis=1)))
-            eps = v
+            # it falls out; only the diagonal blocks of each effect are used
+            v = np.einsum('osi,osj->oij', y, y).reshape(len(y), -1)
+            eps[:, sl] = (ss_tot ** 2 / (df1 * np.dot(v ** 2, blocks))).T
+
+    df1, df2 = df1[:, np.newaxis] * eps, df2[:, np.newaxis] * eps
+    if correction:
+        # numerical imprecision can cause eps=0.99999999999999989
+        # even with a single category, so never let our degrees of
+        # freedom drop below 1.
+        df1, df2 = [np.maximum(d, 1.) for d in (df1, df2)]
+
+    if return_pvals:
+        pvalues = f.sf(fvalues, df1, df2)
+    else:
+        pvalues = np.empty((n_effects, 0))
 
-        df1, df2 = np.zeros(n_obs) + df1, np.zeros(n_obs) + df2
-        if correction:
-            # numerical imprecision can cause eps=0.99999999999999989
-            # even with a single category, so never let our degrees of
-            # freedom drop below 1.
-            df1, df2 = [np.maximum(d[None, :] * eps, 1.) for d in (df1, df2)]
+    # handle single effect returns
+    return [np.squeeze(vv) for vv in (fvalues, pvalues)]
 
-        if return_pvals:
-            pvals = f(df1, df2).sf(fvals)
-        else:
-            pvals = np.empty(0)
-        pvalues.append(pvals)
 
-    # handle single effect returns
-    return [np.squeeze(np.asarray(vv)) for vv in (fvalues, pvalues)]
+def _mway_design_key(factor_levels, effects):
+    """Get hashable arguments for _get_mway_design."""
+    factor_levels = tuple(int(n_levels) for n_levels in factor_levels)
+    if not isinstance(effects, str):
+        effects = tuple(effects)
+    return factor_levels, effects
 
 
 def _parametric_ci(arr, ci=.95):
@@ -7,9 +7,54 @@
 from math import sqrt
 import numpy as np
 
-from ..utils import check_random_state, verbose, logger
+from ..utils import (check_random_state, verbose, logger, _validate_type,
+                     _check_option)
 from ..parallel import parallel_func
 
+# Number of permutations between checks of the sequential stopping rule
+_STOP_N_BLOCK = 100
+# Error level of the confidence intervals used by the stopping rule
+_STOP_EPS = 1e-3
+# Approximate number of bytes to use for the blocks of locations for which
+# the bootstrap statistics are evaluated at once
+_BOOT_BLOCK_SIZE = 20e6
+
+
+def _check_stop_alpha(stop_alpha):
+    """Check the alpha level used for sequential stopping."""
+    _validate_type(stop_alpha, ('numeric', None), 'stop_alpha')
+    if stop_alpha is not None:
+        stop_alpha = float(stop_alpha)
+        if not 0 < stop_alpha < 1:
+            raise ValueError('stop_alpha must be between 0 and 1, got %s'
+                             % (stop_alpha,))
+    return stop_alpha
+
+
+def _stop_permuting(H0, T, tail, alpha):
+    """Check if all p-values are confidently above or below alpha.
+
+    The number of permutations that exceed each statistic in ``T`` is
+    binomial, so we stop once the Clopper-Pearson interval of each exceedance
+    probability lies entirely above or below ``alpha``.
+    """
+    from scipy.stats import beta
+    n_perm = len(H0)
+    if tail == 0:
+        H0, T = np.abs(H0), np.abs(T)
+    H0 = np.sort(H0)
+    if tail == -1:
+        n_exceed = np.searchsorted(H0, T, 'right')
+    else:
+        n_exceed = n_perm - np.searchsorted(H0, T, 'left')
+    lower = beta.ppf(_STOP_EPS / 2., np.maximum(n_exceed, 1),
+                     n_perm - n_exceed + 1)
+    lower[n_exceed == 0] = 0.
+    upper = beta.ppf(1 - _STOP_EPS / 2., n_exceed + 1,
+                     np.maximum(n_perm - n_exceed, 1))
+    upper[n_exceed == n_perm] = 1.
+    return bool(np.all((lower > alpha) | (upper < alpha)))
+
 
 def _max_stat(X, X2, perms, dof_scaling):
     """Aux function for permutation_t_test (for parallel comp)."""
@@ -22,7 +67,7 @@ def _max_stat(X, X2, perms, dof_scaling):
 
 @verbose
 def permutation_t_test(X, n_permutations=10000, tail=0, n_jobs=1,
-                       seed=None, verbose=None):
+                       seed=None, stop_alpha=None, verbose=None):
     """One sample/paired sample permutation test based on a t-statistic.
 
     This function can perform the test on one variable or
@@ -51,6 +96,13 @@ def permutation_t_test(X, n_permutations=10000, tail=0, n_jobs=1,
         is that the mean of the data is less than 0 (lower tailed test).
     %(n_jobs)s
     %(seed)s
+    stop_alpha : float | None
+        If a float, stop permuting as soon as the p-value of each test is
+        confidently (at the 99.9%% level) above or below this alpha level,
+        which can save many permutations. The number of permutations actually
+        used is ``len(H0) - 1``. If None (default), all permutations are run.
+
+        .. versionadded:: 0.23
     %(verbose)s
 
     Returns
@@ -82,14 +134,28 @@ def permutation_t_test(X, n_permutations=10000, tail=0, n_jobs=1,
     dof_scaling = sqrt(n_samples / (n_samples - 1.0))
     std0 = np.sqrt(X2 - mu0 ** 2) * dof_scaling  # get std with var splitting
     T_obs = np.mean(X, axis=0) / (std0 / sqrt(n_samples))
+    stop_alpha = _check_stop_alpha(stop_alpha)
     rng = check_random_state(seed)
     orders, _, extra = _get_1samp_orders(n_samples, n_permutations, tail, rng)
     perms = 2 * np.array(orders) - 1  # from 0, 1 -> 1, -1
     logger.info('Permuting %d times%s...' % (len(orders), extra))
     parallel, my_max_stat, n_jobs = parallel_func(_max_stat, n_jobs)
-    max_abs = np.concatenate(parallel(my_max_stat(X, X2, p, dof_scaling)
-                                      for p in np.array_split(perms, n_jobs)))
-    max_abs = np.concatenate((max_abs, [np.abs(T_obs).max()]))
+    # with sequential stopping, check the p-values after each block
+    n_block = max(len(perms), 1) if stop_alpha is None else _STOP_N_BLOCK
+    max_abs = list()
+    for start in range(0, len(perms), n_block):
+        max_abs.extend(parallel(
+            my_max_stat(X, X2, p, dof_scaling)
+            for p in np.array_split(perms[start:start + n_block], n_jobs)))
+        if stop_alpha is not None and start + n_block < len(perms):
+            this_H0 = np.concatenate(max_abs)
+            if _stop_permuting(-this_H0 if tail == -1 else this_H0, T_obs,
+                               tail, stop_alpha):
+                logger.info('Stopping after %d permutations, all p-values '
+                            'are resolved at alpha=%s'
+                            % (len(this_H0), stop_alpha))
+                break
+    max_abs = np.concatenate(max_abs + [[np.abs(T_obs).max()]])
     H0 = np.sort(max_abs)
     if tail == 0:
         p_values = (H0 >= np.abs(T_obs[:, np.newaxis])).mean(-1)
@@ -101,7 +167,8 @@ def permutation_t_test(X, n_permutations=10000, tail=0, n_jobs=1,
 
 
 def bootstrap_confidence_interval(arr, ci=.95, n_bootstraps=2000,
-                                  stat_fun='mean', random_state=None):
+                                  stat_fun='mean', random_state=None,
+                                  method='percentile'):
     """Get confidence intervals from non-parametric bootstrap.
 
     Parameters
@@ -116,30 +183,124 @@ def bootstrap_confidence_interval(arr, ci=.95, n_bootstraps=2000,
         Can be "mean", "median", or a callable operating along ``axis=0``.
     random_state : int | float | array_like | None
         The seed at which to initialize the bootstrap.
+    method : str
+        Can be "percentile" to use the percentiles of the bootstrap
+        distribution, or "bca" for bias-corrected and accelerated intervals
+        :footcite:`Efron1987`.
+
+        .. versionadded:: 0.23
 
     Returns
     -------
     cis : ndarray, shape (2, ...)
         Containing the lower boundary of the CI at ``cis[0, ...]`` and the
         upper boundary of the CI at ``cis[1, ...]``.
+
+    Notes
+    -----
+    For ``stat_fun='mean'`` the means of all resamples are computed as a
+    single product of the counts of each sample in each resample with the
+    data, and the built-in statistics are computed for blocks of locations
+    at a time to bound memory usage.
+
+    References
+    ----------
+    .. footbibliography::
     """
-    if stat_fun == "mean":
-        def stat_fun(x):
-            return x.mean(axis=0)
-    elif stat_fun == 'median':
-        def stat_fun(x):
-            return np.median(x, axis=0)
-    elif not callable(stat_fun):
+    _check_option('method', method, ('percentile', 'bca'))
+    if not callable(stat_fun) and stat_fun not in ('mean', 'median'):
         raise ValueError("stat_fun must be 'mean', 'median' or callable.")
+    bca = method == 'bca'
     n_trials = arr.shape[0]
-    indices = np.arange(n_trials, dtype=int)  # BCA would be cool to have too
+    indices = np.arange(n_trials, dtype=int)
     rng = check_random_state(random_state)
     boot_indices = rng.choice(indices, replace=True,
                               size=(n_bootstraps, len(indices)))
-    stat = np.array([stat_fun(arr[inds]) for inds in boot_indices])
-    ci = (((1 - ci) / 2) * 100, ((1 - ((1 - ci) / 2))) * 100)
-    ci_low, ci_up = np.percentile(stat, ci, axis=0)
-    return np.array([ci_low, ci_up])
+    if callable(stat_fun):
+        stat = np.array([stat_fun(arr[inds]) for inds in boot_indices])
+        shape = stat.shape[1:]
+        stat = stat.reshape(n_bootstraps, -1)
+        obs = jack = None
+        if bca:
+            obs = np.ravel(stat_fun(arr))
+            jack = np.array([np.ravel(stat_fun(np.delete(arr, ii, axis=0)))
+                             for ii in range(n_trials)])
+        return _bootstrap_ci(stat, ci, obs, jack).reshape((2,) + shape)
+
+    x_all = arr.reshape(n_trials, -1)
+    cis = np.empty((2, x_all.shape[1]))
+    # how often each sample is drawn in each resample
+    counts = boot_indices + n_trials * np.arange(n_bootstraps)[:, None]
+    counts = np.bincount(counts.ravel(), minlength=counts.size)
+    counts = counts.reshape(n_bootstraps, n_trials)
+    if stat_fun == 'mean':
+        counts = counts.astype(np.float64)
+        n_block = 8 * (n_trials + 2 * n_bootstraps)
+    else:
+        counts = counts.astype(np.min_scalar_type(n_trials))
+        n_block = (counts.itemsize + 1) * n_trials * n_bootstraps
+    n_block = max(int(_BOOT_BLOCK_SIZE // n_block), 1)
+    for start in range(0, x_all.shape[1], n_block):
+        sl = slice(start, start + n_block)
+        x = x_all[:, sl]
+        obs = jack = None
+        if stat_fun == 'mean':
+            stat = np.dot(counts, x) / n_trials
+            if bca:
+                obs = x.mean(axis=0)
+                jack = (x.sum(axis=0) - x) / (n_trials - 1)
+        else:
+            stat = _boot_medians(x, counts)
+            if bca:
+                obs = np.median(x, axis=0)
+                jack = np.array([np.median(np.delete(x, ii, axis=0), axis=0)
+                                 for ii in range(n_trials)])
+        cis[:, sl] = _bootstrap_ci(stat, ci, obs, jack)
+    return cis.reshape((2,) + arr.shape[1:])
+
+
+def _boot_medians(x, counts):
+    """Get the medians of resamples given by the counts of each sample."""
+    n_trials = len(x)
+    order = np.argsort(x, axis=0)
+    x = np.take_along_axis(x, order, axis=0)
+    # the cumulative counts of the sorted samples give the ranks in each
+    # resample
+    cum_counts = np.cumsum(counts[:, order.T], axis=-1, dtype=counts.dtype)
+    cols = np.arange(x.shape[1])
+    low = x[np.sum(cum_counts <= (n_trials - 1) // 2, axis=-1), cols]
+    high = x[np.sum(cum_counts <= n_trials // 2, axis=-1), cols]
+    return (low + high) / 2.
+
+
+def _bootstrap_ci(stat, ci, obs=None, jack=None):
+    """Get percentile or BCa (with obs and jack) intervals of bootstraps."""
+    quantiles = np.array([(1 - ci) / 2, 1 - (1 - ci) / 2])
+    if obs is None:
+        return np.percentile(stat, quantiles * 100, axis=0)
+    from scipy.stats import norm
+    n_bootstraps = len(stat)
+    # bias correction, keep it finite if obs is outside of the bootstraps
+    prop = np.clip(np.mean(stat < obs, axis=0), 0.5 / n_bootstraps,
+                   1 - 0.5 / n_bootstraps)
+    z_0 = norm.ppf(prop)
+    # acceleration from the jackknife
+    diff = jack.mean(axis=0) - jack
+    with np.errstate(divide='ignore', invalid='ignore'):
+        accel = np.sum(diff ** 3, axis=0) / (
+            6 * np.sum(diff ** 2, axis=0) ** 1.5)
+    accel[~np.isfinite(accel)] = 0.
+    z = z_0 + norm.ppf(quantiles)[:, np.newaxis]
+    quantiles = norm.cdf(z_0 + z / (1 - accel * z))
+    # like np.percentile, but with different quantiles for each column
+    stat = np.sort(stat, axis=0)
+    pos = quantiles * (n_bootstraps - 1)
+    low = np.clip(np.floor(pos).astype(int), 0, n_bootstraps - 1)
+    high = np.minimum(low + 1, n_bootstraps - 1)
+    frac = pos - low
+    low = np.take_along_axis(stat, low, axis=0)
+    high = np.take_along_axis(stat, high, axis=0)
+    return low + frac * (high - low)
 
 
 def _ci(arr, ci=.95, method="bootstrap", n_bootstraps=2000, random_state=None):
@@ -7,6 +7,7 @@
 # License: BSD (3-clause)
 
 from inspect import isgenerator
+from itertools import chain
 from collections import namedtuple
 
 import numpy as np
@@ -15,7 +16,8 @@ from scipy import linalg, sparse
 from ..source_estimate import SourceEstimate
 from ..epochs import BaseEpochs
 from ..evoked import Evoked, EvokedArray
-from ..utils import logger, _reject_data_segments, warn, fill_doc
+from ..utils import (logger, _reject_data_segments, _get_data_segments,
+                     warn, fill_doc)
 from ..io.pick import pick_types, pick_info, _picks_to_idx
 
 
@@ -67,22 +69,24 @@ def linear_regression(inst, design_matrix, names=None):
             warn('Fitting linear model to non-data or bad channels. '
                  'Check picking')
         msg = 'Fitting linear model to epochs'
-        data = inst.get_data()
-        out = EvokedArray(np.zeros(data.shape[1:]), inst.info, inst.tmin)
+        # stream epochs that are not in memory
+        data = inst.get_data() if inst.preload else iter(inst)
+        out = EvokedArray(np.zeros((len(inst.ch_names), len(inst.times))),
+                          inst.info, inst.tmin)
     elif isgenerator(inst):
         msg = 'Fitting linear model to source estimates (generator input)'
         out = next(inst)
-        data = np.array([out.data] + [i.data for i in inst])
+        data = chain([out.data], (i.data for i in inst))
     elif isinstance(inst, list) and isinstance(inst[0], SourceEstimate):
         msg = 'Fitting linear model to source estimates (list input)'
         out = inst[0]
-        data = np.array([i.data for i in inst])
+        data = (i.data for i in inst)
     else:
         raise ValueError('Input must be epochs or iterable of source '
                          'estimates')
     logger.info(msg + ', (%s targets, %s regressors)' %
-                (np.product(data.shape[1:]), len(names)))
-    lm_params = _fit_lm(data, design_matrix, names)
+                (np.product(out.data.shape), len(names)))
+    lm_params = _fit_lm(data, design_matrix, names, out.data.shape)
     lm = namedtuple('lm', 'beta stderr t_val p_val mlog10_p_val')
     lm_fits = {}
     for name in names:
@@ -98,54 +102,158 @@ def linear_regression(inst, design_matrix, names=None):
     return lm_fits
 
 
-def _fit_lm(data, design_matrix, names):
-    """Aux function."""
-    from scipy import stats
-    n_samples = len(data)
-    n_features = np.product(data.shape[1:])
+# Approximate number of bytes of streamed observations to buffer for each
+# product with the design
+_LM_CHUNK_SIZE = 50e6
+
+
+def _lm_design(design_matrix):
+    """Decompose the design once for mass-univariate OLS fits.
+
+    Returns the economic QR decomposition of the design, the unscaled
+    standard errors of the regressors, the residual degrees of freedom and
+    the design matrix.
+    """
+    design_matrix = np.asarray(design_matrix, dtype=np.float64)
     if design_matrix.ndim != 2:
         raise ValueError('Design matrix must be a 2d array')
     n_rows, n_predictors = design_matrix.shape
+    if n_rows <= n_predictors:
+        raise ValueError('Design matrix must have more rows (%d) than '
+                         'columns (%d)' % (n_rows, n_predictors))
+    q, r = linalg.qr(design_matrix, mode='economic')
+    diag = np.abs(np.diag(r))
+    if diag.min() <= diag.max() * max(n_rows, n_predictors) * \
+            np.finfo(np.float64).eps:
+        raise ValueError('Design matrix is rank deficient')
+    # sqrt(diag(inv(X.T @ X))) are the row norms of inv(R)
+    r_inv = linalg.solve_triangular(r, np.eye(n_predictors))
+    unscaled_stderrs = np.linalg.norm(r_inv, axis=1)
+    return q, r, unscaled_stderrs, n_rows - n_predictors, design_matrix
+
+
+def _iter_lm_chunks(data, n_features):
+    """Get blocks of observations of streamed (or array) data."""
+    if isinstance(data, np.ndarray):
+        yield np.reshape(data, (len(data), n_features))
+        return
+    n_chunk = max(int(_LM_CHUNK_SIZE // (8 * n_features)), 1)
+    buffer = None
+    n_buffer = 0
+    for obs in data:
+        obs = np.asarray(obs)
+        if buffer is None:
+            buffer = np.empty((n_chunk, n_features), obs.dtype)
+        buffer[n_buffer] = obs.ravel()
+        n_buffer += 1
+        if n_buffer == n_chunk:
+            yield buffer
+            n_buffer = 0
+    if n_buffer > 0:
+        yield buffer[:n_buffer]
+
+
+def _lm_solve(design, data, n_features, perm=None):
+    """Fit all targets to a decomposed design.
 
-    if n_samples != n_rows:
+    Parameters
+    ----------
+    design : tuple
+        The output of :func:`_lm_design`.
+    data : ndarray | iterable of ndarray
+        The observations, either as an array with observations along the
+        first axis, or as an iterable of single observations.
+    n_features : int
+        The number of targets of each observation.
+    perm : ndarray | None
+        If not None, observation ``ii`` is paired with row ``perm[ii]`` of
+        the design, i.e. the rows of the design are permuted. For data in
+        memory, the decomposition does not need to be recomputed for this.
+
+    Returns
+    -------
+    betas : ndarray, shape (n_predictors, n_features)
+        The regression coefficients.
+    sqrt_noise_var : ndarray, shape (n_features,)
+        The square root of the residual variance.
+    """
+    q, r, _, df, design_matrix = design
+    if perm is not None:
+        q, design_matrix = q[perm], design_matrix[perm]
+    n_rows = len(design_matrix)
+    # Blocks of observations update the QR decomposition of the design rows
+    # seen so far (R) and Q.T @ y. The residuals are computed directly from
+    # the part of each block orthogonal to the design, which avoids the
+    # cancellation of ||y||^2 - ||Q.T @ y||^2 (e.g., for large offsets).
+    resid_sum_squares = np.zeros(n_features)
+    r_seen = qty = None
+    start = stop = 0
+    for y in _iter_lm_chunks(data, n_features):
+        stop = start + len(y)
+        if stop > n_rows:
+            break
+        if start == 0 and stop == n_rows:  # all at once, use decomposition
+            q_block, r_seen = q, r
+        else:
+            x = design_matrix[start:stop]
+            if r_seen is not None:
+                x = np.concatenate([r_seen, x])
+                y = np.concatenate([qty, y])
+            q_block, r_seen = linalg.qr(x, mode='economic')
+        q_block = np.ascontiguousarray(q_block)  # much faster products
+        qty = np.dot(q_block.T, y)
+        # residuals for blocks of targets in a reused buffer, bounding the
+        # temporary memory
+        n_cols = min(max(int(_LM_CHUNK_SIZE // (8 * len(y))), 1), n_features)
+        resid_buffer = np.empty(len(y) * n_cols, np.result_type(y, qty))
+        for col in range(0, n_features, n_cols):
+            sl = slice(col, col + n_cols)
+            resid = resid_buffer[:len(y) * (min(col + n_cols, n_features) -
+                                            col)].reshape(len(y), -1)
+            np.dot(q_block, qty[:, sl], out=resid)
+            np.subtract(y[:, sl], resid, out=resid)
+            resid_sum_squares[sl] += np.einsum('ij,ij->j', resid, resid)
+        start = stop
+    if stop != n_rows:
         raise ValueError('Number of rows in design matrix must be equal '
                          'to number of observations')
-    if n_predictors != len(names):
-        raise ValueError('Number of regressor names must be equal to '
-                         'number of column in design matrix')
+    betas = linalg.solve_triangular(r_seen, qty)
+    return betas, np.sqrt(resid_sum_squares / df)
 
-    y = np.reshape(data, (n_samples, n_features))
-    betas, resid_sum_squares, _, _ = linalg.lstsq(a=design_matrix, b=y)
 
-    df = n_rows - n_predictors
-    sqrt_noise_var = np.sqrt(resid_sum_squares / df).reshape(data.shape[1:])
-    design_invcov = linalg.inv(np.dot(design_matrix.T, design_matrix))
-    unscaled_stderrs = np.sqrt(np.diag(design_invcov))
+def _fit_lm(data, design_matrix, names, shape=None):
+    """Aux function."""
+    from scipy import stats
+    if shape is None:
+        shape = data.shape[1:]
+    design = _lm_design(design_matrix)
+    if design[0].shape[1] != len(names):
+        raise ValueError('Number of regressor names must be equal to '
+                         'number of column in design matrix')
+    n_features = int(np.prod(shape))
+    betas, sqrt_noise_var = _lm_solve(design, data, n_features)
+    df = design[3]
+
+    # t and p values of all predictors at once
+    stderrs = design[2][:, np.newaxis] * sqrt_noise_var
+    stderr_pos = stderrs > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_vals = np.where(stderr_pos, betas / stderrs, 0.)
     tiny = np.finfo(np.float64).tiny
-    beta, stderr, t_val, p_val, mlog10_p_val = (dict() for _ in range(5))
-    for x, unscaled_stderr, predictor in zip(betas, unscaled_stderrs, names):
-        beta[predictor] = x.reshape(data.shape[1:])
-        stderr[predictor] = sqrt_noise_var * unscaled_stderr
-        p_val[predictor] = np.empty_like(stderr[predictor])
-        t_val[predictor] = np.empty_like(stderr[predictor])
-
-        stderr_pos = (stderr[predictor] > 0)
-        beta_pos = (beta[predictor] > 0)
-        t_val[predictor][stderr_pos] = (beta[predictor][stderr_pos] /
-                                        stderr[predictor][stderr_pos])
-        cdf = stats.t.cdf(np.abs(t_val[predictor][stderr_pos]), df)
-        p_val[predictor][stderr_pos] = np.clip((1. - cdf) * 2., tiny, 1.)
-        # degenerate cases
-        mask = (~stderr_pos & beta_pos)
-        t_val[predictor][mask] = np.inf * np.sign(beta[predictor][mask])
-        p_val[predictor][mask] = tiny
-        # could do NaN here, but hopefully this is safe enough
-        mask = (~stderr_pos & ~beta_pos)
-        t_val[predictor][mask] = 0
-        p_val[predictor][mask] = 1.
-        mlog10_p_val[predictor] = -np.log10(p_val[predictor])
-
-    return beta, stderr, t_val, p_val, mlog10_p_val
+    p_vals = np.clip(2 * stats.t.sf(np.abs(t_vals), df), tiny, 1.)
+    # degenerate cases
+    mask = ~stderr_pos & (betas > 0)
+    t_vals[mask] = np.inf
+    p_vals[mask] = tiny
+    # could do NaN here, but hopefully this is safe enough
+    mask = ~stderr_pos & ~(betas > 0)
+    t_vals[mask] = 0
+    p_vals[mask] = 1.
+    mlog10_p_vals = -np.log10(p_vals)
+
+    return tuple({predictor: x.reshape(shape)
+                  for predictor, x in zip(names, param)}
+                 for param in (betas, stderrs, t_vals, p_vals, mlog10_p_vals))
 
 
 @fill_doc
@@ -226,8 +334,12 @@ def linear_regression_raw(raw, events, event_id=None, tmin=-.1, tmax=1,
         matrix b; or a string.
         X is of shape (n_times, n_predictors * time_window_length).
         y is of shape (n_channels, n_times).
-        If str, must be ``'cholesky'``, in which case the solver used is
-        ``linalg.solve(dot(X.T, X), dot(X.T, y))``.
+        If str, must be ``'cholesky'``, in which case the normal equations
+        ``dot(X.T, X)`` and ``dot(X.T, y)`` are formed once from the sparse
+        predictor matrix, factorized with a Cholesky decomposition, and
+        solved for all channels at once. Contaminated data points are
+        subtracted from the normal equations rather than removed from the
+        data.
 
     Returns
     -------
@@ -245,11 +357,6 @@ def linear_regression_raw(raw, events, event_id=None, tmin=-.1, tmax=1,
     if isinstance(solver, str):
         if solver not in {"cholesky"}:
             raise ValueError("No such solver: {}".format(solver))
-        if solver == 'cholesky':
-            def solver(X, y):
-                a = (X.T * X).toarray()  # dot product of sparse matrices
-                return linalg.solve(a, X.T * y, sym_pos=True,
-                                    overwrite_a=True, overwrite_b=True).T
     elif callable(solver):
         pass
     else:
@@ -267,11 +374,18 @@ def linear_regression_raw(raw, events, event_id=None, tmin=-.1, tmax=1,
         n_samples=data.shape[1], sfreq=info["sfreq"], events=events,
         event_id=event_id, tmin=tmin, tmax=tmax, covariates=covariates)
 
-    # remove "empty" and contaminated data points
-    X, data = _clean_rerp_input(X, data, reject, flat, decim, info, tstep)
+    if solver == 'cholesky':
+        # solve the normal equations, contaminated data points are removed
+        # from them without copying the data
+        coefs = _solve_rerp_cholesky(X, data, reject, flat, decim, info,
+                                     tstep)
+    else:
+        # remove "empty" and contaminated data points
+        X, data = _clean_rerp_input(X, data, reject, flat, decim, info,
+                                    tstep)
 
-    # solve linear system
-    coefs = solver(X, data.T)
+        # solve linear system
+        coefs = solver(X, data.T)
     if coefs.shape[0] != data.shape[0]:
         raise ValueError("solver output has unexcepted shape. Supply a "
                          "function that returns coefficients in the form "
@@ -289,8 +403,7 @@ def _prepare_rerp_data(raw, events, picks=None, decim=1):
     info = pick_info(raw.info, picks)
     decim = int(decim)
     info["sfreq"] /= decim
-    data, times = raw[:]
-    data = data[picks, ::decim]
+    data = raw.get_data(picks)[:, ::decim]
     if len(set(events[:, 0])) < len(events[:, 0]):
         raise ValueError("`events` contains duplicate time points. Make "
                          "sure all entries in the first column of `events` "
@@ -381,6 +494,43 @@ def _clean_rerp_input(X, data, reject, flat, decim, info, tstep):
     return X.tocsr()[has_val], data[:, has_val]
 
 
+def _solve_rerp_cholesky(X, data, reject, flat, decim, info, tstep):
+    """Solve the normal equations of all channels at once.
+
+    Samples without predictors do not contribute to ``X.T @ X`` and
+    ``X.T @ y``, and contaminated samples are removed by downdating the
+    normal equations of all samples, so neither X nor the data are copied.
+    """
+    X = X.tocsr()
+    xtx = X.T @ X  # sparse
+    # X.T @ y in blocks of samples, each channel is a right-hand side
+    n_chunk = max(int(_LM_CHUNK_SIZE // (8 * len(data))), 1)
+    xty = np.zeros((X.shape[1], len(data)))
+    for start in range(0, X.shape[0], n_chunk):
+        sl = slice(start, start + n_chunk)
+        xty += X[sl].T @ data[:, sl].T
+
+    # downdate with contaminated samples
+    if reject is not None:
+        keep, inds = _get_data_segments(data, reject, flat, decim=None,
+                                        info=info, tstep=tstep)
+        if not keep.any():
+            raise RuntimeError('No clean segment found. Please '
+                               'consider updating your rejection '
+                               'thresholds.')
+        drop = np.zeros(X.shape[0], bool)
+        for t0, t1 in inds:
+            drop[t0:t1] = True
+        drop = np.flatnonzero(drop)
+        X_drop = X[drop]
+        xtx = xtx - X_drop.T @ X_drop
+        xty -= X_drop.T @ data[:, drop].T
+
+    # one factorization and one multi-RHS back-substitution
+    factor = linalg.cho_factor(xtx.toarray(), overwrite_a=True)
+    return linalg.cho_solve(factor, xty, overwrite_b=True).T
+
+
 def _make_evokeds(coefs, conds, cond_length, tmin_s, tmax_s, info):
     """Create a dictionary of Evoked objects.
 
@@ -21,7 +21,9 @@ from mne.stats.cluster_level import (permutation_cluster_test, f_oneway,
                                      permutation_cluster_1samp_test,
                                      spatio_temporal_cluster_test,
                                      spatio_temporal_cluster_1samp_test,
-                                     ttest_1samp_no_p, summarize_clusters_stc)
+                                     ttest_1samp_no_p, summarize_clusters_stc,
+                                     permutation_cluster_slice,
+                                     merge_permutation_slices)
 from mne.utils import (run_tests_if_main, catch_logging, check_version,
                        requires_sklearn)
 
@@ -31,12 +33,9 @@ def numba_conditional(monkeypatch, request):
     """Test both code paths on machines that have Numba."""
     assert request.param in ('Numba', 'NumPy')
     if request.param == 'NumPy' and has_numba:
-        monkeypatch.setattr(
-            cluster_level, '_get_buddies', cluster_level._get_buddies_fallback)
-        monkeypatch.setattr(
-            cluster_level, '_get_selves', cluster_level._get_selves_fallback)
-        monkeypatch.setattr(
-            cluster_level, '_where_first', cluster_level._where_first_fallback)
+        monkeypatch.setattr(cluster_level, '_get_st_labels',
+                            cluster_level._get_st_labels_fallback)
+        monkeypatch.setattr(cluster_level, 'has_numba', False)
     if request.param == 'Numba' and not has_numba:
         pytest.skip('Numba not installed')
     yield request.param
@@ -288,6 +287,113 @@ def test_cluster_permutation_t_test(numba_conditional, stat_fun):
                 out_type='mask')
 
 
+@pytest.mark.parametrize('kind', ('1samp', 'f'))
+@pytest.mark.parametrize('tail', (-1, 0, 1))
+@pytest.mark.parametrize('adjacency, t_power', [
+    (None, 1), (None, 0), (False, 1), ('sparse', 1), ('tfce', 1)])
+def test_cluster_permutation_blocks(kind, tail, adjacency, t_power,
+                                    monkeypatch):
+    """Test permutations of the built-in stat_funs evaluated in blocks."""
+    rng = np.random.RandomState(0)
+    X = rng.randn(12, 6, 5)
+    X[:, 2:4, 1:3] += 0.8
+    if kind == '1samp':
+        func, stat_fun = permutation_cluster_1samp_test, ttest_1samp_no_p
+        threshold = 1.5 if tail >= 0 else -1.5
+    else:
+        if tail == -1:
+            return
+        func, stat_fun = permutation_cluster_test, f_oneway
+        X = [X[:5], X[5:], rng.randn(4, 6, 5)]
+        threshold = 2.
+        tail = 1
+    kwargs = dict(tail=tail, t_power=t_power, seed=0, n_permutations=50,
+                  out_type='mask', threshold=threshold)
+    if adjacency == 'sparse':
+        kwargs['adjacency'] = combine_adjacency(6, 5)
+    elif adjacency == 'tfce':
+        kwargs['threshold'] = dict(start=0, step=0.5 if tail >= 0 else -0.5)
+    else:
+        kwargs['adjacency'] = adjacency
+    exclude = np.zeros((6, 5), bool)
+    exclude[0] = True
+    if adjacency == 'sparse':
+        exclude = exclude.ravel()
+    elif adjacency is False:  # only supported for 1D data
+        X = [x.reshape(len(x), -1) for x in X] if kind == 'f' else \
+            X.reshape(len(X), -1)
+        exclude = exclude.ravel()
+    # a small block size exercises several blocks and partial blocks
+    monkeypatch.setattr(cluster_level, '_PERM_BLOCK_SIZE', 2000)
+    with pytest.warns(None):  # might not find clusters
+        want = func(X, stat_fun=lambda *x: stat_fun(*x), exclude=exclude,
+                    buffer_size=None, **kwargs)
+        got = func(X, stat_fun=stat_fun, exclude=exclude, **kwargs)
+    assert len(got[3]) == len(want[3])
+    if adjacency == 'tfce':
+        assert len(got[3]) == 50
+    assert_allclose(got[0], want[0])
+    assert_allclose(got[2], want[2])
+    assert_allclose(got[3], want[3], rtol=1e-7, atol=1e-10)
+
+
+@pytest.mark.parametrize('kind', ('1samp', 'f'))
+def test_permutation_views(kind):
+    """Test permuting the data in place for custom stat_fun."""
+    from mne.utils import ProgressBar
+    rng = np.random.RandomState(0)
+    X = rng.randn(10, 40)
+    X[:, 10:20] += 1.
+    if kind == '1samp':
+        do_perm, slices = cluster_level._do_1samp_permutations, None
+        orders = [rng.randint(0, 2, 10) for _ in range(20)]
+        threshold = 2.
+    else:
+        do_perm, slices = cluster_level._do_permutations, [slice(0, 4),
+                                                           slice(4, 10)]
+        orders = [rng.permutation(10) for _ in range(20)]
+        threshold = 1.
+    perm = rng.permutation(10)
+    X_perm = X.copy()
+    cluster_level._permute_rows(X_perm, perm)
+    assert_array_equal(X_perm, X[perm])
+
+    def stat_fun(*x):
+        assert all(xx.shape[1] in (7, 5, 40) for xx in x)
+        return ttest_1samp_no_p(*x) if kind == '1samp' else f_oneway(*x)
+
+    results = list()
+    for buffer_size in (None, 7):
+        for writeable in (True, False):
+            X_run = X.copy()
+            X_run.flags.writeable = writeable
+            with ProgressBar(len(orders)) as progress_bar:
+                results.append(do_perm(
+                    X_run, slices, threshold, 0, False, stat_fun, 1, None,
+                    None, 1, orders, (40,), buffer_size, progress_bar))
+            assert_array_equal(X_run, X)  # restored
+    assert np.abs(results[0]).max() > 0
+    for result in results[1:]:
+        assert_allclose(result, results[0])
+
+    # the data are restored if stat_fun fails
+    def bad_stat_fun(*x):
+        if len(calls) == 3:
+            raise RuntimeError('stat_fun failed')
+        calls.append(None)
+        return stat_fun(*x)
+
+    for buffer_size in (None, 7):
+        calls = list()
+        X_run = X.copy()
+        with ProgressBar(len(orders)) as progress_bar:
+            with pytest.raises(RuntimeError, match='stat_fun failed'):
+                do_perm(X_run, slices, threshold, 0, False, bad_stat_fun, 1,
+                        None, None, 1, orders, (40,), buffer_size,
+                        progress_bar)
+        assert_array_equal(X_run, X)
+
+
 @requires_sklearn
 def test_cluster_permutation_with_adjacency(numba_conditional):
     """Test cluster level permutations with adjacency matrix."""
@@ -557,6 +663,52 @@ def test_permutation_adjacency_equiv(numba_conditional):
 
 
 @requires_sklearn
+@pytest.mark.parametrize('max_step', (1, 2, 3))
+@pytest.mark.parametrize('t_power', (0, 1, 2))
+def test_spatio_temporal_clusters_engine(numba_conditional, max_step,
+                                         t_power):
+    """Test spatio-temporal clusters against the full adjacency graph."""
+    rng = np.random.RandomState(0)
+    n_times, n_src = 7, 20
+    # two disjoint chains of vertices (i.e., partitions)
+    adj = sparse.diags([1., 1.], [-1, 1], (n_src, n_src)).tolil()
+    adj[9, 10] = adj[10, 9] = 0
+    adj = adj.tocsr()
+    adj.eliminate_zeros()
+    full = sparse.kron(sparse.eye(n_times), adj)
+    for step in range(1, max_step + 1):
+        time_adj = sparse.eye(n_times, k=step) + sparse.eye(n_times, k=-step)
+        full = full + sparse.kron(time_adj, sparse.eye(n_src))
+    full = full.tocoo()
+    x = rng.randn(n_times * n_src)
+    neighbors = cluster_level._setup_adjacency(adj, x.size, n_times)
+    assert sparse.isspmatrix_csr(neighbors)
+    partitions = cluster_level._get_partitions_from_adjacency(
+        neighbors, n_times)
+    assert_array_equal(np.unique(partitions), [0, 1])
+    for tail, thresh in ((1, 0.5), (0, 0.5), (-1, -0.5)):
+        want = cluster_level._find_clusters(
+            x, thresh, tail, full, t_power=t_power)
+        for adjacency in (neighbors, [neighbors[ii].indices
+                                      for ii in range(n_src)]):
+            got = cluster_level._find_clusters(
+                x, thresh, tail, adjacency, max_step=max_step,
+                t_power=t_power)
+            assert len(got[0]) == len(want[0]) > 5
+            for c_got, c_want in zip(got[0], want[0]):
+                assert_array_equal(c_got, np.sort(c_want))
+            assert_allclose(got[1], want[1])
+            # partitions only change the order of the clusters
+            got_parts = cluster_level._find_clusters(
+                x, thresh, tail, adjacency, max_step=max_step,
+                t_power=t_power, partitions=partitions)
+            parts = [partitions[c[0]] for c in got_parts[0]]
+            if tail != 0:
+                assert_array_equal(parts, np.sort(parts))
+            assert (sorted(tuple(c) for c in got_parts[0]) ==
+                    sorted(tuple(c) for c in got[0]))
+
+
 def test_spatio_temporal_cluster_adjacency(numba_conditional):
     """Test spatio-temporal cluster permutations."""
     from sklearn.feature_extraction.image import grid_to_graph
@@ -669,6 +821,130 @@ def test_permutation_test_H0(numba_conditional):
         assert_equal(len(h0), 2 ** (7 - (tail == 0)))  # exact test
 
 
+@pytest.mark.skipif(not has_numba, reason='Requires Numba')
+@pytest.mark.parametrize('tail', (-1, 0, 1))
+@pytest.mark.parametrize('kind', ('1d', '2d', '3d', 'false', 'sparse',
+                                  'st1', 'st2'))
+def test_tfce_sweep(tail, kind, monkeypatch):
+    """Test the single-sweep TFCE against clustering at each threshold."""
+    rng = np.random.RandomState(0)
+    shape = dict(d1=(40,), d2=(8, 9), d3=(4, 5, 6)).get(
+        'd' + kind[:-1] if kind[-1] == 'd' else '', (6, 10))
+    x = rng.randn(*shape)
+    max_step = 1
+    if kind[-1] == 'd':
+        adjacency = None
+    elif kind == 'false':
+        adjacency = False
+    elif kind == 'sparse':
+        # only the upper triangle is used
+        adjacency = sparse.triu(combine_adjacency(6, 10)).tocoo()
+    else:
+        adjacency = cluster_level._setup_adjacency(
+            combine_adjacency(10), x.size, 6)
+        max_step = int(kind[-1])
+    if adjacency is not None:
+        x = x.ravel()
+    include = rng.rand(*x.shape) > 0.1
+    step = -0.2 if tail == -1 else 0.2
+    for threshold in (dict(start=0, step=step),
+                      dict(start=step / 2., step=step, h_power=1.5,
+                           e_power=1)):
+        got = cluster_level._find_clusters(
+            x, threshold, tail, adjacency, max_step=max_step,
+            include=include)[1]
+        monkeypatch.setattr(cluster_level, 'has_numba', False)
+        want = cluster_level._find_clusters(
+            x, threshold, tail, adjacency, max_step=max_step,
+            include=include)[1]
+        monkeypatch.undo()
+        assert (want > 0).sum() > 5
+        assert_allclose(got, want, rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize('kind', ('1samp', 'f'))
+def test_permutation_slices(kind, tmpdir):
+    """Test computing the permutations in slices and merging them."""
+    rng = np.random.RandomState(0)
+    X = rng.randn(25, 30)
+    X[:, 10:15] += 0.8
+    if kind == '1samp':
+        func, threshold = permutation_cluster_1samp_test, 1.5
+    else:
+        func, threshold = permutation_cluster_test, 3.
+        X[:10, 10:15] += 0.8
+        X = [X[:10], X[10:20], X[20:]]
+    kwargs = dict(threshold=threshold, n_permutations=100, seed=3)
+    t_obs, clusters, cluster_pv, H0 = func(X, **kwargs)
+    fnames = [str(tmpdir.join('slice%d.npz' % ii)) for ii in range(3)]
+    for fname, (start, stop, n_jobs) in zip(
+            fnames[::-1], ((70, 1000, 1), (0, 30, 2), (30, 70, 1))):
+        t_obs_sl, clusters_sl, H0_sl = permutation_cluster_slice(
+            fname, X, start, stop, n_jobs=n_jobs, **kwargs)
+        assert_array_equal(t_obs_sl, t_obs)
+        assert len(clusters_sl) == len(clusters)
+        assert len(H0_sl) == min(stop, 99) - start
+    cluster_pv_merged, H0_merged = merge_permutation_slices(fnames)
+    assert_allclose(H0_merged, H0)
+    assert_allclose(cluster_pv_merged, cluster_pv)
+    assert cluster_pv.min() < 0.05
+
+    # restarting a job loads the slice
+    with catch_logging() as log:
+        _, _, H0_sl = permutation_cluster_slice(
+            fnames[1], X, 0, 30, verbose=True, **kwargs)
+    assert 'Loading permutations 0 to 30' in log.getvalue()
+    assert_allclose(H0_sl, H0[1:31])
+    kwargs['seed'] = 4
+    with pytest.raises(FileExistsError, match='overwrite'):
+        permutation_cluster_slice(fnames[1], X, 0, 30, **kwargs)
+    with pytest.raises(TypeError, match='seed must be'):
+        permutation_cluster_slice(fnames[1], X, 0, 30, threshold=threshold,
+                                  seed=None)
+    with pytest.raises(ValueError, match='0 <= start <= stop'):
+        permutation_cluster_slice(fnames[1], X, 30, 0, **kwargs)
+    with pytest.raises(ValueError, match='must not exceed the number'):
+        permutation_cluster_slice(fnames[1], X, 200, 300, **kwargs)
+
+    # bad merges
+    with pytest.raises(ValueError, match='Permutations 70 to 99 are missing'):
+        merge_permutation_slices(fnames[:2])
+    with pytest.raises(ValueError, match='0 to 30 are missing'):
+        merge_permutation_slices(fnames[:1] + fnames[2:])
+    with pytest.raises(ValueError, match='more than once'):
+        merge_permutation_slices(fnames + fnames[1:2])
+    permutation_cluster_slice(fnames[1], X, 0, 30, overwrite=True, **kwargs)
+    with pytest.raises(ValueError, match='different tests'):
+        merge_permutation_slices(fnames)
+
+
+@pytest.mark.parametrize('kind', ('1samp', 'f'))
+def test_permutation_stop(kind):
+    """Test sequential stopping of cluster-level permutation tests."""
+    rng = np.random.RandomState(0)
+    X = rng.randn(30, 40)
+    X[:, 10:20] += 0.8
+    if kind == '1samp':
+        func, threshold = permutation_cluster_1samp_test, 1.5
+    else:
+        func, threshold = permutation_cluster_test, 3.
+        X[:10, 10:20] += 0.8
+        X = [X[:15], X[15:]]
+    kwargs = dict(threshold=threshold, n_permutations=3000, seed=0)
+    _, clusters, cluster_pv, H0 = func(X, **kwargs)
+    assert len(H0) == 3000
+    assert len(clusters) > 3
+    with catch_logging() as log:
+        _, clusters_stop, cluster_pv_stop, H0_stop = func(
+            X, stop_alpha=0.05, verbose=True, **kwargs)
+    assert 'Stopping after' in log.getvalue()
+    assert len(H0_stop) < 1000
+    # same permutations as the full test, just fewer of them
+    assert_array_equal(H0_stop, H0[:len(H0_stop)])
+    assert_array_equal(cluster_pv_stop < 0.05, cluster_pv < 0.05)
+    assert (cluster_pv < 0.05).sum() == 1
+
+
 def test_tfce_thresholds(numba_conditional):
     """Test TFCE thresholds."""
     rng = np.random.RandomState(0)
@@ -3,7 +3,7 @@ from itertools import product
 
 import pytest
 from numpy.testing import (assert_array_almost_equal, assert_allclose,
-                           assert_array_less)
+                           assert_array_less, assert_array_equal)
 import numpy as np
 import scipy.stats
 
@@ -157,3 +157,55 @@ def test_ttest_equiv(kind, kwargs, sigma, seed):
         # something to the divisor (var)
         assert_allclose(got, want, rtol=2e-1, atol=1e-2)
         assert_array_less(np.abs(got), np.abs(want))
+
+
+@pytest.mark.parametrize('dtype', (np.float32, np.float64))
+def test_stat_blocks(dtype, monkeypatch):
+    """Test block-wise and dtype-preserving built-in statistics."""
+    from mne.stats import parametric
+    rng = np.random.RandomState(0)
+    X = rng.randn(3, 10, 20, 30).astype(dtype)
+    want_t = scipy.stats.ttest_1samp(X[0], 0)[0]
+    want_f = scipy.stats.f_oneway(*X)[0]
+    t = mne.stats.ttest_1samp_no_p(X[0])
+    f = mne.stats.f_oneway(*X)
+    monkeypatch.setattr(parametric, '_STAT_BLOCK_SIZE', 8 * 10 * 7)
+    assert len(parametric._stat_blocks(10, 600)) == 86
+    for got, want, fun in ((t, want_t, mne.stats.ttest_1samp_no_p),
+                           (f, want_f, mne.stats.f_oneway)):
+        assert got.dtype == dtype
+        assert got.shape == (20, 30)
+        assert_allclose(got, want, rtol=1e-5 if dtype == np.float32 else 1e-7)
+        got_block = fun(X[0]) if fun is mne.stats.ttest_1samp_no_p \
+            else fun(*X)
+        assert_array_equal(got, got_block)
+    # 1D data give a scalar
+    assert np.isscalar(mne.stats.ttest_1samp_no_p(X[0, :, 0, 0]))
+    assert np.isscalar(mne.stats.f_oneway(*X[:, :, 0, 0]))
+
+
+def test_f_mway_rm_blocks(monkeypatch):
+    """Test the cached design and block-wise repeated measures ANOVA."""
+    from mne.stats import parametric
+    rng = np.random.RandomState(0)
+    data = rng.randn(10, 6, 4, 5)
+    parametric._get_mway_design.cache_clear()
+    want = [f_mway_rm(data, [2, 3], effects=effects, correction=True)
+            for effects in ('all', ['A', 'A:B'])]
+    assert parametric._get_mway_design.cache_info().currsize == 2
+    for effects in ('all', ['A', 'A:B']):
+        f_mway_rm(data, (2, 3), effects=effects)
+        assert parametric._get_mway_design.cache_info().currsize == 2
+    assert want[0][0].shape == (3, 20)
+    assert_array_equal(want[1][0], want[0][0][[0, 2]])
+    # each test on its own
+    for ii in range(20):
+        fvals, pvals = f_mway_rm(data.reshape(10, 6, -1)[:, :, ii], [2, 3],
+                                 correction=True)
+        assert_allclose(fvals, want[0][0][:, ii])
+        assert_allclose(pvals, want[0][1][:, ii])
+    # several blocks
+    monkeypatch.setattr(parametric, '_STAT_BLOCK_SIZE', 8 * 200)
+    got = f_mway_rm(data, [2, 3], correction=True)
+    assert_allclose(got[0], want[0][0])
+    assert_allclose(got[1], want[0][1])
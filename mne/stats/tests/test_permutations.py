@@ -4,6 +4,7 @@
 
 from numpy.testing import assert_array_equal, assert_allclose
 import numpy as np
+import pytest
 from scipy import stats, sparse
 
 from mne.stats import permutation_cluster_1samp_test
@@ -64,6 +65,24 @@ def test_permutation_t_test():
     assert_allclose(p_values[0], p_values_scipy, rtol=1e-2)
 
 
+@pytest.mark.parametrize('tail', (-1, 0, 1))
+def test_permutation_t_test_stop(tail):
+    """Test sequential stopping of permutation T-tests."""
+    rng = np.random.RandomState(0)
+    X = rng.randn(30, 5)
+    X[:, :2] += 1.5 * (tail or 1)
+    _, p_values, H0 = permutation_t_test(X, 2000, tail=tail, seed=0)
+    assert len(H0) == 2000
+    t_obs, p_values_stop, H0_stop = permutation_t_test(
+        X, 2000, tail=tail, seed=0, stop_alpha=0.05)
+    assert 100 < len(H0_stop) < 1000
+    assert_array_equal(p_values_stop < 0.05, p_values < 0.05)
+    assert_array_equal(p_values_stop < 0.05, [True, True, False, False,
+                                              False])
+    with pytest.raises(ValueError, match='between 0 and 1'):
+        permutation_t_test(X, tail=tail, stop_alpha=1.)
+
+
 def test_ci():
     """Test confidence intervals."""
     # isolated test of CI functions
@@ -81,4 +100,32 @@ def test_ci():
         bootstrap_confidence_interval(arr, random_state=random_state)
 
 
+@pytest.mark.parametrize('stat_fun', ('mean', 'median'))
+def test_bootstrap_engine(stat_fun, monkeypatch):
+    """Test vectorized bootstrap statistics and BCa intervals."""
+    from mne.stats import permutations
+    import scipy.stats
+    rng = np.random.RandomState(0)
+    arr = rng.exponential(size=(30, 4, 5))
+    func = getattr(np, stat_fun)
+    kwargs = dict(random_state=0, n_bootstraps=500)
+    monkeypatch.setattr(permutations, '_BOOT_BLOCK_SIZE', 1)  # 1 location
+    for method in ('percentile', 'bca'):
+        want = bootstrap_confidence_interval(
+            arr, stat_fun=lambda x: func(x, axis=0), method=method, **kwargs)
+        got = bootstrap_confidence_interval(arr, stat_fun=stat_fun,
+                                            method=method, **kwargs)
+        assert got.shape == (2, 4, 5)
+        assert_allclose(got, want)
+    assert (got[0] < func(arr, axis=0)).all()
+    assert (got[1] > func(arr, axis=0)).all()
+    if hasattr(scipy.stats, 'bootstrap'):
+        want = scipy.stats.bootstrap(
+            (arr[:, 0, 0],), func, method='BCa', n_resamples=500,
+            random_state=0).confidence_interval
+        assert_allclose(got[:, 0, 0], want, rtol=0.1)
+    with pytest.raises(ValueError, match='Invalid value'):
+        bootstrap_confidence_interval(arr, method='foo')
+
+
 run_tests_if_main()
@@ -77,6 +77,79 @@ def test_regression():
             assert_array_equal(v1.data, v2.data)
 
 
+def test_regression_engine(monkeypatch):
+    """Test the streamed OLS engine on simulated source estimates."""
+    from scipy import stats
+    from mne.stats import regression
+    rng = np.random.RandomState(0)
+    n_obs = 30
+    design_matrix = np.c_[np.ones(n_obs), rng.randn(n_obs, 2)]
+    data = rng.randn(n_obs, 4, 5)
+    data += 2 * design_matrix[:, 1, np.newaxis, np.newaxis]
+    vertices = [np.arange(2), np.arange(2)]
+    stcs = [mne.SourceEstimate(d, vertices, 0, 1) for d in data]
+    # buffer several observations at a time
+    monkeypatch.setattr(regression, '_LM_CHUNK_SIZE', 8 * 20 * 7)
+    lm = linear_regression(stcs, design_matrix, ['a', 'b', 'c'])
+    lm_gen = linear_regression((s for s in stcs), design_matrix,
+                               ['a', 'b', 'c'])
+    for k in lm:
+        for v1, v2 in zip(lm[k], lm_gen[k]):
+            assert_array_equal(v1.data, v2.data)
+    want = stats.linregress(design_matrix[:, 1], data[:, 0, 0])
+    lm_1 = linear_regression(stcs, design_matrix[:, :2], ['a', 'b'])['b']
+    assert_allclose(lm_1.beta.data[0, 0], want.slope)
+    assert_allclose(lm_1.stderr.data[0, 0], want.stderr)
+    assert_allclose(lm_1.p_val.data[0, 0], want.pvalue)
+    assert_allclose(lm_1.t_val.data, lm_1.beta.data / lm_1.stderr.data)
+    betas = np.linalg.lstsq(design_matrix, data.reshape(n_obs, -1),
+                            rcond=None)[0]
+    for beta, k in zip(betas, 'abc'):
+        assert_allclose(lm[k].beta.data.ravel(), beta)
+    # exact fits
+    stcs_exact = [mne.SourceEstimate(np.full((4, 5), x), vertices, 0, 1)
+                  for x in design_matrix[:, 1]]
+    lm_exact = linear_regression(stcs_exact, design_matrix, ['a', 'b', 'c'])
+    assert_allclose(lm_exact['b'].beta.data, 1.)
+    assert (lm_exact['b'].t_val.data > 1e10).all()
+    assert_allclose(lm_exact['c'].beta.data, 0., atol=1e-12)
+    # a large offset does not degrade the residuals
+    for offset in (0.1, 1e3):
+        data_offset = offset + 0.5 * design_matrix[:, 1] + \
+            1e-6 * rng.randn(4, 5, n_obs)
+        # centered reference, linregress is not precise enough for r ~ 1
+        x = design_matrix[:, 1] - design_matrix[:, 1].mean()
+        y = data_offset - data_offset.mean(axis=-1, keepdims=True)
+        slope = np.dot(y, x) / np.dot(x, x)
+        resid = y - slope[..., np.newaxis] * x
+        want = slope / np.sqrt(np.sum(resid ** 2, axis=-1) / (n_obs - 2) /
+                               np.dot(x, x))
+        stcs_offset = [mne.SourceEstimate(d, vertices, 0, 1)
+                       for d in data_offset.transpose(2, 0, 1)]
+        for inst in (stcs_offset, (s for s in stcs_offset)):
+            got = linear_regression(inst, design_matrix[:, :2], ['a', 'b'])
+            assert np.isfinite(got['b'].t_val.data).all()
+            assert_allclose(got['b'].t_val.data, want, rtol=1e-7)
+        got = regression._fit_lm(data_offset.transpose(2, 0, 1),
+                                 design_matrix[:, :2], ['a', 'b'])[2]['b']
+        assert_allclose(got, want, rtol=1e-7)
+    # permutation of the design without decomposing it again
+    design = regression._lm_design(design_matrix)
+    perm = rng.permutation(n_obs)
+    got = regression._lm_solve(design, data, 20, perm)
+    want = regression._lm_solve(regression._lm_design(design_matrix[perm]),
+                                data, 20)
+    assert_allclose(got[0], want[0])
+    assert_allclose(got[1], want[1])
+    # errors
+    with pytest.raises(ValueError, match='equal to number of observations'):
+        linear_regression(stcs[:-1], design_matrix)
+    with pytest.raises(ValueError, match='rank deficient'):
+        linear_regression(stcs, np.c_[design_matrix, design_matrix[:, :1]])
+    with pytest.raises(ValueError, match='more rows'):
+        linear_regression(stcs[:3], design_matrix[:3])
+
+
 @testing.requires_testing_data
 def test_continuous_regression_no_overlap():
     """Test regression without overlap correction, on real data."""
@@ -153,4 +226,37 @@ def test_continuous_regression_with_overlap():
     pytest.raises(TypeError, linear_regression_raw, raw, events, solver=0)
 
 
+def test_continuous_regression_cholesky():
+    """Test the normal equations solver with overlap and rejection."""
+    rng = np.random.RandomState(0)
+    n_times = 5000
+    times = np.arange(100, n_times - 200, 37)
+    events = np.c_[times, np.zeros(len(times), int),
+                   rng.randint(1, 3, len(times))]
+    effects = {1: hann(31), 2: -np.arange(31) / 30.}
+    signal = 0.05 * rng.randn(2, n_times)
+    for time, event in zip(times, events[:, 2]):
+        signal[:, time:time + 31] += effects[event]
+    signal[1, 2000:2010] += 100  # an artifact
+    raw = RawArray(signal, mne.create_info(2, 100, 'eeg'))
+    covariates = dict(cov=rng.randn(len(times)))
+
+    def solver(X, y):
+        return np.linalg.lstsq(X.toarray(), y, rcond=None)[0].T
+
+    for reject in (None, dict(eeg=10)):
+        want = linear_regression_raw(raw, events, tmin=0, tmax=0.3,
+                                     covariates=covariates, reject=reject,
+                                     solver=solver)
+        got = linear_regression_raw(raw, events, tmin=0, tmax=0.3,
+                                    covariates=covariates, reject=reject)
+        for cond in want:
+            assert_allclose(got[cond].data, want[cond].data, atol=1e-10)
+        for cond in (1, 2):
+            assert_allclose(got[str(cond)].data[0], effects[cond],
+                            atol=0.05)
+    with pytest.raises(RuntimeError, match='No clean segment'):
+        linear_regression_raw(raw, events, reject=dict(eeg=1e-3))
+
+
 run_tests_if_main()
@@ -241,6 +241,29 @@ def test_notch_filters(method, filter_length, line_freq, tol):
     assert_almost_equal(new_power, orig_power, tol)
 
 
+def test_notch_filter_spectrum_fit_channels():
+    """Test that spectrum_fit processes channels independently."""
+    rng = np.random.RandomState(0)
+    sfreq = 250.
+    t = np.arange(int(round(12 * sfreq))) / sfreq
+    x = rng.randn(5, len(t))
+    x[:2] += np.sin(2 * np.pi * 50. * t)
+    x[1:4] += 2 * np.sin(2 * np.pi * 60. * t + 1.)
+    x[4] = 0.
+    for line_freq in (None, [50., 60.]):
+        want = np.array([notch_filter(x_, sfreq, line_freq, '5s',
+                                      method='spectrum_fit') for x_ in x])
+        assert_array_equal(want[4], 0.)
+        for n_jobs in (1, 2):
+            got = notch_filter(x, sfreq, line_freq, '5s',
+                               method='spectrum_fit', n_jobs=n_jobs)
+            assert_allclose(got, want, atol=1e-10)
+        got = notch_filter(x, sfreq, line_freq, '5s', picks=[1, 3],
+                           method='spectrum_fit')
+        assert_array_equal(got[[0, 2, 4]], x[[0, 2, 4]])
+        assert_allclose(got[[1, 3]], want[[1, 3]], atol=1e-10)
+
+
 def test_resample():
     """Test resampling."""
     rng = np.random.RandomState(0)
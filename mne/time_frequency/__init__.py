@@ -5,10 +5,10 @@ from .tfr import (morlet, tfr_morlet, AverageTFR, tfr_multitaper, _BaseTFR,
 from .psd import psd_welch, psd_multitaper, psd_array_welch
 from .csd import (CrossSpectralDensity, csd_fourier, csd_multitaper,
                   csd_morlet, csd_array_fourier, csd_array_multitaper,
-                  csd_array_morlet, read_csd,
+                  csd_array_morlet, csd_tfr, read_csd,
                   pick_channels_csd)
 from .ar import fit_iir_model_raw
 from .multitaper import (dpss_windows, psd_array_multitaper,
-                         tfr_array_multitaper)
+                         tfr_array_multitaper, tfr_array_stft_multitaper)
 from ._stft import stft, istft, stftfreq
 from ._stockwell import tfr_stockwell, tfr_array_stockwell
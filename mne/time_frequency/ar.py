@@ -8,7 +8,10 @@ from scipy import linalg
 
 from ..defaults import _handle_default
 from ..io.pick import _picks_to_idx, _picks_by_type, pick_info
-from ..utils import verbose, _apply_scaling_array
+from ..utils import verbose, _apply_scaling_array, _check_option
+
+# bytes of lagged data used at once to accumulate the MVAR cross-products
+_MVAR_BLOCK_SIZE = 10e6
 
 
 def _yule_walker(X, order=1):
@@ -30,6 +33,114 @@ def _yule_walker(X, order=1):
     return rho, np.sqrt(sigmasq)
 
 
+def _mvar_lagged_products(data, order, method='ls'):
+    """Compute the lagged cross-products of epochs for MVAR fitting.
+
+    Parameters
+    ----------
+    data : ndarray, shape (n_epochs, n_signals, n_times)
+        The epochs, which are demeaned (in a copy) before fitting.
+    order : int
+        The model order.
+    method : str
+        Can be ``'ls'`` for the least-squares normal equations or ``'yw'``
+        for the block-Toeplitz Yule-Walker equations.
+
+    Returns
+    -------
+    zz : ndarray, shape (order * n_signals, order * n_signals)
+        The products of the lagged signals, ordered lag-major (i.e., the
+        row ``(k - 1) * n_signals + i`` corresponds to signal ``i`` at lag
+        ``k``).
+    yz : ndarray, shape (n_signals, order * n_signals)
+        The products of the signals with the lagged signals.
+    yy : ndarray, shape (n_signals, n_signals)
+        The zero-lag products of the signals.
+    n_obs : int
+        The number of predicted samples the products are summed over.
+    """
+    _check_option('method', method, ('ls', 'yw'))
+    n_epochs, n_signals, n_times = data.shape
+    if n_times <= order:
+        raise ValueError('The number of time points (%d) must be larger '
+                         'than the model order (%d)' % (n_times, order))
+    n_lagged = order * n_signals
+    zz = np.zeros((n_lagged, n_lagged))
+    yz = np.zeros((n_signals, n_lagged))
+    yy = np.zeros((n_signals, n_signals))
+    if method == 'yw':
+        # autocovariances gamma[k] = sum_t x(t) x(t - k).T
+        gamma = np.zeros((order + 1, n_signals, n_signals))
+    n_block = int(max(_MVAR_BLOCK_SIZE // (8 * n_lagged * n_times), 1))
+    for start in range(0, n_epochs, n_block):
+        x = data[start:start + n_block]
+        x = x - x.mean(axis=-1, keepdims=True)
+        if method == 'yw':
+            for k in range(order + 1):
+                gamma[k] += np.tensordot(x[:, :, k:], x[:, :, :n_times - k],
+                                         axes=([0, 2], [0, 2]))
+            continue
+        # stack the lagged signals of all epochs along the time axis
+        z = np.concatenate([x[:, :, order - k:n_times - k]
+                            for k in range(1, order + 1)], axis=1)
+        z = z.transpose(1, 0, 2).reshape(n_lagged, -1)
+        y = x[:, :, order:].transpose(1, 0, 2).reshape(n_signals, -1)
+        zz += np.dot(z, z.T)
+        yz += np.dot(y, z.T)
+        yy += np.dot(y, y.T)
+    if method == 'yw':
+        n_obs = n_epochs * n_times
+        for a in range(order):
+            for b in range(order):
+                zz[a * n_signals:(a + 1) * n_signals,
+                   b * n_signals:(b + 1) * n_signals] = \
+                    gamma[b - a] if b >= a else gamma[a - b].T
+            yz[:, a * n_signals:(a + 1) * n_signals] = gamma[a + 1]
+        yy[:] = gamma[0]
+    else:
+        n_obs = n_epochs * (n_times - order)
+    return zz, yz, yy, n_obs
+
+
+def _mvar_solve(zz, yz, yy, n_obs, order, sig_idx=None):
+    """Fit one or several MVAR models from lagged cross-products.
+
+    Parameters
+    ----------
+    zz, yz, yy, n_obs :
+        The output of :func:`_mvar_lagged_products`.
+    order : int
+        The model order.
+    sig_idx : ndarray, shape (n_models, n_sub) | None
+        The signals of each (sub-)model, all of which are fitted at once.
+        If None, a single model of all signals is fitted.
+
+    Returns
+    -------
+    coef : ndarray, shape (n_models, order, n_sub, n_sub)
+        The coefficients ``A_k``, such that
+        ``x(t) = sum_k A_k x(t - k) + e(t)``.
+    sigma : ndarray, shape (n_models, n_sub, n_sub)
+        The covariance of the residuals ``e(t)``.
+    """
+    n_signals = yy.shape[0]
+    if sig_idx is None:
+        sig_idx = np.arange(n_signals)[np.newaxis]
+    sig_idx = np.asarray(sig_idx)
+    n_models, n_sub = sig_idx.shape
+    rows = (np.arange(order)[:, np.newaxis] * n_signals +
+            sig_idx[:, np.newaxis, :]).reshape(n_models, order * n_sub)
+    zz = zz[rows[:, :, np.newaxis], rows[:, np.newaxis, :]]
+    yz = yz[sig_idx[:, :, np.newaxis], rows[:, np.newaxis, :]]
+    yy = yy[sig_idx[:, :, np.newaxis], sig_idx[:, np.newaxis, :]]
+    # all normal equations are solved in one batch
+    coef = np.linalg.solve(zz, yz.transpose(0, 2, 1)).transpose(0, 2, 1)
+    sigma = (yy - np.matmul(coef, yz.transpose(0, 2, 1))) / n_obs
+    sigma = (sigma + sigma.transpose(0, 2, 1)) / 2.
+    coef = coef.reshape(n_models, n_sub, order, n_sub).transpose(0, 2, 1, 3)
+    return coef, sigma
+
+
 @verbose
 def fit_iir_model_raw(raw, order=2, picks=None, tmin=None, tmax=None,
                       verbose=None):
@@ -9,14 +9,15 @@ import copy as cp
 import numbers
 
 import numpy as np
-from .tfr import _cwt_array, morlet, _get_nfft
+from .tfr import _cwt_array, morlet, _get_nfft, EpochsTFR
 from ..fixes import rfftfreq
 from ..io.pick import pick_channels, _picks_to_idx
 from ..utils import (logger, verbose, warn, copy_function_doc_to_method_doc,
-                     ProgressBar)
+                     ProgressBar, _check_compute_dtype, _validate_type,
+                     _time_mask, _ensure_int)
 from ..viz.misc import plot_csd
 from ..time_frequency.multitaper import (_compute_mt_params, _mt_spectra,
-                                         _csd_from_mt, _psd_from_mt_adaptive)
+                                         _psd_from_mt_adaptive)
 from ..parallel import parallel_func
 from ..externals.h5io import read_hdf5, write_hdf5
 
@@ -53,14 +54,10 @@ def pick_channels_csd(csd, include=[], exclude=[], ordered=False, copy=True):
 
     sel = pick_channels(csd.ch_names, include=include, exclude=exclude,
                         ordered=ordered)
-    data = []
-    for vec in csd._data.T:
-        mat = _vector_to_sym_mat(vec)
-        mat = mat[sel, :][:, sel]
-        data.append(_sym_mat_to_vector(mat))
+    mat = _vector_to_sym_mat(csd._data)
     ch_names = [csd.ch_names[i] for i in sel]
 
-    csd._data = np.array(data).T
+    csd._data = _sym_mat_to_vector(mat[sel][:, sel])
     csd.ch_names = ch_names
     return csd
 
@@ -521,32 +518,34 @@ def _vector_to_sym_mat(vec):
 
     Parameters
     ----------
-    vec : list or 1d-array
-        The vector to convert to a symmetric matrix.
+    vec : list or 1d-array, shape (n_triu, ...)
+        The vector to convert to a symmetric matrix. Extra dimensions (e.g.,
+        frequencies) are preserved.
 
     Returns
     -------
-    mat : 2d-array
+    mat : 2d-array, shape (n_channels, n_channels, ...)
         The symmetric matrix.
 
     See Also
     --------
     _sym_mat_to_vector
     """
+    vec = np.asarray(vec)
     dim = _n_dims_from_triu(len(vec))
-    mat = np.zeros((dim, dim) + vec.shape[1:], dtype=vec.dtype)
+    mat = np.empty((dim, dim) + vec.shape[1:], dtype=vec.dtype)
+    row, col = np.triu_indices(dim)
 
     # Fill the upper triangle of the matrix
-    mat[np.triu_indices(dim)] = vec
+    mat[row, col] = vec
 
     # Fill out the lower tri (make conjugate to ensure matrix is hermitian)
-    mat = mat + np.rollaxis(mat, 1).conj()
+    mat[col, row] = np.conj(vec)
 
-    # We counted the diagonal twice
-    if np.issubdtype(mat.dtype, np.integer):
-        mat[np.diag_indices(dim)] //= 2
-    else:
-        mat[np.diag_indices(dim)] /= 2
+    # The diagonal of a hermitian matrix is real
+    if np.iscomplexobj(mat):
+        diag = np.arange(dim)
+        mat[diag, diag] = mat[diag, diag].real
 
     return mat
 
@@ -559,19 +558,20 @@ def _sym_mat_to_vector(mat):
 
     Parameters
     ----------
-    mat : 2d-array
-        The symmetric matrix to convert to a vector
+    mat : 2d-array, shape (n_channels, n_channels, ...)
+        The symmetric matrix to convert to a vector. Extra dimensions (e.g.,
+        frequencies) are preserved.
 
     Returns
     -------
-    vec : 1d-array
+    vec : 1d-array, shape (n_triu, ...)
         A vector consisting of the values of the upper triangle of the matrix.
 
     See Also
     --------
     _vector_to_sym_mat
     """
-    return mat[np.triu_indices_from(mat)]
+    return mat[np.triu_indices(len(mat))]
 
 
 def read_csd(fname):
@@ -651,7 +651,7 @@ def csd_fourier(epochs, fmin=0, fmax=np.inf, tmin=None, tmax=None, picks=None,
 @verbose
 def csd_array_fourier(X, sfreq, t0=0, fmin=0, fmax=np.inf, tmin=None,
                       tmax=None, ch_names=None, n_fft=None, projs=None,
-                      n_jobs=1, verbose=None):
+                      n_jobs=1, dtype='float64', verbose=None):
     """Estimate cross-spectral density from an array using short-time fourier.
 
     Parameters
@@ -684,6 +684,9 @@ def csd_array_fourier(X, sfreq, t0=0, fmin=0, fmax=np.inf, tmin=None,
         List of projectors to store in the CSD object. Defaults to ``None``,
         which means no projectors are stored.
     %(n_jobs)s
+    %(dtype-spectral)s
+
+        .. versionadded:: 0.23
     %(verbose)s
 
     Returns
@@ -700,7 +703,7 @@ def csd_array_fourier(X, sfreq, t0=0, fmin=0, fmax=np.inf, tmin=None,
     csd_multitaper
     """
     X, times, tmin, tmax, fmin, fmax = _prepare_csd_array(
-        X, sfreq, t0, tmin, tmax, fmin, fmax)
+        X, sfreq, t0, tmin, tmax, fmin, fmax, dtype)
 
     # Slice X to the requested time window
     tstart = None if tmin is None else np.searchsorted(times, tmin - 1e-10)
@@ -791,7 +794,7 @@ def csd_multitaper(epochs, fmin=0, fmax=np.inf, tmin=None, tmax=None,
 def csd_array_multitaper(X, sfreq, t0=0, fmin=0, fmax=np.inf, tmin=None,
                          tmax=None, ch_names=None, n_fft=None, bandwidth=None,
                          adaptive=False, low_bias=True, projs=None, n_jobs=1,
-                         verbose=None):
+                         dtype='float64', verbose=None):
     """Estimate cross-spectral density from an array using a multitaper method.
 
     Parameters
@@ -831,6 +834,9 @@ def csd_array_multitaper(X, sfreq, t0=0, fmin=0, fmax=np.inf, tmin=None,
         List of projectors to store in the CSD object. Defaults to ``None``,
         which means no projectors are stored.
     %(n_jobs)s
+    %(dtype-spectral)s
+
+        .. versionadded:: 0.23
     %(verbose)s
 
     Returns
@@ -847,7 +853,7 @@ def csd_array_multitaper(X, sfreq, t0=0, fmin=0, fmax=np.inf, tmin=None,
     csd_multitaper
     """
     X, times, tmin, tmax, fmin, fmax = _prepare_csd_array(
-        X, sfreq, t0, tmin, tmax, fmin, fmax)
+        X, sfreq, t0, tmin, tmax, fmin, fmax, dtype)
 
     # Slice X to the requested time window
     tstart = None if tmin is None else np.searchsorted(times, tmin - 1e-10)
@@ -940,7 +946,7 @@ def csd_morlet(epochs, frequencies, tmin=None, tmax=None, picks=None,
 @verbose
 def csd_array_morlet(X, sfreq, frequencies, t0=0, tmin=None, tmax=None,
                      ch_names=None, n_cycles=7, use_fft=True, decim=1,
-                     projs=None, n_jobs=1, verbose=None):
+                     projs=None, n_jobs=1, dtype='float64', verbose=None):
     """Estimate cross-spectral density from an array using Morlet wavelets.
 
     Parameters
@@ -981,6 +987,9 @@ def csd_array_morlet(X, sfreq, frequencies, t0=0, tmin=None, tmax=None,
         List of projectors to store in the CSD object. Defaults to ``None``,
         which means the projectors defined in the Epochs object will be copied.
     %(n_jobs)s
+    %(dtype-spectral)s
+
+        .. versionadded:: 0.23
     %(verbose)s
 
     Returns
@@ -996,7 +1005,8 @@ def csd_array_morlet(X, sfreq, frequencies, t0=0, tmin=None, tmax=None,
     csd_morlet
     csd_multitaper
     """
-    X, times, tmin, tmax, _, _ = _prepare_csd_array(X, sfreq, t0, tmin, tmax)
+    X, times, tmin, tmax, _, _ = _prepare_csd_array(X, sfreq, t0, tmin, tmax,
+                                                    dtype=dtype)
     n_times = len(times)
 
     # Construct the appropriate Morlet wavelets
@@ -1030,6 +1040,105 @@ def csd_array_morlet(X, sfreq, frequencies, t0=0, tmin=None, tmax=None,
                                  n_jobs=n_jobs, verbose=verbose)
 
 
+@verbose
+def csd_tfr(epochs_tfr, tmin=None, tmax=None, picks=None, projs=None,
+            decim=1, verbose=None):
+    """Estimate cross-spectral density from complex time-frequency epochs.
+
+    The CSD is the average over epochs and time points of the products of
+    the complex time-frequency coefficients. Since the coefficients are only
+    computed once, CSDs for several time windows (e.g., for a DICS
+    beamformer applied to a sequence of time windows) or channel subsets can
+    be obtained from the same decomposition without recomputing it.
+
+    Parameters
+    ----------
+    epochs_tfr : instance of EpochsTFR
+        The complex time-frequency decomposition of the epochs, e.g., as
+        computed by :func:`mne.time_frequency.tfr_morlet` with
+        ``output='complex'`` and ``average=False``. The epochs are processed
+        one at a time, so the data can also be a memory-mapped array.
+    tmin : float | None
+        Minimum time instant to consider, in seconds. If ``None`` start at
+        first sample.
+    tmax : float | None
+        Maximum time instant to consider, in seconds. If ``None`` end at last
+        sample.
+    %(picks_good_data_noref)s
+    projs : list of Projection | None
+        List of projectors to store in the CSD object. Defaults to ``None``,
+        which means the projectors defined in the EpochsTFR object will be
+        copied.
+    decim : int
+        The decimation factor used when computing ``epochs_tfr``. The
+        CSD is scaled by the original sampling frequency
+        (``epochs_tfr.info['sfreq'] * decim``) so that it does not depend on
+        the decimation, like in :func:`csd_morlet`. Defaults to 1 (no
+        decimation).
+    %(verbose)s
+
+    Returns
+    -------
+    csd : instance of CrossSpectralDensity
+        The computed cross-spectral density.
+
+    See Also
+    --------
+    csd_array_morlet
+    csd_morlet
+    mne.time_frequency.tfr_morlet
+
+    Notes
+    -----
+    With ``zero_mean=False`` and ``use_fft=True`` in
+    :func:`mne.time_frequency.tfr_morlet`, the result is the same as the one
+    of :func:`csd_morlet` with the same ``tmin`` and ``tmax``.
+
+    .. versionadded:: 0.23
+    """
+    _validate_type(epochs_tfr, EpochsTFR, 'epochs_tfr')
+    if not np.iscomplexobj(epochs_tfr.data):
+        raise ValueError('epochs_tfr must contain complex data, compute it '
+                         'with output="complex"')
+    decim = _ensure_int(decim, 'decim')
+    if decim < 1:
+        raise ValueError('decim must be a positive integer, got %d' % decim)
+    sfreq = epochs_tfr.info['sfreq']
+    times = epochs_tfr.times
+    if tmax is not None and tmin is not None and tmax < tmin:
+        raise ValueError('tmax must be larger than tmin')
+    time_mask = _time_mask(times, tmin, tmax, sfreq=sfreq)
+    if not time_mask.any():
+        raise ValueError('No time points between tmin=%s and tmax=%s'
+                         % (tmin, tmax))
+    tstart, tstop = np.where(time_mask)[0][[0, -1]]
+    tslice = slice(tstart, tstop + 1)
+    picks = _picks_to_idx(epochs_tfr.info, picks, 'data', with_ref_meg=False)
+    if projs is None:
+        projs = epochs_tfr.info['projs']
+
+    logger.info('Computing cross-spectral density from epochs TFR...')
+    n_epochs = len(epochs_tfr.data)
+    n_times = tstop + 1 - tstart
+    csds = np.zeros((len(epochs_tfr.freqs), len(picks), len(picks)),
+                    epochs_tfr.data.dtype)
+    for epoch in epochs_tfr.data:
+        # only read the selected channels and time points of each epoch
+        x = epoch[picks, :, tslice].transpose(1, 0, 2)
+        csds += np.matmul(x, x.conj().transpose(0, 2, 1))
+    csds = _sym_mat_to_vector(csds.transpose(1, 2, 0))
+    csds /= n_epochs * n_times
+    # Scaling by (original) sampling frequency for compatibility with Matlab
+    csds /= sfreq * decim
+    logger.info('[done]')
+
+    ch_names = [epochs_tfr.ch_names[pick] for pick in picks]
+    return CrossSpectralDensity(csds, ch_names=ch_names,
+                                tmin=times[tslice][0], tmax=times[tslice][-1],
+                                frequencies=epochs_tfr.freqs, n_fft=1,
+                                projs=projs)
+
+
 def _prepare_csd(epochs, tmin=None, tmax=None, picks=None, projs=None):
     """Do some checking and preprocessing of common csd_* parameters.
 
@@ -1058,12 +1167,15 @@ def _prepare_csd(epochs, tmin=None, tmax=None, picks=None, projs=None):
     return epochs, projs
 
 
-def _prepare_csd_array(X, sfreq, t0, tmin, tmax, fmin=None, fmax=None):
+def _prepare_csd_array(X, sfreq, t0, tmin, tmax, fmin=None, fmax=None,
+                       dtype='float64'):
     """Do some checking and preprocessing of common csd_r=array_* parameters.
 
-    See the csd_array_* functions for documentation of the parameters.
+    See the csd_array_* functions for documentation of the parameters. The
+    data are cast to ``dtype``, which sets the precision of the CSD
+    computations.
     """
-    X = np.asarray(X, dtype=float)
+    X = np.asarray(X, dtype=_check_compute_dtype(dtype))
     if X.ndim != 3:
         raise ValueError("X must be n_epochs x n_channels x n_times.")
 
@@ -1103,7 +1215,8 @@ def _execute_csd_function(X, times, frequencies, csd_function, params, n_fft,
     ----------
     X : array-like, shape (n_epochs, n_channels, n_times)
         The time series data consisting of n_epochs separate observations
-        of signals with n_channels time-series of length n_times.
+        of signals with n_channels time-series of length n_times. Its
+        precision is used for the computations.
     times : float
         Timestamps for each sample.
     frequencies : list of float
@@ -1134,7 +1247,7 @@ def _execute_csd_function(X, times, frequencies, csd_function, params, n_fft,
 
     n_freqs = len(frequencies)
     csds_mean = np.zeros((n_channels * (n_channels + 1) // 2, n_freqs),
-                         dtype=np.complex128)
+                         dtype=np.result_type(X.dtype, np.complex64))
 
     # Prepare the function that does the actual CSD computation for parallel
     # execution.
@@ -1180,24 +1293,11 @@ def _csd_fourier(X, sfreq, n_times, freq_mask, n_fft):
     n_fft : int
         Length of the FFT.
     """
-    x_mt, _ = _mt_spectra(X, np.hanning(n_times), sfreq, n_fft)
-
-    # Hack so we can sum over axis=-2
-    weights = np.array([1.])[:, np.newaxis, np.newaxis, np.newaxis]
-
+    x_mt, _ = _mt_spectra(X, np.hanning(n_times), sfreq, n_fft, X.dtype)
     x_mt = x_mt[:, :, freq_mask]
 
-    # Calculating CSD
-    # Tiling x_mt so that we can easily use _csd_from_mt()
-    x_mt = x_mt[:, np.newaxis, :, :]
-    x_mt = np.tile(x_mt, [1, x_mt.shape[0], 1, 1])
-    y_mt = np.transpose(x_mt, axes=[1, 0, 2, 3])
-    weights_y = np.transpose(weights, axes=[1, 0, 2, 3])
-    csds = _csd_from_mt(x_mt, y_mt, weights, weights_y)
-
-    # FIXME: don't compute full matrix in the first place
-    csds = np.array([_sym_mat_to_vector(csds[:, :, i])
-                     for i in range(csds.shape[-1])]).T
+    # Calculating CSD (see _csd_from_mt for the factor 2)
+    csds = _csd_from_scaled_spectra(x_mt * np.sqrt(2., dtype=X.dtype))
 
     # Scaling by number of samples and compensating for loss of power
     # due to windowing (see section 11.5.2 in Bendat & Piersol).
@@ -1237,32 +1337,25 @@ def _csd_multitaper(X, sfreq, n_times, window_fun, eigvals, freq_mask, n_fft,
     adaptive : bool
         Use adaptive weights to combine the tapered spectra into PSD.
     """
-    x_mt, _ = _mt_spectra(X, window_fun, sfreq, n_fft)
+    x_mt, _ = _mt_spectra(X, window_fun, sfreq, n_fft, X.dtype)
 
     if adaptive:
         # Compute adaptive weights
         _, weights = _psd_from_mt_adaptive(x_mt, eigvals, freq_mask,
                                            return_weights=True)
-        # Tiling weights so that we can easily use _csd_from_mt()
-        weights = weights[:, np.newaxis, :, :]
-        weights = np.tile(weights, [1, x_mt.shape[0], 1, 1])
+        weights = weights.astype(X.dtype)
     else:
         # Do not use adaptive weights
-        weights = np.sqrt(eigvals)[np.newaxis, np.newaxis, :, np.newaxis]
+        weights = np.sqrt(eigvals).astype(X.dtype)
+        weights = weights[np.newaxis, :, np.newaxis]
 
     x_mt = x_mt[:, :, freq_mask]
 
-    # Calculating CSD
-    # Tiling x_mt so that we can easily use _csd_from_mt()
-    x_mt = x_mt[:, np.newaxis, :, :]
-    x_mt = np.tile(x_mt, [1, x_mt.shape[0], 1, 1])
-    y_mt = np.transpose(x_mt, axes=[1, 0, 2, 3])
-    weights_y = np.transpose(weights, axes=[1, 0, 2, 3])
-    csds = _csd_from_mt(x_mt, y_mt, weights, weights_y)
-
-    # FIXME: don't compute full matrix in the first place
-    csds = np.array([_sym_mat_to_vector(csds[:, :, i])
-                     for i in range(csds.shape[-1])]).T
+    # Calculating CSD: scale the tapered spectra so that the CSD is the sum
+    # over tapers of x * conj(y), as computed by _csd_from_mt
+    x_mt = x_mt * (weights * np.sqrt(2. / np.sum(
+        weights * weights, axis=-2, keepdims=True)))
+    csds = _csd_from_scaled_spectra(x_mt)
 
     # Scaling by sampling frequency for compatibility with Matlab
     csds /= sfreq
@@ -1314,7 +1407,7 @@ def _csd_morlet(data, sfreq, wavelets, nfft, tslice=None, use_fft=True,
     """
     # Compute PSD
     psds = _cwt_array(data, wavelets, nfft, mode='same', use_fft=use_fft,
-                      decim=decim)
+                      decim=decim, dtype=data.dtype)
 
     if tslice is not None:
         tstart = None if tslice.start is None else tslice.start // decim
@@ -1323,14 +1416,32 @@ def _csd_morlet(data, sfreq, wavelets, nfft, tslice=None, use_fft=True,
         tslice = slice(tstart, tstop, tstep)
         psds = psds[:, :, tslice]
 
-    psds_conj = np.conj(psds)
-
-    # Compute the spectral density between all pairs of series
-    n_channels = data.shape[0]
-    csds = np.vstack([np.mean(psds[[i]] * psds_conj[i:], axis=2)
-                      for i in range(n_channels)])
+    # Compute the spectral density between all pairs of series (the mean
+    # over time of x * conj(y))
+    psds = psds.transpose(0, 2, 1)
+    psds = psds * np.sqrt(1. / psds.shape[1], dtype=data.dtype)
+    csds = _csd_from_scaled_spectra(psds)
 
     # Scaling by sampling frequency for compatibility with Matlab
     csds /= sfreq
 
     return csds
+
+
+def _csd_from_scaled_spectra(x_mt):
+    """Compute the upper triangles of CSD matrices from scaled spectra.
+
+    Parameters
+    ----------
+    x_mt : ndarray, shape (n_channels, n_tapers, n_freqs)
+        The (tapered) spectra, scaled such that the CSD between two channels
+        is the sum over the second axis of ``x * conj(y)``.
+
+    Returns
+    -------
+    csd : ndarray, shape ((n_channels**2 + n_channels) / 2, n_freqs)
+        For each frequency, the upper triangle of the CSD matrix.
+    """
+    x_mt = x_mt.transpose(2, 0, 1)
+    csds = np.matmul(x_mt, x_mt.conj().transpose(0, 2, 1))
+    return _sym_mat_to_vector(csds.transpose(1, 2, 0))
@@ -3,12 +3,18 @@
 
 # Parts of this code were copied from NiTime http://nipy.sourceforge.net/nitime
 
+from functools import lru_cache
 import operator
+import os
+import os.path as op
+import tempfile
+
 import numpy as np
 
 from ..fixes import rfft, irfft, rfftfreq
 from ..parallel import parallel_func
-from ..utils import sum_squared, warn, verbose, logger, _check_option
+from ..utils import (sum_squared, warn, verbose, logger, _check_option,
+                     _check_compute_dtype, get_config)
 
 
 def dpss_windows(N, half_nbw, Kmax, low_bias=True, interp_from=None,
@@ -58,7 +64,52 @@ def dpss_windows(N, half_nbw, Kmax, low_bias=True, interp_from=None,
     Slepian, D. Prolate spheroidal wave functions, Fourier analysis, and
     uncertainty V: The discrete case. Bell System Technical Journal,
     Volume 57 (1978), 1371430
+
+    Without ``interp_from``, the tapers and eigenvalues of the most recent
+    ``(N, half_nbw, Kmax, low_bias)`` combinations are kept in memory. If
+    the ``MNE_DPSS_CACHE_DIR`` configuration value is set (see
+    :func:`mne.set_config`), they are also stored in and read from that
+    directory, so that they can be reused across sessions.
     """
+    if interp_from is None:
+        dpss, eigvals = _dpss_windows_cached(
+            operator.index(N), float(half_nbw), operator.index(Kmax),
+            bool(low_bias))
+        return dpss.copy(), eigvals.copy()
+    return _dpss_windows(N, half_nbw, Kmax, low_bias, interp_from,
+                         interp_kind)
+
+
+@lru_cache(maxsize=16)
+def _dpss_windows_cached(N, half_nbw, Kmax, low_bias):
+    """Get read-only DPSS tapers from the caches or compute them."""
+    cache_dir = get_config('MNE_DPSS_CACHE_DIR')
+    fname = dpss = None
+    if cache_dir:
+        fname = op.join(cache_dir, 'dpss-%d-%r-%d-%d.npz'
+                        % (N, half_nbw, Kmax, low_bias))
+        if op.isfile(fname):
+            logger.debug('Reading DPSS windows from %s' % (fname,))
+            with np.load(fname) as npz:
+                dpss, eigvals = npz['dpss'], npz['eigvals']
+    if dpss is None:
+        dpss, eigvals = _dpss_windows(N, half_nbw, Kmax, low_bias)
+        if fname is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # write to a temporary file first so that concurrent readers
+            # never see a partial file
+            fd, tmp_fname = tempfile.mkstemp(suffix='.npz', dir=cache_dir)
+            with os.fdopen(fd, 'wb') as fid:
+                np.savez(fid, dpss=dpss, eigvals=eigvals)
+            os.replace(tmp_fname, fname)
+    dpss.flags.writeable = False
+    eigvals.flags.writeable = False
+    return dpss, eigvals
+
+
+def _dpss_windows(N, half_nbw, Kmax, low_bias=True, interp_from=None,
+                  interp_kind='linear'):
+    """Compute DPSS windows without caching (see dpss_windows)."""
     from scipy import interpolate
     from scipy.signal.windows import dpss as sp_dpss
     from ..filter import next_fast_len
@@ -159,6 +210,7 @@ def _psd_from_mt_adaptive(x_mt, eigvals, freq_mask, max_iter=150,
     if n_tapers < 3:
         raise ValueError('Not enough tapers to compute adaptive weights.')
 
+    eigvals = eigvals.astype(x_mt.real.dtype, copy=False)
     rt_eig = np.sqrt(eigvals)
 
     # estimate the variance from an estimate with fixed weights
@@ -166,65 +218,66 @@ def _psd_from_mt_adaptive(x_mt, eigvals, freq_mask, max_iter=150,
     x_var = np.trapz(psd_est, dx=np.pi / n_freqs) / (2 * np.pi)
     del psd_est
 
-    # allocate space for output
-    psd = np.empty((n_signals, np.sum(freq_mask)))
-
-    # only keep the frequencies of interest
+    # only keep the frequencies of interest, and iterate over all
+    # (signal, frequency) pairs at once: shape (n_pairs, n_tapers)
     x_mt = x_mt[:, :, freq_mask]
-
-    if return_weights:
-        weights = np.empty((n_signals, n_tapers, psd.shape[1]))
-
-    for i, (xk, var) in enumerate(zip(x_mt, x_var)):
-        # combine the SDFs in the traditional way in order to estimate
-        # the variance of the timeseries
-
-        # The process is to iteratively switch solving for the following
-        # two expressions:
-        # (1) Adaptive Multitaper SDF:
-        # S^{mt}(f) = [ sum |d_k(f)|^2 S_k(f) ]/ sum |d_k(f)|^2
-        #
-        # (2) Weights
-        # d_k(f) = [sqrt(lam_k) S^{mt}(f)] / [lam_k S^{mt}(f) + E{B_k(f)}]
-        #
-        # Where lam_k are the eigenvalues corresponding to the DPSS tapers,
-        # and the expected value of the broadband bias function
-        # E{B_k(f)} is replaced by its full-band integration
-        # (1/2pi) int_{-pi}^{pi} E{B_k(f)} = sig^2(1-lam_k)
-
-        # start with an estimate from incomplete data--the first 2 tapers
-        psd_iter = _psd_from_mt(xk[:2, :], rt_eig[:2, np.newaxis])
-
-        err = np.zeros_like(xk)
-        for n in range(max_iter):
-            d_k = (psd_iter / (eigvals[:, np.newaxis] * psd_iter +
-                               (1 - eigvals[:, np.newaxis]) * var))
-            d_k *= rt_eig[:, np.newaxis]
-            # Test for convergence -- this is overly conservative, since
-            # iteration only stops when all frequencies have converged.
-            # A better approach is to iterate separately for each freq, but
-            # that is a nonvectorized algorithm.
-            # Take the RMS difference in weights from the previous iterate
-            # across frequencies. If the maximum RMS error across freqs is
-            # less than 1e-10, then we're converged
-            err -= d_k
-            if np.max(np.mean(err ** 2, axis=0)) < 1e-10:
+    n_keep = x_mt.shape[2]
+    x_pow = (x_mt * x_mt.conj()).real.transpose(0, 2, 1).reshape(-1, n_tapers)
+    del x_mt
+    var = np.repeat(x_var, n_keep)[:, np.newaxis]
+
+    # The process is to iteratively switch solving for the following
+    # two expressions:
+    # (1) Adaptive Multitaper SDF:
+    # S^{mt}(f) = [ sum |d_k(f)|^2 S_k(f) ]/ sum |d_k(f)|^2
+    #
+    # (2) Weights
+    # d_k(f) = [sqrt(lam_k) S^{mt}(f)] / [lam_k S^{mt}(f) + E{B_k(f)}]
+    #
+    # Where lam_k are the eigenvalues corresponding to the DPSS tapers,
+    # and the expected value of the broadband bias function
+    # E{B_k(f)} is replaced by its full-band integration
+    # (1/2pi) int_{-pi}^{pi} E{B_k(f)} = sig^2(1-lam_k)
+
+    # start with an estimate from incomplete data--the first 2 tapers
+    psd = 2 * (x_pow[:, :2] * eigvals[:2]).sum(axis=-1) / eigvals[:2].sum()
+    weights = np.empty_like(x_pow)
+
+    # Each (signal, frequency) pair stops iterating once the mean squared
+    # difference in its weights from the previous iterate is less than
+    # 1e-10, and is then removed from the (compacted) working set.
+    active = np.arange(len(psd))
+    psd_iter = psd[:, np.newaxis]
+    d_prev = np.zeros_like(x_pow)
+    for n in range(max_iter):
+        d_k = psd_iter / (eigvals * psd_iter + (1 - eigvals) * var)
+        d_k *= rt_eig
+        d_prev -= d_k
+        d_prev *= d_prev
+        converged = np.mean(d_prev, axis=-1) < 1e-10
+        if converged.any():
+            psd[active[converged]] = psd_iter[converged, 0]
+            weights[active[converged]] = d_k[converged]
+            keep = ~converged
+            active, d_k, x_pow, var = \
+                active[keep], d_k[keep], x_pow[keep], var[keep]
+            if len(active) == 0:
                 break
 
-            # update the iterative estimate with this d_k
-            psd_iter = _psd_from_mt(xk, d_k)
-            err = d_k
-
-        if n == max_iter - 1:
-            warn('Iterative multi-taper PSD computation did not converge.')
-
-        psd[i, :] = psd_iter
-
-        if return_weights:
-            weights[i, :, :] = d_k
+        # update the iterative estimate with this d_k
+        d_prev = d_k
+        d_k_sq = d_k * d_k
+        psd_iter = 2 * ((d_k_sq * x_pow).sum(axis=-1, keepdims=True) /
+                        d_k_sq.sum(axis=-1, keepdims=True))
+    else:
+        warn('Iterative multi-taper PSD computation did not converge.')
+        psd[active] = psd_iter[:, 0]
+        weights[active] = d_k
 
+    psd = psd.reshape(n_signals, n_keep)
     if return_weights:
-        return psd, weights
+        weights = weights.reshape(n_signals, n_keep, n_tapers)
+        return psd, weights.transpose(0, 2, 1)
     else:
         return psd
 
@@ -277,7 +330,7 @@ def _csd_from_mt(x_mt, y_mt, weights_x, weights_y):
     return csd
 
 
-def _mt_spectra(x, dpss, sfreq, n_fft=None):
+def _mt_spectra(x, dpss, sfreq, n_fft=None, dtype=np.float64):
     """Compute tapered spectra.
 
     Parameters
@@ -291,6 +344,9 @@ def _mt_spectra(x, dpss, sfreq, n_fft=None):
     n_fft : int | None
         Length of the FFT. If None, the number of samples in the input signal
         will be used.
+    dtype : dtype
+        The real precision of the computations. The tapered spectra have the
+        matching complex type.
 
     Returns
     -------
@@ -303,7 +359,9 @@ def _mt_spectra(x, dpss, sfreq, n_fft=None):
         n_fft = x.shape[-1]
 
     # remove mean (do not use in-place subtraction as it may modify input x)
+    x = np.asarray(x, dtype)
     x = x - np.mean(x, axis=-1, keepdims=True)
+    dpss = np.asarray(dpss, dtype)
 
     # only keep positive frequencies
     freqs = rfftfreq(n_fft, 1. / sfreq)
@@ -312,12 +370,12 @@ def _mt_spectra(x, dpss, sfreq, n_fft=None):
     # x_mt = fftpack.fft(x[:, np.newaxis, :] * dpss, n=n_fft)
     n_tapers = dpss.shape[0] if dpss.ndim > 1 else 1
     x_mt = np.zeros(x.shape[:-1] + (n_tapers, len(freqs)),
-                    dtype=np.complex128)
+                    dtype=np.result_type(dtype, np.complex64))
     for idx, sig in enumerate(x):
         x_mt[idx] = rfft(sig[..., np.newaxis, :] * dpss, n=n_fft)
     # Adjust DC and maybe Nyquist, depending on one-sided transform
     x_mt[..., 0] /= np.sqrt(2.)
-    if x.shape[1] % 2 == 0:
+    if n_fft % 2 == 0:
         x_mt[..., -1] /= np.sqrt(2.)
     return x_mt, freqs
 
@@ -363,7 +421,7 @@ def _compute_mt_params(n_times, sfreq, bandwidth, low_bias, adaptive,
 @verbose
 def psd_array_multitaper(x, sfreq, fmin=0, fmax=np.inf, bandwidth=None,
                          adaptive=False, low_bias=True, normalization='length',
-                         n_jobs=1, verbose=None):
+                         n_jobs=1, dtype='float64', verbose=None):
     """Compute power spectral density (PSD) using a multi-taper method.
 
     Parameters
@@ -389,6 +447,9 @@ def psd_array_multitaper(x, sfreq, fmin=0, fmax=np.inf, bandwidth=None,
         be normalized by the sampling rate as well as the length of
         the signal (as in nitime).
     %(n_jobs)s
+    %(dtype-spectral)s
+
+        .. versionadded:: 0.23
     %(verbose)s
 
     Returns
@@ -411,6 +472,7 @@ def psd_array_multitaper(x, sfreq, fmin=0, fmax=np.inf, bandwidth=None,
     .. versionadded:: 0.14.0
     """
     _check_option('normalization', normalization, ['length', 'full'])
+    dtype = _check_compute_dtype(dtype)
 
     # Reshape data so its 2-D for parallelization
     ndim_in = x.ndim
@@ -427,14 +489,15 @@ def psd_array_multitaper(x, sfreq, fmin=0, fmax=np.inf, bandwidth=None,
     freq_mask = (freqs >= fmin) & (freqs <= fmax)
     freqs = freqs[freq_mask]
 
-    psd = np.zeros((x.shape[0], freq_mask.sum()))
+    psd = np.zeros((x.shape[0], freq_mask.sum()), dtype)
     # Let's go in up to 50 MB chunks of signals to save memory
-    n_chunk = max(50000000 // (len(freq_mask) * len(eigvals) * 16), n_jobs)
+    n_chunk = max(50000000 // (len(freq_mask) * len(eigvals) *
+                               2 * dtype.itemsize), n_jobs)
     offsets = np.concatenate((np.arange(0, x.shape[0], n_chunk), [x.shape[0]]))
     for start, stop in zip(offsets[:-1], offsets[1:]):
-        x_mt = _mt_spectra(x[start:stop], dpss, sfreq)[0]
+        x_mt = _mt_spectra(x[start:stop], dpss, sfreq, dtype=dtype)[0]
         if not adaptive:
-            weights = np.sqrt(eigvals)[np.newaxis, :, np.newaxis]
+            weights = np.sqrt(eigvals).astype(dtype)[np.newaxis, :, np.newaxis]
             psd[start:stop] = _psd_from_mt(x_mt[:, :, freq_mask], weights)
         else:
             n_splits = min(stop - start, n_jobs)
@@ -457,7 +520,7 @@ def psd_array_multitaper(x, sfreq, fmin=0, fmax=np.inf, bandwidth=None,
 @verbose
 def tfr_array_multitaper(epoch_data, sfreq, freqs, n_cycles=7.0,
                          zero_mean=True, time_bandwidth=None, use_fft=True,
-                         decim=1, output='complex', n_jobs=1,
+                         decim=1, output='complex', n_jobs=1, dtype='float64',
                          verbose=None):
     """Compute Time-Frequency Representation (TFR) using DPSS tapers.
 
@@ -503,7 +566,11 @@ def tfr_array_multitaper(epoch_data, sfreq, freqs, n_cycles=7.0,
           coherence across trials.
     %(n_jobs)s
         The number of epochs to process at the same time. The parallelization
-        is implemented across channels. Defaults to 1.
+        is implemented across channels (and across epochs for the averaged
+        outputs). Defaults to 1.
+    %(dtype-spectral)s
+
+        .. versionadded:: 0.23
     %(verbose)s
 
     Returns
@@ -532,4 +599,149 @@ def tfr_array_multitaper(epoch_data, sfreq, freqs, n_cycles=7.0,
                         method='multitaper', n_cycles=n_cycles,
                         zero_mean=zero_mean, time_bandwidth=time_bandwidth,
                         use_fft=use_fft, decim=decim, output=output,
-                        n_jobs=n_jobs, verbose=verbose)
+                        n_jobs=n_jobs, dtype=dtype, verbose=verbose)
+
+
+def _stft_mt_power(x, dpss, weights, sfreq, n_per_seg, step, n_fft,
+                   freq_mask, output, dtype):
+    """Compute the sliding multitaper spectra of a chunk of signals."""
+    n_signals, n_times = x.shape
+    n_segments = (n_times - n_per_seg) // step + 1
+    x = np.ascontiguousarray(x, dtype)
+    segments = np.lib.stride_tricks.as_strided(
+        x, (n_signals, n_segments, n_per_seg),
+        (x.strides[0], step * x.strides[1], x.strides[1]), writeable=False)
+    # One FFT per signal for all windows and tapers
+    x_mt = _mt_spectra(segments, dpss, sfreq, n_fft, dtype)[0]
+    x_mt = x_mt[..., freq_mask]  # (n_signals, n_segments, n_tapers, n_freqs)
+    if output == 'complex':
+        return x_mt.transpose(0, 2, 3, 1)
+    return _psd_from_mt(x_mt, weights).transpose(0, 2, 1)
+
+
+@verbose
+def tfr_array_stft_multitaper(epoch_data, sfreq, n_per_seg, step=None,
+                              fmin=0, fmax=np.inf, bandwidth=None,
+                              low_bias=True, n_fft=None, output='power',
+                              n_jobs=1, dtype='float64', verbose=None):
+    """Compute a sliding-window multitaper spectrogram.
+
+    Unlike :func:`tfr_array_multitaper`, which convolves the data with
+    tapered wavelets whose length depends on the frequency, this uses the
+    same DPSS tapers for all frequencies with a fixed window length (as
+    :func:`psd_array_multitaper` applied to short windows). All tapered
+    windows of a signal are transformed in a single FFT, which is much
+    faster for fixed-resolution spectrograms.
+
+    Parameters
+    ----------
+    epoch_data : array, shape (..., n_times)
+        The data, for example of shape (n_epochs, n_channels, n_times).
+    sfreq : float
+        The sampling frequency.
+    n_per_seg : int
+        The length of each window in samples.
+    step : int | None
+        The number of samples between the starts of consecutive windows.
+        If None (default), windows overlap by half.
+    fmin : float
+        The lower frequency of interest.
+    fmax : float
+        The upper frequency of interest.
+    bandwidth : float | None
+        The bandwidth of the multitaper windowing function in Hz. If None,
+        a half-bandwidth of 4 frequency bins of the window is used.
+    low_bias : bool
+        Only use tapers with more than 90%% spectral concentration within
+        bandwidth.
+    n_fft : int | None
+        The length of the FFT, must be ``>= n_per_seg``. Windows are
+        zero-padded if ``n_fft > n_per_seg``. If None (default),
+        ``n_per_seg`` is used.
+    output : str
+        Can be ``'power'`` (default) for the single-trial power,
+        ``'avg_power'`` to average the power over the first dimension (e.g.,
+        epochs), or ``'complex'`` for the tapered spectra.
+    %(n_jobs)s
+        The parallelization is implemented across signals.
+    %(dtype-spectral)s
+    %(verbose)s
+
+    Returns
+    -------
+    out : array
+        The spectrogram. With ``output='power'`` its shape is
+        ``(..., n_freqs, n_segments)``, with ``output='avg_power'`` the first
+        dimension is averaged over, and with ``output='complex'`` its shape
+        is ``(..., n_tapers, n_freqs, n_segments)``. The power is scaled as
+        in :func:`psd_array_multitaper` with ``normalization='length'``.
+    freqs : array, shape (n_freqs,)
+        The frequency points in Hz.
+    times : array, shape (n_segments,)
+        The times of the centers of the windows, in seconds relative to the
+        first sample.
+
+    See Also
+    --------
+    psd_array_multitaper
+    tfr_array_multitaper
+
+    Notes
+    -----
+    .. versionadded:: 0.23
+    """
+    _check_option('output', output, ('power', 'avg_power', 'complex'))
+    dtype = _check_compute_dtype(dtype)
+    epoch_data = np.asarray(epoch_data)
+    dshape, n_times = epoch_data.shape[:-1], epoch_data.shape[-1]
+    n_per_seg = operator.index(n_per_seg)
+    if not 0 < n_per_seg <= n_times:
+        raise ValueError('n_per_seg must be positive and at most the number '
+                         'of time points (%s), got %s' % (n_times, n_per_seg))
+    step = max(n_per_seg // 2, 1) if step is None else operator.index(step)
+    if step < 1:
+        raise ValueError('step must be a positive integer, got %s' % (step,))
+    n_fft = n_per_seg if n_fft is None else operator.index(n_fft)
+    if n_fft < n_per_seg:
+        raise ValueError('n_fft (%s) must be at least n_per_seg (%s)'
+                         % (n_fft, n_per_seg))
+
+    # Taper parameters, shared across calls with the same window
+    if bandwidth is not None:
+        half_nbw = float(bandwidth) * n_per_seg / (2. * sfreq)
+    else:
+        half_nbw = 4.
+    if half_nbw < 0.5:
+        raise ValueError(
+            'bandwidth value %s yields a normalized bandwidth of %s < 0.5, '
+            'use a value of at least %s'
+            % (bandwidth, half_nbw, sfreq / n_per_seg))
+    dpss, eigvals = _dpss_windows_cached(n_per_seg, half_nbw,
+                                         int(2 * half_nbw), bool(low_bias))
+    logger.info('    Using multitaper spectrogram with %d DPSS windows of '
+                '%d samples' % (len(eigvals), n_per_seg))
+    weights = np.sqrt(eigvals).astype(dtype)[:, np.newaxis]
+
+    freqs = rfftfreq(n_fft, 1. / sfreq)
+    freq_mask = (freqs >= fmin) & (freqs <= fmax)
+    if not freq_mask.any():
+        raise ValueError(
+            f'No frequencies found between fmin={fmin} and fmax={fmax}')
+    freqs = freqs[freq_mask]
+    n_segments = (n_times - n_per_seg) // step + 1
+    times = (np.arange(n_segments) * step + (n_per_seg - 1) / 2.) / sfreq
+
+    x = epoch_data.reshape(-1, n_times)
+    parallel, my_stft_mt, n_jobs = parallel_func(_stft_mt_power, n_jobs)
+    # Go in chunks of about 50 MB of tapered spectra
+    n_chunk = max(50000000 // (n_segments * len(eigvals) * n_fft *
+                               dtype.itemsize), 1)
+    n_splits = max(int(np.ceil(len(x) / n_chunk)), min(n_jobs, len(x)))
+    out = parallel(my_stft_mt(x_split, dpss, weights, sfreq, n_per_seg, step,
+                              n_fft, freq_mask, output, dtype)
+                   for x_split in np.array_split(x, n_splits))
+    out = np.concatenate(out)
+    out.shape = dshape + out.shape[1:]
+    if output == 'avg_power':
+        out = out.mean(axis=0)
+    return out, freqs, times
@@ -2,40 +2,213 @@
 #           Denis A. Engemann <denis.engemann@gmail.com>
 # License : BSD 3-clause
 
-from functools import partial
 import numpy as np
 
-from ..parallel import parallel_func
+from ..fixes import rfft
+from ..parallel import parallel_func, check_n_jobs
 from ..io.pick import _picks_to_idx
-from ..utils import logger, verbose, _time_mask, _check_option
+from ..utils import (logger, verbose, _time_mask, _check_option,
+                     _check_compute_dtype)
 from .multitaper import psd_array_multitaper
 
+# bytes of tapered segments transformed at once by psd_array_welch
+_WELCH_BLOCK_SIZE = 10e6
+# bins of the histograms approximating streamed median PSDs, spanning
+# +/- _WELCH_MEDIAN_DECADES of log10 power around a first estimate
+_WELCH_MEDIAN_BINS = 200
+_WELCH_MEDIAN_DECADES = 2.
 
-def _decomp_aggregate_mask(epoch, func, average, freq_sl):
-    _, _, spect = func(epoch)
-    spect = spect[..., freq_sl, :]
-    # Do the averaging here (per epoch) to save memory
+
+def _welch_window(window, n_per_seg, dtype):
+    """Get the Welch segment window."""
+    from scipy.signal import get_window
+    if isinstance(window, (str, tuple)):
+        win = get_window(window, n_per_seg)
+    else:
+        win = np.asarray(window)
+        if win.ndim != 1 or len(win) != n_per_seg:
+            raise ValueError('window must be 1D with length n_per_seg (%d), '
+                             'got shape %s' % (n_per_seg, win.shape))
+    return win.astype(dtype, copy=False)
+
+
+def _welch_segments_ok(x, n_per_seg, step, n_segments):
+    """Find the segments that only contain finite values.
+
+    Returns None if all values are finite, otherwise a boolean array of shape
+    (n_signals, n_segments). Non-finite values arise e.g. from Raw segments
+    annotated as bad, which are then skipped.
+    """
+    bad = ~np.isfinite(x)
+    if not bad.any():
+        return None
+    n_bad = np.zeros((len(x), x.shape[-1] + 1), int)
+    np.cumsum(bad, axis=-1, out=n_bad[:, 1:])
+    starts = np.arange(n_segments) * step
+    return n_bad[:, starts + n_per_seg] == n_bad[:, starts]
+
+
+def _welch_segments_psd(x, seg_ok, win, n_fft, step, freq_sl, scale):
+    """Compute the PSDs of the Welch segments of signals with a single FFT.
+
+    Segments that are bad in all signals (according to ``seg_ok``) are
+    skipped, and returned PSDs have shape (n_signals, n_segments, n_freqs).
+    """
+    from numpy.lib.stride_tricks import as_strided
+    n_per_seg = len(win)
+    n_segments = (x.shape[-1] - n_per_seg) // step + 1
+    segs = as_strided(x, (len(x), n_segments, n_per_seg),
+                      x.strides[:1] + (x.strides[1] * step, x.strides[1]),
+                      writeable=False)
+    if seg_ok is not None:
+        # only transform segments that are good in at least one signal
+        use = seg_ok.any(axis=0)
+        segs, seg_ok = segs[:, use], seg_ok[:, use]
+        if seg_ok.all():
+            seg_ok = None
+    # detrend (constant) and taper
+    segs = segs - segs.mean(axis=-1, keepdims=True)
+    segs *= win
+    spect = rfft(segs, n_fft)[..., freq_sl]
+    del segs
+    psds = spect.real ** 2
+    psds += spect.imag ** 2
+    del spect
+    psds *= scale
+    return psds, seg_ok
+
+
+def _welch_block(x, seg_ok, win, n_fft, step, freq_sl, scale, average):
+    """Compute Welch PSDs for a block of signals with a single FFT."""
+    if average is None:
+        psds, _ = _welch_segments_psd(
+            x, None, win, n_fft, step, freq_sl, scale)
+        return psds.transpose(0, 2, 1)
+    psds, seg_ok = _welch_segments_psd(
+        x, seg_ok, win, n_fft, step, freq_sl, scale)
+    use_nan = seg_ok is not None
+    if use_nan:
+        psds[~seg_ok] = np.nan
     if average == 'mean':
-        spect = np.nanmean(spect, axis=-1)
-    elif average == 'median':
-        spect = np.nanmedian(spect, axis=-1)
-    return spect
-
-
-def _spect_func(epoch, func, freq_sl, average):
-    """Aux function."""
-    # Decide if we should split this to save memory or not, since doing
-    # multiple calls will incur some performance overhead. Eventually we might
-    # want to write (really, go back to) our own spectrogram implementation
-    # that, if possible, averages after each transform, but this will incur
-    # a lot of overhead because of the many Python calls required.
-    kwargs = dict(func=func, average=average, freq_sl=freq_sl)
-    if epoch.nbytes > 10e6:
-        spect = np.apply_along_axis(
-            _decomp_aggregate_mask, -1, epoch, **kwargs)
+        psds = np.nanmean(psds, axis=1) if use_nan else psds.mean(axis=1)
+    else:  # median
+        median = np.nanmedian if use_nan else np.median
+        psds = median(psds, axis=1, overwrite_input=True)
+    return psds
+
+
+def _welch_params(n_times, sfreq, fmin, fmax, n_fft, n_per_seg, n_overlap,
+                  window, dtype):
+    """Get the frequencies, window and scaling of Welch's method."""
+    n_fft, n_per_seg, n_overlap = _check_nfft(n_times, n_fft, n_per_seg,
+                                              n_overlap)
+    win_size = n_fft / float(sfreq)
+    logger.info("Effective window size : %0.3f (s)" % win_size)
+    freqs = np.arange(n_fft // 2 + 1, dtype=float) * (sfreq / n_fft)
+    freq_mask = (freqs >= fmin) & (freqs <= fmax)
+    if not freq_mask.any():
+        raise ValueError(
+            f'No frequencies found between fmin={fmin} and fmax={fmax}')
+    freq_sl = slice(*(np.where(freq_mask)[0][[0, -1]] + [0, 1]))
+    del freq_mask
+    freqs = freqs[freq_sl]
+
+    logger.debug(
+        f'Spectogram using {n_fft}-point FFT on {n_per_seg} samples with '
+        f'{n_overlap} overlap and {window} window')
+    win = _welch_window(window, n_per_seg, dtype)
+    # density scaling, doubling all but DC and Nyquist for the one-sided PSD
+    scale = np.full(n_fft // 2 + 1, 2. / (sfreq * (win * win).sum()))
+    scale[0] /= 2.
+    if n_fft % 2 == 0:
+        scale[-1] /= 2.
+    scale = scale[freq_sl].astype(dtype)
+    return n_fft, n_per_seg - n_overlap, freqs, freq_sl, win, scale
+
+
+def _hist_median(hist, lo, width):
+    """Approximate medians from histograms along the last axis.
+
+    The first and last bins count values below and above the binned range.
+    """
+    cum = np.cumsum(hist, axis=-1)
+    half = cum[..., -1:] / 2.
+    idx = np.minimum((cum < half).sum(axis=-1, keepdims=True),
+                     hist.shape[-1] - 1)
+    below = np.take_along_axis(cum, idx, -1) - np.take_along_axis(
+        hist, idx, -1)
+    count = np.take_along_axis(hist, idx, -1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.clip((half - below) / count, 0, 1)
+    # interpolate linearly within the bin (bin 1 starts at lo)
+    med = lo + ((idx - 1 + frac) * width)[..., 0]
+    med[cum[..., -1] == 0] = np.nan
+    return med
+
+
+def _psd_welch_stream(raw, picks, start, stop, reject_by_annotation, average,
+                      n_fft, step, freq_sl, win, scale):
+    """Compute Welch PSDs of Raw data read in chunks of segments."""
+    n_per_seg = len(win)
+    n_segments = (stop - start - n_per_seg) // step + 1
+    n_chunk = max(int(_WELCH_BLOCK_SIZE // (len(picks) * n_fft * 8)), 1)
+    rba = 'NaN' if reject_by_annotation else None
+    n_freqs = len(scale)
+    n_used = np.zeros((len(picks), 1), int)
+    if average == 'mean':
+        psd_sum = np.zeros((len(picks), n_freqs))
     else:
-        spect = _decomp_aggregate_mask(epoch, **kwargs)
-    return spect
+        # histograms of log10 power (centered on a first estimate of the
+        # median), with under- and overflow bins on each side
+        hist = lo = None
+        width = 2. * _WELCH_MEDIAN_DECADES / _WELCH_MEDIAN_BINS
+        n_bins = _WELCH_MEDIAN_BINS + 2
+        offsets = np.arange(len(picks) * n_freqs)[:, np.newaxis] * n_bins
+    logger.info(f'Streaming {n_segments} segments in chunks of {n_chunk}')
+    for seg_start in range(0, n_segments, n_chunk):
+        n_seg = min(n_chunk, n_segments - seg_start)
+        chunk_start = start + seg_start * step
+        data = raw.get_data(picks, chunk_start,
+                            chunk_start + (n_seg - 1) * step + n_per_seg,
+                            reject_by_annotation=rba)
+        seg_ok = _welch_segments_ok(data, n_per_seg, step, n_seg)
+        if seg_ok is not None and not seg_ok.any():
+            continue
+        psds, seg_ok = _welch_segments_psd(data, seg_ok, win, n_fft, step,
+                                           freq_sl, scale)
+        del data
+        if seg_ok is None:
+            n_used += psds.shape[1]
+        else:
+            n_used += seg_ok.sum(axis=1, keepdims=True)
+            psds[~seg_ok] = np.nan
+        if average == 'mean':
+            if seg_ok is None:
+                psd_sum += psds.sum(axis=1)
+            else:
+                psd_sum += np.nansum(psds, axis=1)
+            continue
+        with np.errstate(divide='ignore', invalid='ignore'):
+            psds = np.log10(psds).transpose(0, 2, 1).reshape(
+                len(picks) * n_freqs, -1)
+        if lo is None:
+            center = np.nanmedian(psds, axis=-1)
+            center[np.isnan(center)] = np.nanmedian(center)
+            lo = (center - _WELCH_MEDIAN_DECADES)[:, np.newaxis]
+            hist = np.zeros(len(psds) * n_bins, np.uint32)
+        idx = np.floor((psds - lo) / width)
+        good = ~np.isnan(idx)
+        idx = np.clip(idx[good], -1, _WELCH_MEDIAN_BINS).astype(int) + 1
+        idx += np.broadcast_to(offsets, good.shape)[good]
+        hist += np.bincount(idx, minlength=hist.size).astype(hist.dtype)
+    if average == 'mean':
+        with np.errstate(invalid='ignore'):
+            return psd_sum / n_used
+    if hist is None:
+        return np.full((len(picks), n_freqs), np.nan)
+    hist.shape = (len(picks) * n_freqs, n_bins)
+    return 10 ** _hist_median(hist, lo[:, 0], width).reshape(
+        len(picks), n_freqs)
 
 
 def _check_nfft(n, n_fft, n_per_seg, n_overlap):
@@ -85,7 +258,7 @@ def _check_psd_data(inst, tmin, tmax, picks, proj, reject_by_annotation=False):
 @verbose
 def psd_array_welch(x, sfreq, fmin=0, fmax=np.inf, n_fft=256, n_overlap=0,
                     n_per_seg=None, n_jobs=1, average='mean', window='hamming',
-                    verbose=None):
+                    dtype='float64', verbose=None):
     """Compute power spectral density (PSD) using Welch's method.
 
     Parameters
@@ -114,6 +287,9 @@ def psd_array_welch(x, sfreq, fmin=0, fmax=np.inf, n_fft=256, n_overlap=0,
     %(window-psd)s
 
         .. versionadded:: 0.22.0
+    %(dtype-spectral)s
+
+        .. versionadded:: 0.23
     %(verbose)s
 
     Returns
@@ -130,45 +306,46 @@ def psd_array_welch(x, sfreq, fmin=0, fmax=np.inf, n_fft=256, n_overlap=0,
 
     Notes
     -----
+    The segments of all signals are detrended, tapered and transformed in
+    blocks with a single FFT each; with ``n_jobs > 1`` the blocks are
+    processed by a pool of threads. Segments containing non-finite values
+    (e.g., from spans of :class:`~mne.io.Raw` annotated as bad) are skipped
+    when averaging.
+
     .. versionadded:: 0.14.0
     """
     _check_option('average', average, (None, 'mean', 'median'))
+    dtype = _check_compute_dtype(dtype)
 
     dshape = x.shape[:-1]
     n_times = x.shape[-1]
-    x = x.reshape(-1, n_times)
+    x = x.reshape(-1, n_times).astype(dtype, copy=False)
 
     # Prep the PSD
-    n_fft, n_per_seg, n_overlap = _check_nfft(n_times, n_fft, n_per_seg,
-                                              n_overlap)
-    win_size = n_fft / float(sfreq)
-    logger.info("Effective window size : %0.3f (s)" % win_size)
-    freqs = np.arange(n_fft // 2 + 1, dtype=float) * (sfreq / n_fft)
-    freq_mask = (freqs >= fmin) & (freqs <= fmax)
-    if not freq_mask.any():
-        raise ValueError(
-            f'No frequencies found between fmin={fmin} and fmax={fmax}')
-    freq_sl = slice(*(np.where(freq_mask)[0][[0, -1]] + [0, 1]))
-    del freq_mask
-    freqs = freqs[freq_sl]
-
-    # Parallelize across first N-1 dimensions
-    x_splits = np.array_split(x, n_jobs)
-    logger.debug(
-        f'Spectogram using {n_fft}-point FFT on {n_per_seg} samples with '
-        f'{n_overlap} overlap and {window} window')
-
-    from scipy.signal import spectrogram
-    parallel, my_spect_func, n_jobs = parallel_func(_spect_func, n_jobs=n_jobs)
-    func = partial(spectrogram, noverlap=n_overlap, nperseg=n_per_seg,
-                   nfft=n_fft, fs=sfreq, window=window)
-    f_spect = parallel(my_spect_func(d, func=func, freq_sl=freq_sl,
-                                     average=average)
-                       for d in x_splits)
-    psds = np.concatenate(f_spect, axis=0)
+    n_fft, step, freqs, freq_sl, win, scale = _welch_params(
+        n_times, sfreq, fmin, fmax, n_fft, n_per_seg, n_overlap, window,
+        dtype)
+    n_per_seg = len(win)
+    n_segments = (n_times - n_per_seg) // step + 1
+    seg_ok = _welch_segments_ok(x, n_per_seg, step, n_segments)
+
+    # Process blocks of signals (bounding the memory used by the tapered
+    # segments) with a single FFT each, using threads across blocks
+    n_jobs = check_n_jobs(n_jobs)
+    n_block = max(int(_WELCH_BLOCK_SIZE // (n_segments * n_fft *
+                                            x.itemsize)), 1)
+    n_block = max(min(n_block, -(-len(x) // n_jobs)), 1)
+    blocks = [slice(start, start + n_block)
+              for start in range(0, max(len(x), 1), n_block)]
+    parallel, my_welch_block, _ = parallel_func(
+        _welch_block, n_jobs, prefer='threads', verbose=False)
+    psds = parallel(my_welch_block(
+        x[sl], None if seg_ok is None else seg_ok[sl], win, n_fft, step,
+        freq_sl, scale, average) for sl in blocks)
+    psds = np.concatenate(psds, axis=0)
     shape = dshape + (len(freqs),)
     if average is None:
-        shape = shape + (-1,)
+        shape = shape + (psds.shape[-1],)
     psds.shape = shape
     return psds, freqs
 
@@ -177,7 +354,7 @@ def psd_array_welch(x, sfreq, fmin=0, fmax=np.inf, n_fft=256, n_overlap=0,
 def psd_welch(inst, fmin=0, fmax=np.inf, tmin=None, tmax=None, n_fft=256,
               n_overlap=0, n_per_seg=None, picks=None, proj=False, n_jobs=1,
               reject_by_annotation=True, average='mean', window='hamming',
-              verbose=None):
+              stream=None, verbose=None):
     """Compute the power spectral density (PSD) using Welch's method.
 
     Calculates periodograms for a sliding window over the time dimension, then
@@ -219,6 +396,16 @@ def psd_welch(inst, fmin=0, fmax=np.inf, tmin=None, tmax=None, n_fft=256,
     %(window-psd)s
 
         .. versionadded:: 0.22.0
+    stream : bool | None
+        Whether to read a Raw instance in chunks of segments, accumulating
+        the PSD as it goes, so that only a few MB of data are held in memory
+        at a time. If None (default), streaming is used when ``inst`` is a
+        Raw instance that is not preloaded and ``average='mean'`` (in which
+        case the result is identical). With ``average='median'``, the
+        streamed median is approximated from histograms of the log-power of
+        each channel and frequency. Cannot be used with ``average=None``.
+
+        .. versionadded:: 0.23
     %(verbose)s
 
     Returns
@@ -244,6 +431,32 @@ def psd_welch(inst, fmin=0, fmax=np.inf, tmin=None, tmax=None, n_fft=256,
     -----
     .. versionadded:: 0.12.0
     """
+    from ..io.base import BaseRaw
+    _check_option('average', average, (None, 'mean', 'median'))
+    if stream is None:
+        stream = (isinstance(inst, BaseRaw) and not inst.preload and
+                  average == 'mean')
+    if stream:
+        if not isinstance(inst, BaseRaw):
+            raise ValueError('stream=True requires an instance of Raw, got '
+                             f'{type(inst)}')
+        if average is None:
+            raise ValueError('stream=True cannot be used with average=None')
+        time_mask = _time_mask(inst.times, tmin, tmax,
+                               sfreq=inst.info['sfreq'])
+        picks = _picks_to_idx(inst.info, picks, 'data', with_ref_meg=False)
+        if proj:
+            # Copy first so it's not modified (cheap if not preloaded)
+            inst = inst.copy().apply_proj()
+        start, stop = np.where(time_mask)[0][[0, -1]] + [0, 1]
+        n_fft, step, freqs, freq_sl, win, scale = _welch_params(
+            stop - start, inst.info['sfreq'], fmin, fmax, n_fft, n_per_seg,
+            n_overlap, window, np.float64)
+        psds = _psd_welch_stream(inst, picks, start, stop,
+                                 reject_by_annotation, average, n_fft, step,
+                                 freq_sl, win, scale)
+        return psds, freqs
+
     # Prep data
     data, sfreq = _check_psd_data(inst, tmin, tmax, picks, proj,
                                   reject_by_annotation=reject_by_annotation)
@@ -12,7 +12,7 @@ from mne.utils import sum_squared, run_tests_if_main, _TempDir, requires_h5py
 from mne.time_frequency import (csd_fourier, csd_multitaper,
                                 csd_morlet, csd_array_fourier,
                                 csd_array_multitaper, csd_array_morlet,
-                                tfr_morlet,
+                                csd_tfr, tfr_morlet,
                                 CrossSpectralDensity, read_csd,
                                 pick_channels_csd, psd_multitaper)
 from mne.time_frequency.csd import _sym_mat_to_vector, _vector_to_sym_mat
@@ -291,6 +291,15 @@ def test_sym_mat_to_vector():
     assert _sym_mat_to_vector(mat.astype(np.float16)).dtype == np.float16
     assert _vector_to_sym_mat(vec.astype(np.float16)).dtype == np.float16
 
+    # Test extra dimensions
+    vecs = np.random.RandomState(0).randn(10, 3) + 1j
+    mats = _vector_to_sym_mat(vecs)
+    assert mats.shape == (4, 4, 3)
+    for ii in range(3):
+        assert_array_equal(mats[:, :, ii], _vector_to_sym_mat(vecs[:, ii]))
+    assert_array_equal(_sym_mat_to_vector(mats), vecs.real + 1j * np.triu(
+        np.ones((4, 4)), 1)[np.triu_indices(4)][:, np.newaxis])
+
 
 def _generate_coherence_data():
     """Create an epochs object with coherence at 22Hz between channels 1 and 3.
@@ -541,6 +550,71 @@ def test_csd_morlet():
         csd = csd_morlet(epochs_nobase, frequencies=[10], decim=20)
 
 
+def test_csd_tfr(tmpdir):
+    """Test computing cross-spectral density from an EpochsTFR."""
+    epochs = _generate_coherence_data()
+    freqs = [10, 15, 22]
+    n_cycles = [20, 30, 44]
+    epochs_tfr = tfr_morlet(epochs, freqs, n_cycles, use_fft=True,
+                            return_itc=False, zero_mean=False,
+                            output='complex', average=False)
+    # all time windows of a sweep come from the same decomposition
+    for tmin, tmax in ((None, None), (1, 5), (4, 9)):
+        csd = csd_morlet(epochs, frequencies=freqs, n_cycles=n_cycles,
+                         tmin=tmin, tmax=tmax)
+        csd_2 = csd_tfr(epochs_tfr, tmin=tmin, tmax=tmax)
+        assert csd_2.ch_names == csd.ch_names
+        assert csd_2.tmin == csd.tmin and csd_2.tmax == csd.tmax
+        assert_allclose(csd_2.frequencies, freqs)
+        # csd_morlet only pads the window by half the longest wavelet
+        assert_allclose(csd_2._data, csd._data, rtol=1e-6,
+                        atol=1e-7 * np.abs(csd._data).max())
+    _test_csd_matrix(csd_2)
+
+    # the scaling does not depend on the decimation
+    epochs_tfr_decim = tfr_morlet(epochs, freqs, n_cycles, use_fft=True,
+                                  return_itc=False, zero_mean=False,
+                                  output='complex', average=False, decim=4)
+    csd = csd_morlet(epochs, frequencies=freqs, n_cycles=n_cycles, decim=4)
+    csd_decim = csd_tfr(epochs_tfr_decim, decim=4)
+    assert_allclose(csd_decim._data, csd._data, rtol=1e-6,
+                    atol=1e-7 * np.abs(csd._data).max())
+    with pytest.raises(ValueError, match='positive integer'):
+        csd_tfr(epochs_tfr_decim, decim=0)
+
+    # channel subsets, and memory-mapped data
+    fname = str(tmpdir.join('tfr.dat'))
+    data = np.memmap(fname, dtype=epochs_tfr.data.dtype, mode='w+',
+                     shape=epochs_tfr.data.shape)
+    data[:] = epochs_tfr.data
+    epochs_tfr.data = data
+    csd_3 = csd_tfr(epochs_tfr, tmin=4, tmax=9, picks=['CH1', 'CH3'])
+    assert_allclose(csd_3._data,
+                    pick_channels_csd(csd_2, ['CH1', 'CH3'])._data)
+
+    with pytest.raises(TypeError, match='must be an instance of EpochsTFR'):
+        csd_tfr(epochs)
+    epochs_tfr.data = np.abs(data)
+    with pytest.raises(ValueError, match='complex data'):
+        csd_tfr(epochs_tfr)
+
+
+@pytest.mark.parametrize('func, kwargs', [
+    (csd_array_fourier, dict()),
+    (csd_array_multitaper, dict(adaptive=True)),
+    (csd_array_morlet, dict(frequencies=[10., 20.])),
+])
+def test_csd_array_dtype(func, kwargs):
+    """Test single precision CSD computation."""
+    X = np.random.RandomState(0).randn(3, 4, 500)
+    csd = func(X, 250., **kwargs)
+    csd_32 = func(X, 250., dtype='float32', **kwargs)
+    assert csd._data.dtype == np.complex128
+    assert csd_32._data.dtype == np.complex64
+    assert_allclose(csd_32._data, csd._data,
+                    atol=1e-5 * np.abs(csd._data).max())
+
+
 def test_equalize_channels():
     """Test equalization of channels for instances of CrossSpectralDensity."""
     csd1 = _make_csd()
@@ -2,10 +2,12 @@ from distutils.version import LooseVersion
 
 import numpy as np
 import pytest
-from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_almost_equal, assert_allclose
 
-from mne.time_frequency import psd_multitaper
-from mne.time_frequency.multitaper import dpss_windows
+from mne.time_frequency import (psd_multitaper, psd_array_multitaper,
+                                tfr_array_stft_multitaper)
+from mne.time_frequency.multitaper import (dpss_windows, _mt_spectra,
+                                           _psd_from_mt_adaptive)
 from mne.utils import requires_nitime
 from mne.io import RawArray
 from mne import create_info
@@ -64,3 +66,90 @@ def test_multitaper_psd():
                 assert_array_almost_equal(freqs, freqs_ni)
         with pytest.raises(ValueError, match='use a value of at least'):
             psd_multitaper(raw, bandwidth=4.9)
+
+
+def test_psd_from_mt_adaptive():
+    """Test vectorized adaptive weights against a per-frequency loop."""
+    rng = np.random.RandomState(0)
+    n_times, sfreq = 500, 100.
+    x = rng.randn(3, n_times)
+    x[0] += 5 * np.sin(2 * np.pi * 10. * np.arange(n_times) / sfreq)
+    dpss, eigvals = dpss_windows(n_times, 4, 7)
+    x_mt, freqs = _mt_spectra(x, dpss, sfreq)
+    freq_mask = freqs > 1.
+    psd, weights = _psd_from_mt_adaptive(x_mt, eigvals, freq_mask,
+                                         return_weights=True)
+    assert psd.shape == (3, freq_mask.sum())
+    assert weights.shape == (3, len(eigvals), freq_mask.sum())
+
+    # straightforward reference: iterate each (signal, freq) on its own
+    x_pow = np.abs(x_mt[:, :, freq_mask]) ** 2
+    psd_est = 2 * np.einsum('k,skf->sf', eigvals,
+                            np.abs(x_mt) ** 2) / eigvals.sum()
+    x_var = np.trapz(psd_est, dx=np.pi / x_mt.shape[2]) / (2 * np.pi)
+    rt_eig = np.sqrt(eigvals)
+    for si in range(len(x)):
+        for fi in range(x_pow.shape[2]):
+            s_k = x_pow[si, :, fi]
+            psd_ref = 2 * np.dot(s_k[:2], eigvals[:2]) / eigvals[:2].sum()
+            d_prev = 0.
+            for _ in range(150):
+                d_k = rt_eig * psd_ref / (eigvals * psd_ref +
+                                          (1 - eigvals) * x_var[si])
+                if np.mean((d_prev - d_k) ** 2) < 1e-10:
+                    break
+                psd_ref = 2 * np.dot(d_k ** 2, s_k) / np.sum(d_k ** 2)
+                d_prev = d_k
+            assert_allclose(psd[si, fi], psd_ref, rtol=1e-10)
+            assert_allclose(weights[si, :, fi], d_k, rtol=1e-10)
+
+
+def test_stft_multitaper():
+    """Test sliding-window multitaper spectrogram."""
+    sfreq, n_per_seg, step = 250., 500, 125
+    x = np.random.RandomState(0).randn(2, 3, 2000)
+    power, freqs, times = tfr_array_stft_multitaper(
+        x, sfreq, n_per_seg, step=step, fmin=5, fmax=40, bandwidth=2.)
+    n_segments = (2000 - n_per_seg) // step + 1
+    assert power.shape == (2, 3, len(freqs), n_segments)
+    assert_allclose(times, (np.arange(n_segments) * step + 249.5) / sfreq)
+    # each window matches the multitaper PSD of that window
+    for ii in (0, n_segments - 1):
+        psd, freqs_psd = psd_array_multitaper(
+            x[..., ii * step:ii * step + n_per_seg], sfreq, fmin=5, fmax=40,
+            bandwidth=2.)
+        assert_allclose(freqs, freqs_psd)
+        assert_allclose(power[..., ii], psd, rtol=1e-10)
+    x_mt, _, _ = tfr_array_stft_multitaper(
+        x, sfreq, n_per_seg, step=step, fmin=5, fmax=40, bandwidth=2.,
+        output='complex')
+    assert x_mt.shape[:2] == (2, 3) and x_mt.shape[3:] == power.shape[2:]
+    avg, _, _ = tfr_array_stft_multitaper(
+        x, sfreq, n_per_seg, step=step, fmin=5, fmax=40, bandwidth=2.,
+        output='avg_power', n_jobs=2, dtype='float32')
+    assert avg.dtype == np.float32
+    assert_allclose(avg, power.mean(0), rtol=1e-4)
+    with pytest.raises(ValueError, match='n_per_seg must be'):
+        tfr_array_stft_multitaper(x, sfreq, 3000)
+    with pytest.raises(ValueError, match='n_fft'):
+        tfr_array_stft_multitaper(x, sfreq, n_per_seg, n_fft=100)
+
+
+def test_dpss_windows_cache(tmpdir, monkeypatch):
+    """Test the memory and disk caches of DPSS windows."""
+    from mne.time_frequency.multitaper import _dpss_windows_cached
+    monkeypatch.setenv('MNE_DPSS_CACHE_DIR', str(tmpdir))
+    _dpss_windows_cached.cache_clear()
+    dpss, eigvals = dpss_windows(1000, 4, 7)
+    assert len(tmpdir.listdir()) == 1
+    dpss_2, eigvals_2 = dpss_windows(1000, 4., 7)  # same key
+    assert _dpss_windows_cached.cache_info().hits == 1
+    assert_allclose(dpss_2, dpss)
+    dpss_2[:] = 0  # copies are returned
+    _dpss_windows_cached.cache_clear()
+    dpss_3, eigvals_3 = dpss_windows(1000, 4, 7)  # from disk
+    assert_allclose(dpss_3, dpss)
+    assert_allclose(eigvals_3, eigvals)
+    dpss_4, _ = dpss_windows(1000, 4, 7, low_bias=False)
+    assert len(dpss_4) == 7 and len(tmpdir.listdir()) == 2
+    _dpss_windows_cached.cache_clear()
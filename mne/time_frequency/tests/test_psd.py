@@ -1,13 +1,15 @@
 import numpy as np
 import os.path as op
 from numpy.testing import assert_array_almost_equal, assert_allclose
-from scipy.signal import welch
+from scipy.signal import welch, spectrogram
 import pytest
 
-from mne import pick_types, Epochs, read_events
+from mne import (pick_types, Epochs, read_events, create_info, Annotations,
+                 EpochsArray)
 from mne.io import RawArray, read_raw_fif
 from mne.utils import catch_logging
-from mne.time_frequency import psd_welch, psd_multitaper, psd_array_welch
+from mne.time_frequency import (psd_welch, psd_multitaper, psd_array_welch,
+                                psd_array_multitaper)
 
 base_dir = op.join(op.dirname(__file__), '..', '..', 'io', 'tests', 'data')
 raw_fname = op.join(base_dir, 'test_raw.fif')
@@ -38,6 +40,99 @@ def test_psd_nan():
     assert 'hamming window' in log
 
 
+@pytest.mark.parametrize('n_fft, n_per_seg, n_overlap, window', [
+    (256, None, 0, 'hamming'),
+    (255, 200, 100, 'hann'),
+    (128, 128, 64, np.ones(128)),
+])
+@pytest.mark.parametrize('average', ('mean', 'median', None))
+def test_psd_welch_batched(n_fft, n_per_seg, n_overlap, window, average):
+    """Test the batched Welch engine against scipy.signal.spectrogram."""
+    rng = np.random.RandomState(0)
+    sfreq = 250.
+    x = rng.randn(2, 3, 2000)
+    x[1, :, 500:900] = np.nan  # annotated as bad in all channels
+    x[0, 2, 1500:] = np.nan  # and in a single channel
+    n_per_seg_ = n_fft if n_per_seg is None else n_per_seg
+    _, _, want = spectrogram(x, sfreq, window=window, nperseg=n_per_seg_,
+                             noverlap=n_overlap, nfft=n_fft)
+    want = want[..., 5:41, :]
+    if average == 'mean':
+        want = np.nanmean(want, axis=-1)
+    elif average == 'median':
+        want = np.nanmedian(want, axis=-1)
+    for n_jobs in (1, 2):
+        psds, freqs = psd_array_welch(
+            x, sfreq, fmin=4.5 * sfreq / n_fft, fmax=40.5 * sfreq / n_fft,
+            n_fft=n_fft,
+            n_per_seg=n_per_seg, n_overlap=n_overlap, window=window,
+            average=average, n_jobs=n_jobs)
+        assert_allclose(freqs, np.arange(5, 41) * sfreq / n_fft)
+        assert_allclose(psds, want, rtol=1e-10)
+        # no signals
+        psds, _ = psd_array_welch(
+            x[:, :0], sfreq, fmin=4.5 * sfreq / n_fft,
+            fmax=40.5 * sfreq / n_fft, n_fft=n_fft, n_per_seg=n_per_seg,
+            n_overlap=n_overlap, window=window, average=average,
+            n_jobs=n_jobs)
+        assert psds.shape == want[:, :0].shape
+    with pytest.raises(ValueError, match='window must be 1D'):
+        psd_array_welch(x, sfreq, n_fft=n_fft, n_per_seg=n_per_seg,
+                        window=np.ones(n_per_seg_ + 1))
+
+
+def test_psd_welch_stream(tmpdir):
+    """Test streaming Welch PSD of non-preloaded Raw."""
+    rng = np.random.RandomState(0)
+    sfreq = 256.
+    data = 1e-5 * rng.randn(4, int(200 * sfreq))
+    raw = RawArray(data, create_info(4, sfreq, 'eeg'))
+    raw.set_annotations(Annotations([10, 100.3], [5, 20.7], 'BAD_x'))
+    fname = op.join(str(tmpdir), 'test_raw.fif')
+    raw.save(fname)
+    raw = read_raw_fif(fname)
+    raw_loaded = raw.copy().load_data()
+    kwargs = dict(tmin=3, tmax=180, fmin=2, fmax=60, n_fft=512,
+                  n_per_seg=300, n_overlap=100)
+    psds, freqs = psd_welch(raw_loaded, **kwargs)
+    with catch_logging() as log:
+        psds_2, freqs_2 = psd_welch(raw, verbose=True, **kwargs)
+    assert 'Streaming' in log.getvalue()
+    assert_allclose(freqs, freqs_2)
+    assert_allclose(psds, psds_2, rtol=1e-10)
+    psds_2, _ = psd_welch(raw, stream=False, **kwargs)
+    assert_allclose(psds, psds_2, rtol=1e-10)
+    # approximate median
+    psds, _ = psd_welch(raw_loaded, average='median', **kwargs)
+    psds_2, _ = psd_welch(raw, average='median', **kwargs)
+    assert_allclose(psds, psds_2, rtol=1e-10)  # not streamed by default
+    psds_2, _ = psd_welch(raw, average='median', stream=True, **kwargs)
+    assert_allclose(psds, psds_2, rtol=0.05)
+    assert np.median(np.abs(psds_2 / psds - 1)) < 0.01
+    with pytest.raises(ValueError, match='cannot be used with average=None'):
+        psd_welch(raw, average=None, stream=True)
+    with pytest.raises(ValueError, match='requires an instance of Raw'):
+        psd_welch(EpochsArray(data[np.newaxis], raw.info), stream=True)
+
+
+@pytest.mark.parametrize('func, kwargs', [
+    (psd_array_welch, dict()),
+    (psd_array_multitaper, dict()),
+    (psd_array_multitaper, dict(adaptive=True)),
+])
+def test_psd_array_dtype(func, kwargs):
+    """Test single precision PSD computation."""
+    x = np.random.RandomState(0).randn(2, 3, 1000)
+    psds, freqs = func(x, 250., **kwargs)
+    psds_32, freqs_32 = func(x, 250., dtype='float32', **kwargs)
+    assert psds.dtype == np.float64
+    assert psds_32.dtype == np.float32
+    assert_allclose(freqs, freqs_32)
+    assert_allclose(psds_32, psds, rtol=1e-4, atol=1e-5 * psds.max())
+    with pytest.raises(ValueError, match='Invalid value for the .dtype.'):
+        func(x, 250., dtype='int64')
+
+
 def test_psd():
     """Tests the welch and multitaper PSD."""
     raw = read_raw_fif(raw_fname)
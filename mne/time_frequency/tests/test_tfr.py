@@ -16,7 +16,7 @@ from mne.utils import (_TempDir, run_tests_if_main, requires_h5py,
 from mne.time_frequency.tfr import (morlet, tfr_morlet, _make_dpss,
                                     tfr_multitaper, AverageTFR, read_tfrs,
                                     write_tfrs, combine_tfr, cwt, _compute_tfr,
-                                    EpochsTFR)
+                                    EpochsTFR, _get_fft_groups, _get_nfft)
 from mne.time_frequency import tfr_array_multitaper, tfr_array_morlet
 from mne.viz.utils import _fake_click
 from mne.tests.test_epochs import assert_metadata_equal
@@ -735,6 +735,79 @@ def test_compute_tfr_correct(method, decim):
     assert freqs[np.argmax(np.abs(tfr).mean(-1))] == f
 
 
+@pytest.mark.parametrize('mode', ('same', 'valid'))
+def test_cwt_fft_groups(mode):
+    """Test that grouping wavelets by FFT length gives the direct result."""
+    sfreq = 1000.
+    freqs = np.logspace(np.log10(3), np.log10(150), 20)
+    Ws = morlet(sfreq, freqs, n_cycles=7.)
+    X = np.random.RandomState(0).randn(2, 6000)
+    nfft = _get_nfft(Ws, X)
+    groups = _get_fft_groups(Ws, X.shape[1], nfft)
+    assert len(groups) > 1
+    assert groups[0][0] == nfft
+    assert all(g[0] < nfft for g in groups[1:])
+    assert_array_equal(np.sort(np.concatenate([g[1] for g in groups])),
+                       np.arange(len(Ws)))
+    tfr_fft = cwt(X, Ws, use_fft=True, mode=mode)
+    tfr_conv = cwt(X, Ws, use_fft=False, mode=mode)
+    assert_allclose(tfr_fft, tfr_conv, atol=1e-12 * np.abs(tfr_conv).max())
+
+
+@pytest.mark.parametrize('n_jobs', (1, 2))
+@pytest.mark.parametrize('method', (tfr_morlet, tfr_multitaper))
+def test_tfr_average_streaming(method, n_jobs):
+    """Test averaged TFRs accumulated over blocks of epochs."""
+    sfreq = 200.
+    rng = np.random.RandomState(0)
+    info = create_info(3, sfreq, 'eeg')
+    raw = mne.io.RawArray(rng.randn(3, 20000), info)
+    events = mne.make_fixed_length_events(raw, duration=1.)
+    epochs = Epochs(raw, events, tmin=0, tmax=1., baseline=None,
+                    preload=False)
+    kwargs = dict(freqs=np.array([10., 20.]), n_cycles=2., decim=2,
+                  n_jobs=n_jobs)
+    power, itc = method(epochs, **kwargs)
+    epochs.load_data()
+    power_pre, itc_pre = method(epochs, **kwargs)
+    assert power.nave == power_pre.nave == len(epochs) > 32
+    assert_allclose(power.data, power_pre.data, rtol=1e-10)
+    assert_allclose(itc.data, itc_pre.data, rtol=1e-10)
+
+    # blocks of epochs give the same result as the full array
+    data = epochs.get_data()
+    method_name = 'multitaper' if method is tfr_multitaper else 'morlet'
+    for output in ('avg_power', 'itc', 'avg_power_itc'):
+        want = _compute_tfr(data, kwargs['freqs'], sfreq, method=method_name,
+                            n_cycles=2., output=output)
+        got = _compute_tfr((d for d in np.array_split(data, 5)),
+                           kwargs['freqs'], sfreq, method=method_name,
+                           n_cycles=2., output=output, n_jobs=n_jobs)
+        assert_allclose(got, want, rtol=1e-10)
+    with pytest.raises(ValueError, match='averaged outputs'):
+        _compute_tfr((d for d in data[np.newaxis]), kwargs['freqs'], sfreq,
+                     output='power')
+
+
+@pytest.mark.parametrize('func', (tfr_array_morlet, tfr_array_multitaper))
+@pytest.mark.parametrize('output, dtype', [
+    ('complex', np.complex64),
+    ('power', np.float32),
+    ('avg_power_itc', np.complex64),
+])
+def test_tfr_array_dtype(func, output, dtype):
+    """Test single precision TFR computation."""
+    data = np.random.RandomState(0).randn(4, 2, 500)
+    kwargs = dict(freqs=np.array([10., 20.]), n_cycles=3., output=output)
+    tfr = func(data, 250., **kwargs)
+    tfr_32 = func(data, 250., dtype='float32', **kwargs)
+    assert tfr_32.dtype == dtype
+    assert_allclose(tfr_32, tfr, atol=1e-5 * np.abs(tfr).max())
+    # complex types give the precision too
+    tfr_32 = func(data, 250., dtype=np.complex64, **kwargs)
+    assert tfr_32.dtype == dtype
+
+
 @requires_pandas
 def test_getitem_epochsTFR():
     """Test GetEpochsMixin in the context of EpochsTFR."""
@@ -11,6 +11,7 @@ Morlet code inspired by Matlab code from Sheraz Khan & Brainstorm & SPM
 
 from copy import deepcopy
 from functools import partial
+from itertools import chain
 from math import sqrt
 
 import numpy as np
@@ -26,7 +27,7 @@ from ..utils import (logger, verbose, _time_mask, _freq_mask, check_fname,
                      sizeof_fmt, GetEpochsMixin, _prepare_read_metadata,
                      fill_doc, _prepare_write_metadata, _check_event_id,
                      _gen_events, SizeMixin, _is_numeric, _check_option,
-                     _validate_type)
+                     _validate_type, _check_compute_dtype)
 from ..channels.channels import ContainsMixin, UpdateChannelsMixin
 from ..channels.layout import _merge_ch_data, _pair_grad_sensors
 from ..io.pick import (pick_info, _picks_to_idx, channel_type, _pick_inst,
@@ -190,7 +191,51 @@ def _get_nfft(wavelets, X, use_fft=True, check=True):
     return nfft
 
 
-def _cwt_gen(X, Ws, *, fsize=0, mode="same", decim=1, use_fft=True):
+def _get_fft_groups(Ws, n_times, fsize):
+    """Group wavelets by length so that each group uses its own FFT length.
+
+    Using the FFT length of the longest (lowest frequency) wavelet for all
+    wavelets wastes most of the work for the short ones. Wavelets are
+    visited from the longest to the shortest, and a new group (which costs
+    one extra FFT of the signal) is started whenever the optimal FFT length
+    of a wavelet is at least a quarter shorter than the one of its group.
+
+    Parameters
+    ----------
+    Ws : list of array
+        Wavelets time series.
+    n_times : int
+        The number of time points of the signals.
+    fsize : int
+        The FFT length suited to the longest wavelet (as returned by
+        :func:`_get_nfft`). No group uses a longer one.
+
+    Returns
+    -------
+    groups : list of tuple
+        Each entry is ``(nfft, idx)``, where ``idx`` are the indices of the
+        wavelets that are convolved using an FFT of length ``nfft``.
+    """
+    order = np.argsort([-W.size for W in Ws], kind='stable')
+    groups = list()
+    for ii in order:
+        nfft = min(next_fast_len(n_times + Ws[ii].size - 1), fsize)
+        if len(groups) == 0 or 4 * nfft <= 3 * groups[-1][0]:
+            groups.append((nfft, list()))
+        groups[-1][1].append(ii)
+    return [(nfft, np.array(idx)) for nfft, idx in groups]
+
+
+def _fft_convolve_groups(x, groups, fft_Ws):
+    """Convolve a signal with each group of wavelets, one FFT per group."""
+    for (nfft, idx), fft_W in zip(groups, fft_Ws):
+        fft_x = fft(x, nfft)
+        for ii, this_fft_W in zip(idx, fft_W):
+            yield ii, ifft(fft_x * this_fft_W)
+
+
+def _cwt_gen(X, Ws, *, fsize=0, mode="same", decim=1, use_fft=True,
+             dtype=np.float64):
     """Compute cwt with fft based convolutions or temporal convolutions.
 
     Parameters
@@ -200,7 +245,8 @@ def _cwt_gen(X, Ws, *, fsize=0, mode="same", decim=1, use_fft=True):
     Ws : list of array
         Wavelets time series.
     fsize : int
-        FFT length.
+        FFT length of the longest wavelet. Shorter wavelets are grouped by
+        length and use shorter FFTs (see :func:`_get_fft_groups`).
     mode : {'full', 'valid', 'same'}
         See numpy.convolve.
     decim : int | slice, default 1
@@ -213,6 +259,9 @@ def _cwt_gen(X, Ws, *, fsize=0, mode="same", decim=1, use_fft=True):
 
     use_fft : bool, default True
         Use the FFT for convolutions or not.
+    dtype : dtype, default np.float64
+        The real precision of the computations, the output has the matching
+        complex type.
 
     Returns
     -------
@@ -221,31 +270,40 @@ def _cwt_gen(X, Ws, *, fsize=0, mode="same", decim=1, use_fft=True):
     """
     _check_option('mode', mode, ['same', 'valid', 'full'])
     decim = _check_decim(decim)
+    cdtype = np.result_type(dtype, np.complex64)
     X = np.asarray(X)
+    X = X.astype(cdtype if np.iscomplexobj(X) else dtype, copy=False)
+    Ws = [W.astype(cdtype, copy=False) for W in Ws]
 
     # Precompute wavelets for given frequency range to save time
     _, n_times = X.shape
     n_times_out = X[:, decim].shape[1]
     n_freqs = len(Ws)
 
-    # precompute FFTs of Ws
+    # precompute FFTs of Ws, one array per group of similar length
     if use_fft:
-        fft_Ws = np.empty((n_freqs, fsize), dtype=np.complex128)
-        for i, W in enumerate(Ws):
-            fft_Ws[i] = fft(W, fsize)
+        groups = _get_fft_groups(Ws, n_times, fsize)
+        fft_Ws = list()
+        for nfft, idx in groups:
+            fft_W = np.empty((len(idx), nfft), dtype=cdtype)
+            for jj, ii in enumerate(idx):
+                fft_W[jj] = fft(Ws[ii], nfft)
+            fft_Ws.append(fft_W)
 
     # Make generator looping across signals
-    tfr = np.zeros((n_freqs, n_times_out), dtype=np.complex128)
+    tfr = np.zeros((n_freqs, n_times_out), dtype=cdtype)
     for x in X:
         if use_fft:
-            fft_x = fft(x, fsize)
+            rets = _fft_convolve_groups(x, groups, fft_Ws)
+        else:
+            rets = ((ii, np.convolve(x, W, mode=mode))
+                    for ii, W in enumerate(Ws))
 
         # Loop across wavelets
-        for ii, W in enumerate(Ws):
+        for ii, ret in rets:
+            W = Ws[ii]
             if use_fft:
-                ret = ifft(fft_x * fft_Ws[ii])[:n_times + W.size - 1]
-            else:
-                ret = np.convolve(x, W, mode=mode)
+                ret = ret[:n_times + W.size - 1]
 
             # Center and decimate decomposition
             if mode == 'valid':
@@ -274,13 +332,17 @@ def _cwt_gen(X, Ws, *, fsize=0, mode="same", decim=1, use_fft=True):
 def _compute_tfr(epoch_data, freqs, sfreq=1.0, method='morlet',
                  n_cycles=7.0, zero_mean=None, time_bandwidth=None,
                  use_fft=True, decim=1, output='complex', n_jobs=1,
-                 verbose=None):
+                 dtype=np.float64, verbose=None):
     """Compute time-frequency transforms.
 
     Parameters
     ----------
-    epoch_data : array of shape (n_epochs, n_channels, n_times)
-        The epochs.
+    epoch_data : array of shape (n_epochs, n_channels, n_times) | iterable
+        The epochs. For the averaged outputs (``'avg_power'``, ``'itc'`` and
+        ``'avg_power_itc'``), this can also be an iterable of arrays of
+        shape (n_block_epochs, n_channels, n_times), which are then
+        accumulated one block at a time so that all epochs never have to
+        be in memory at once.
     freqs : array-like of floats, shape (n_freqs)
         The frequencies.
     sfreq : float | int, default 1.0
@@ -324,7 +386,9 @@ def _compute_tfr(epoch_data, freqs, sfreq=1.0, method='morlet',
 
     %(n_jobs)s
         The number of epochs to process at the same time. The parallelization
-        is implemented across channels.
+        is implemented across channels, and also across epochs for the
+        averaged outputs.
+    %(dtype-spectral)s
     %(verbose)s
 
     Returns
@@ -337,7 +401,17 @@ def _compute_tfr(epoch_data, freqs, sfreq=1.0, method='morlet',
         imaginary values code for the 'itc': out = avg_power + i * itc
     """
     # Check data
-    epoch_data = np.asarray(epoch_data)
+    if isinstance(epoch_data, (np.ndarray, list, tuple)):
+        epoch_blocks = None
+        epoch_data = np.asarray(epoch_data)
+    else:
+        if output not in ('avg_power', 'itc', 'avg_power_itc'):
+            raise ValueError('epoch_data can only be an iterable of blocks '
+                             'of epochs for averaged outputs, got output=%r'
+                             % (output,))
+        epoch_blocks = iter(epoch_data)
+        epoch_data = np.asarray(next(epoch_blocks))
+        epoch_blocks = chain([epoch_data], epoch_blocks)
     if epoch_data.ndim != 3:
         raise ValueError('epoch_data must be of shape (n_epochs, n_chans, '
                          'n_times), got %s' % (epoch_data.shape,))
@@ -348,6 +422,7 @@ def _compute_tfr(epoch_data, freqs, sfreq=1.0, method='morlet',
                          time_bandwidth, use_fft, decim, output)
 
     decim = _check_decim(decim)
+    dtype = _check_compute_dtype(dtype)
     if (freqs > sfreq / 2.).any():
         raise ValueError('Cannot compute freq above Nyquist freq of the data '
                          '(%0.1f Hz), got %0.1f Hz'
@@ -368,39 +443,141 @@ def _compute_tfr(epoch_data, freqs, sfreq=1.0, method='morlet',
         raise ValueError('At least one of the wavelets is longer than the '
                          'signal. Use a longer signal or shorter wavelets.')
 
+    # Averaged outputs are accumulated across blocks of epochs
+    all_Ws = sum([list(W) for W in Ws], list())
+    _get_nfft(all_Ws, epoch_data, use_fft)
+    if output in ('avg_power', 'itc', 'avg_power_itc'):
+        if epoch_blocks is None:
+            epoch_blocks = [epoch_data]
+        return _compute_tfr_avg(epoch_blocks, Ws, output, use_fft, decim,
+                                n_jobs, dtype)
+
     # Initialize output
     n_freqs = len(freqs)
     n_epochs, n_chans, n_times = epoch_data[:, :, decim].shape
-    if output in ('power', 'phase', 'avg_power', 'itc'):
-        dtype = np.float64
-    elif output in ('complex', 'avg_power_itc'):
-        # avg_power_itc is stored as power + 1i * itc to keep a
-        # simple dimensionality
-        dtype = np.complex128
-
-    if ('avg_' in output) or ('itc' in output):
-        out = np.empty((n_chans, n_freqs, n_times), dtype)
+    if output == 'complex':
+        out_dtype = np.result_type(dtype, np.complex64)
     else:
-        out = np.empty((n_chans, n_epochs, n_freqs, n_times), dtype)
+        out_dtype = dtype
+    out = np.empty((n_chans, n_epochs, n_freqs, n_times), out_dtype)
 
     # Parallel computation
-    all_Ws = sum([list(W) for W in Ws], list())
-    _get_nfft(all_Ws, epoch_data, use_fft)
     parallel, my_cwt, _ = parallel_func(_time_frequency_loop, n_jobs)
 
     # Parallelization is applied across channels.
     tfrs = parallel(
-        my_cwt(channel, Ws, output, use_fft, 'same', decim)
+        my_cwt(channel, Ws, output, use_fft, 'same', decim, dtype)
         for channel in epoch_data.transpose(1, 0, 2))
 
     # FIXME: to avoid overheads we should use np.array_split()
     for channel_idx, tfr in enumerate(tfrs):
         out[channel_idx] = tfr
 
-    if ('avg_' not in output) and ('itc' not in output):
-        # This is to enforce that the first dimension is for epochs
-        out = out.transpose(1, 0, 2, 3)
-    return out
+    # This is to enforce that the first dimension is for epochs
+    return out.transpose(1, 0, 2, 3)
+
+
+def _compute_tfr_avg(epoch_blocks, Ws, output, use_fft, decim, n_jobs,
+                     dtype=np.float64):
+    """Aux. function to _compute_tfr to accumulate averaged outputs.
+
+    Blocks of epochs are consumed one at a time, and each block is split
+    across channels and epochs so that ``n_jobs`` workers are kept busy
+    even with few channels. Only running sums of power and of unit
+    phasors (per taper, for the ITC) are kept, in the precision given by
+    ``dtype``.
+    """
+    parallel, my_sum, n_jobs = parallel_func(_tfr_sum, n_jobs)
+    n_tapers, n_freqs = len(Ws), len(Ws[0])
+    cdtype = np.result_type(dtype, np.complex64)
+    power = plf = None
+    n_epochs = 0
+    for X in epoch_blocks:
+        X = np.asarray(X)
+        n_block, n_chans, n_times = X[:, :, decim].shape
+        if n_block == 0:
+            continue
+        if n_epochs == 0:
+            shape = (n_chans, n_freqs, n_times)
+            if output != 'itc':
+                power = np.zeros(shape, dtype)
+            if output != 'avg_power':
+                plf = np.zeros((n_tapers,) + shape, cdtype)
+        n_ch_split = min(n_jobs, n_chans)
+        n_ep_split = min(max(n_jobs // n_ch_split, 1), n_block)
+        splits = [(ch_sel, ep_sel)
+                  for ch_sel in np.array_split(np.arange(n_chans), n_ch_split)
+                  for ep_sel in np.array_split(np.arange(n_block), n_ep_split)]
+        sums = parallel(my_sum(X[ep_sel][:, ch_sel], Ws, output, use_fft,
+                               decim, dtype) for ch_sel, ep_sel in splits)
+        for (ch_sel, _), (this_power, this_plf) in zip(splits, sums):
+            if power is not None:
+                power[ch_sel] += this_power
+            if plf is not None:
+                plf[:, ch_sel] += this_plf
+        n_epochs += n_block
+    if n_epochs == 0:
+        raise ValueError('epoch_data must contain at least one epoch')
+
+    # Normalization by number of epochs and tapers
+    if plf is not None:
+        itc = np.abs(plf).sum(axis=0)
+        itc /= n_epochs * n_tapers
+    if power is not None:
+        power /= n_epochs * n_tapers
+    if output == 'avg_power':
+        return power
+    elif output == 'itc':
+        return itc
+    else:
+        return power + 1j * itc
+
+
+def _tfr_sum(X, Ws, output, use_fft, decim, dtype=np.float64):
+    """Aux. function to _compute_tfr_avg.
+
+    Parameters
+    ----------
+    X : array, shape (n_epochs, n_chans, n_times)
+        The block of epochs.
+    Ws : list, shape (n_tapers, n_wavelets, n_times)
+        The wavelets.
+    output : str
+        The averaged output ('avg_power', 'itc' or 'avg_power_itc').
+    use_fft : bool
+        Use the FFT for convolutions or not.
+    decim : slice
+        The decimation slice: e.g. power[:, decim]
+    dtype : dtype
+        The real precision of the computations and sums.
+
+    Returns
+    -------
+    power : array, shape (n_chans, n_freqs, n_times) | None
+        The power summed across epochs and tapers (None if output is
+        'itc').
+    plf : array, shape (n_tapers, n_chans, n_freqs, n_times) | None
+        The unit phasors summed across epochs (None if output is
+        'avg_power').
+    """
+    decim = _check_decim(decim)
+    n_epochs, n_chans, n_times = X[:, :, decim].shape
+    shape = (n_chans, len(Ws[0]), n_times)
+    power = plf = None
+    if output != 'itc':
+        power = np.zeros(shape, dtype)
+    if output != 'avg_power':
+        plf = np.zeros((len(Ws),) + shape, np.result_type(dtype, np.complex64))
+    for ci in range(n_chans):
+        for ti, W in enumerate(Ws):
+            nfft = _get_nfft(W, X, use_fft, check=False)
+            for tfr in _cwt_gen(X[:, ci], W, fsize=nfft, decim=decim,
+                                use_fft=use_fft, dtype=dtype):
+                if power is not None:
+                    power[ci] += (tfr * tfr.conj()).real
+                if plf is not None:
+                    plf[ti, ci] += tfr / np.abs(tfr)
+    return power, plf
 
 
 def _check_tfr_param(freqs, sfreq, method, zero_mean, n_cycles,
@@ -472,7 +649,8 @@ def _check_tfr_param(freqs, sfreq, method, zero_mean, n_cycles,
     return freqs, sfreq, zero_mean, n_cycles, time_bandwidth, decim
 
 
-def _time_frequency_loop(X, Ws, output, use_fft, mode, decim):
+def _time_frequency_loop(X, Ws, output, use_fft, mode, decim,
+                         dtype=np.float64):
     """Aux. function to _compute_tfr.
 
     Loops time-frequency transform across wavelets and epochs.
@@ -499,11 +677,14 @@ def _time_frequency_loop(X, Ws, output, use_fft, mode, decim):
         See numpy.convolve.
     decim : slice
         The decimation slice: e.g. power[:, decim]
+    dtype : dtype
+        The real precision of the computations.
     """
     # Set output type
-    dtype = np.float64
+    real_dtype = dtype
+    cdtype = np.result_type(dtype, np.complex64)
     if output in ['complex', 'avg_power_itc']:
-        dtype = np.complex128
+        dtype = cdtype
 
     # Init outputs
     decim = _check_decim(decim)
@@ -518,12 +699,12 @@ def _time_frequency_loop(X, Ws, output, use_fft, mode, decim):
     for W in Ws:
         # No need to check here, it's done earlier (outside parallel part)
         nfft = _get_nfft(W, X, use_fft, check=False)
-        coefs = _cwt_gen(
-            X, W, fsize=nfft, mode=mode, decim=decim, use_fft=use_fft)
+        coefs = _cwt_gen(X, W, fsize=nfft, mode=mode, decim=decim,
+                         use_fft=use_fft, dtype=real_dtype)
 
         # Inter-trial phase locking is apparently computed per taper...
         if 'itc' in output:
-            plf = np.zeros((n_freqs, n_times), dtype=np.complex128)
+            plf = np.zeros((n_freqs, n_times), dtype=cdtype)
 
         # Loop across epochs
         for epoch_idx, tfr in enumerate(coefs):
@@ -599,13 +780,14 @@ def cwt(X, Ws, use_fft=True, mode='same', decim=1):
     return _cwt_array(X, Ws, nfft, mode, decim, use_fft)
 
 
-def _cwt_array(X, Ws, nfft, mode, decim, use_fft):
+def _cwt_array(X, Ws, nfft, mode, decim, use_fft, dtype=np.float64):
     decim = _check_decim(decim)
-    coefs = _cwt_gen(
-        X, Ws, fsize=nfft, mode=mode, decim=decim, use_fft=use_fft)
+    coefs = _cwt_gen(X, Ws, fsize=nfft, mode=mode, decim=decim,
+                     use_fft=use_fft, dtype=dtype)
 
     n_signals, n_times = X[:, decim].shape
-    tfrs = np.empty((n_signals, len(Ws), n_times), dtype=np.complex128)
+    tfrs = np.empty((n_signals, len(Ws), n_times),
+                    dtype=np.result_type(dtype, np.complex64))
     for k, tfr in enumerate(coefs):
         tfrs[k] = tfr
 
@@ -617,10 +799,18 @@ def _tfr_aux(method, inst, freqs, decim, return_itc, picks, average,
     from ..epochs import BaseEpochs
     """Help reduce redundancy between tfr_morlet and tfr_multitaper."""
     decim = _check_decim(decim)
-    data = _get_data(inst, return_itc)
     info = inst.info.copy()  # make a copy as sfreq can be altered
-
-    info, data = _prepare_picks(info, data, picks, axis=1)
+    if average and isinstance(inst, BaseEpochs) and not inst.preload:
+        # accumulate blocks of epochs instead of loading all of them
+        picks = _picks_to_idx(info, picks, exclude='bads')
+        info = pick_info(info, picks)
+        inst.drop_bad()
+        data = _iter_epochs_blocks(inst, picks)
+        nave = len(inst)
+    else:
+        data = _get_data(inst, return_itc)
+        info, data = _prepare_picks(info, data, picks, axis=1)
+        nave = len(data)
     del picks
 
     if average:
@@ -646,7 +836,6 @@ def _tfr_aux(method, inst, freqs, decim, return_itc, picks, average,
             power, itc = out.real, out.imag
         else:
             power = out
-        nave = len(data)
         out = AverageTFR(info, power, times, freqs, nave,
                          method='%s-power' % method)
         if return_itc:
@@ -739,7 +928,7 @@ def tfr_morlet(inst, freqs, n_cycles, use_fft=False, return_itc=True, decim=1,
 @verbose
 def tfr_array_morlet(epoch_data, sfreq, freqs, n_cycles=7.0,
                      zero_mean=False, use_fft=True, decim=1, output='complex',
-                     n_jobs=1, verbose=None):
+                     n_jobs=1, dtype='float64', verbose=None):
     """Compute Time-Frequency Representation (TFR) using Morlet wavelets.
 
     Same computation as `~mne.time_frequency.tfr_morlet`, but operates on
@@ -780,7 +969,11 @@ def tfr_array_morlet(epoch_data, sfreq, freqs, n_cycles=7.0,
           coherence across trials.
     %(n_jobs)s
         The number of epochs to process at the same time. The parallelization
-        is implemented across channels. Default 1.
+        is implemented across channels (and across epochs for the averaged
+        outputs). Default 1.
+    %(dtype-spectral)s
+
+        .. versionadded:: 0.23
     %(verbose)s
 
     Returns
@@ -808,7 +1001,7 @@ def tfr_array_morlet(epoch_data, sfreq, freqs, n_cycles=7.0,
                         sfreq=sfreq, method='morlet', n_cycles=n_cycles,
                         zero_mean=zero_mean, time_bandwidth=None,
                         use_fft=use_fft, decim=decim, output=output,
-                        n_jobs=n_jobs, verbose=verbose)
+                        n_jobs=n_jobs, dtype=dtype, verbose=verbose)
 
 
 @verbose
@@ -2183,6 +2376,13 @@ def _get_data(inst, return_itc):
     return data
 
 
+def _iter_epochs_blocks(epochs, picks, n_block=32):
+    """Yield the data of (bad-dropped) epochs in blocks of n_block epochs."""
+    for start in range(0, len(epochs), n_block):
+        yield epochs.get_data(picks=picks,
+                              item=slice(start, start + n_block))
+
+
 def _prepare_picks(info, data, picks, axis):
     """Prepare the picks."""
     picks = _picks_to_idx(info, picks, exclude='bads')
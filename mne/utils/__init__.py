@@ -14,6 +14,7 @@ from .check import (check_fname, check_version, check_random_state,
                     _validate_type, _check_info_inv, _check_pylsl_installed,
                     _check_channels_spatial_filter, _check_one_ch_type,
                     _check_rank, _check_option, _check_depth, _check_combine,
+                    _check_compute_dtype,
                     _check_path_like, _check_src_normal, _check_stc_units,
                     _check_pyqt5_version, _check_sphere, _check_time_format,
                     _check_freesurfer_home, _suggest, _require_version,
@@ -52,6 +53,7 @@ from ._testing import (run_tests_if_main, run_command_if_main,
                        _close_event)
 from .numerics import (hashfunc, _compute_row_norms,
                        _reg_pinv, random_permutation, _reject_data_segments,
+                       _get_data_segments,
                        compute_corr, _get_inst_data, array_split_idx,
                        sum_squared, split_list, _gen_events, create_slices,
                        _time_mask, _freq_mask, grand_average, object_diff,
@@ -608,6 +608,23 @@ def _check_combine(mode, valid=('mean', 'median', 'std')):
     return fun
 
 
+def _check_compute_dtype(dtype):
+    """Check the precision used for spectral computations.
+
+    Both real and complex types are accepted, the real counterpart is
+    returned (complex results use ``np.result_type(dtype, np.complex64)``).
+    """
+    try:
+        dtype = np.dtype(dtype)
+    except TypeError:
+        raise TypeError('dtype must be a NumPy float or complex type, got '
+                        '%r' % (dtype,))
+    if dtype.kind == 'c':
+        dtype = np.finfo(dtype).dtype
+    _check_option('dtype', dtype.name, ('float32', 'float64'))
+    return dtype
+
+
 def _check_src_normal(pick_ori, src):
     from ..source_space import SourceSpaces
     _validate_type(src, SourceSpaces, 'src')
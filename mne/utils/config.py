@@ -108,6 +108,7 @@ known_config_types = (
     'MNE_DATASETS_PHANTOM_4DBTI_PATH',
     'MNE_DATASETS_LIMO_PATH',
     'MNE_DATASETS_REFMEG_NOISE_PATH',
+    'MNE_DPSS_CACHE_DIR',
     'MNE_FORCE_SERIAL',
     'MNE_KIT2FIFF_STIM_CHANNELS',
     'MNE_KIT2FIFF_STIM_CHANNEL_CODING',
@@ -586,6 +586,14 @@ docdict['window-psd'] = """
 window : str | float | tuple
     Windowing function to use. See :func:`scipy.signal.get_window`.
 """
+docdict['dtype-spectral'] = """
+dtype : str | dtype
+    The precision used for the FFTs and the accumulations, either
+    ``'float64'`` (default) or ``'float32'``. Complex intermediate values
+    use the matching complex type (``complex128`` or ``complex64``), and the
+    output has this precision. Single precision halves memory use at the
+    expense of accuracy.
+"""
 docdict['decim'] = """
 decim : int
     Factor by which to subsample the data.
@@ -1776,13 +1784,28 @@ check_disjoint : bool
     sets before clustering. This may lead to faster clustering, especially if
     the second dimension of ``X`` (usually the "time" dimension) is large.
 """
+docdict['clust_stop'] = """
+stop_alpha : float | None
+    If a float, stop permuting as soon as the p-value of each cluster is
+    confidently (at the 99.9% level) above or below this alpha level, which
+    can save many permutations when the clusters are clearly (non-)significant.
+    The number of permutations actually used is ``len(H0) - 1``. If None
+    (default), all permutations are run.
+
+    .. versionadded:: 0.23
+"""
 docdict['clust_buffer'] = """
 buffer_size : int | None
     Block size to use when computing test statistics. This can significantly
     reduce memory usage when n_jobs > 1 and memory sharing between processes is
     enabled (see :func:`mne.set_cache_dir`), because ``X`` will be shared
     between processes and each process only needs to allocate space for a small
-    block of locations at a time.
+    block of locations at a time. The built-in ``stat_fun`` functions
+    (:func:`mne.stats.ttest_1samp_no_p` and :func:`mne.stats.f_oneway`) never
+    copy ``X`` during the permutations, so this has no effect on them. Other
+    functions are passed views of ``X`` (permuted or sign-flipped in place)
+    unless ``X`` is read-only, e.g. a memory-mapped array shared between
+    processes, in which case the block is copied to a buffer.
 """
 
 # DataFrames
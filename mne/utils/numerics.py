@@ -204,16 +204,30 @@ def _gen_events(n_epochs):
 
 def _reject_data_segments(data, reject, flat, decim, info, tstep):
     """Reject data segments using peak-to-peak amplitude."""
+    keep, drop_inds = _get_data_segments(data, reject, flat, decim, info,
+                                         tstep)
+    data = data[:, keep]
+    if not data.any():
+        raise RuntimeError('No clean segment found. Please '
+                           'consider updating your rejection '
+                           'thresholds.')
+    return data, drop_inds
+
+
+def _get_data_segments(data, reject, flat, decim, info, tstep):
+    """Find good and bad data segments using peak-to-peak amplitude.
+
+    Returns a mask of the samples in good segments (a trailing incomplete
+    segment is neither good nor bad) and the bounds of the bad segments.
+    """
     from ..epochs import _is_good
     from ..io.pick import channel_indices_by_type
 
-    data_clean = np.empty_like(data)
+    keep = np.zeros(data.shape[1], bool)
     idx_by_type = channel_indices_by_type(info)
     step = int(ceil(tstep * info['sfreq']))
     if decim is not None:
         step = int(ceil(step / float(decim)))
-    this_start = 0
-    this_stop = 0
     drop_inds = []
     for first in range(0, data.shape[1], step):
         last = first + step
@@ -222,18 +236,11 @@ def _reject_data_segments(data, reject, flat, decim, info, tstep):
             break  # end of the time segment
         if _is_good(data_buffer, info['ch_names'], idx_by_type, reject,
                     flat, ignore_chs=info['bads']):
-            this_stop = this_start + data_buffer.shape[1]
-            data_clean[:, this_start:this_stop] = data_buffer
-            this_start += data_buffer.shape[1]
+            keep[first:last] = True
         else:
             logger.info("Artifact detected in [%d, %d]" % (first, last))
             drop_inds.append((first, last))
-    data = data_clean[:, :this_stop]
-    if not data.any():
-        raise RuntimeError('No clean segment found. Please '
-                           'consider updating your rejection '
-                           'thresholds.')
-    return data, drop_inds
+    return keep, drop_inds
 
 
 def _get_inst_data(inst):